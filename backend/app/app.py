@@ -1,3 +1,4 @@
+import asyncio
 import base64
 import json
 import logging
@@ -7,18 +8,45 @@ from typing import Optional, List
 import requests
 from fastapi import FastAPI, HTTPException, APIRouter, Response, Query, Request
 from fastapi import Request as FastAPIRequest
+from fastapi.responses import StreamingResponse
 from openai import OpenAI
 from pydantic import BaseModel
 from starlette.middleware.cors import CORSMiddleware as cors
 
 import config
+from db.aggregates import reconcile_aggregates
+from db.bulk import import_places, export_csv, export_xlsx, detect_format, ImportFormatError
+from db.bulk import EXPORT_QUERIES, PLACE_IMPORT_MAX_SIZE, CSV, XLSX
 from db.admin import create_admin, login_admin, update_user_rating, verify_place, ban_user, delete_review_admin
 from db.map import get_all_places, add_place, get_all_types, get_place
-from db.map import search_places, update_place
-from db.user import create_user, login_user, add_review, get_all_users, get_user_by_id, delete_review, get_leaderboard
-from db.user import set_review_rank, add_follow, get_followed_reviews, update_user
-from s3_client import upload_photo
-
+from db.executor import shutdown_executor
+from db.feed import get_feed, trim_feeds, FEED_PAGE_SIZE, FEED_TRIM_INTERVAL
+from db.leaderboard import leaderboard, ensure_leaderboard, load_leaderboard
+from db.map import search_places, update_place, nearby_places, get_places_in_bbox, get_places_in_tile, place_cache
+from db.map import invalidate_place_cache
+from db.moderation import apply_moderation_verdicts, claim_pending_reviews, release_pending_reviews
+from db.moderation import get_cached_verdicts, store_verdicts, prune_verdicts
+from db.pagination import decode_id_cursor, next_cursor
+from db.photos import find_photo_object, register_photo_object, reconcile_photo_refs, collect_orphan_photos
+from db.photos import track_photo_upload, collect_abandoned_uploads
+from db.pool import close_pool, pool_stats
+from db.ratings import compact_rating_events, reconcile_ratings
+from db.user import create_user, login_user, add_review, get_all_users, get_user_by_id, delete_review
+from db.user import set_review_rank, add_follow, update_user
+from moderation.classifier import LLMClassifier, FakeClassifier
+from moderation.pipeline import ModerationPipeline
+from moderation.prefilter import Prefilter
+from moderation.verdicts import VerdictCache, IMAGE_KIND, bytes_hash
+from logs import setup_logging
+from metrics import RequestMetricsMiddleware, REGISTRY, PROMETHEUS_CONTENT_TYPE
+from images import process_photo, shutdown_image_pool, thumbnail_url, photo_variant_names, ImageDecodeError
+from s3_client import upload_photo_stream, PHOTO_MAX_UPLOAD_SIZE, public_url, delete_object, delete_objects
+from s3_client import presign_photo_upload, verify_uploaded_photo
+from s3_client import EmptyUpload, UploadTooLarge, UnsupportedImage, MissingUpload
+from s3_client import reconcile_bucket, close_minio_client
+from tiles import tile_cache, encode_tile, TILE_MAX_ZOOM
+
+setup_logging()
 logger = logging.getLogger(__name__)
 
 app = FastAPI(root_path="/api")
@@ -44,7 +72,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing"],
 )
+# Добавлен последним — снаружи CORS, поэтому замеряет запрос целиком
+app.add_middleware(RequestMetricsMiddleware)
 
 OPENROUTER_API_KEY = config.OPENROUTER_API_KEY
 
@@ -54,38 +85,68 @@ client = OpenAI(
 )
 
 
-def classify_toxic_review(text: str) -> int:
-    if not text or not text.strip():
-        return 0
+if getattr(config, 'MODERATION_CLASSIFIER', "llm") == "fake":
+    review_classifier = FakeClassifier()
+else:
+    review_classifier = LLMClassifier(client, max_batch=getattr(config, 'MODERATION_BATCH_SIZE', 10))
+
+verdict_cache = VerdictCache(
+    load=get_cached_verdicts,
+    store=store_verdicts,
+    prune=prune_verdicts,
+    ttl=getattr(config, 'MODERATION_VERDICT_TTL', 30 * 24 * 3600),
+    max_entries=getattr(config, 'MODERATION_VERDICT_MAX_ENTRIES', 100000),
+    memory_entries=getattr(config, 'MODERATION_VERDICT_MEMORY_ENTRIES', 10000),
+)
 
-    system_prompt = (
-        "Ты классификатор токсичных сообщений.\n"
-        "Определи, является ли текст токсичным.\n\n"
-        "Токсичный текст — это оскорбления, угрозы, грубый мат, унижение личности "
-        "или групп людей, явная агрессия и ненависть.\n\n"
-        "Если текст токсичный — ответь числом 1.\n"
-        "Если текст НЕ токсичный — ответь числом 0.\n"
-        "Ответь ТОЛЬКО одной цифрой 0 или 1, без комментариев."
+review_prefilter = None
+# Включать после оценки на отложенной выборке (python -m moderation.evaluate_prefilter)
+if getattr(config, 'MODERATION_PREFILTER', False):
+    review_prefilter = Prefilter(
+        clean_threshold=getattr(config, 'MODERATION_PREFILTER_CLEAN_THRESHOLD', 0.15),
     )
 
-    user_prompt = f'Текст отзыва: """{text}"""'
+moderation_pipeline = ModerationPipeline(
+    review_classifier,
+    apply_verdicts=apply_moderation_verdicts,
+    load_pending=claim_pending_reviews,
+    release_pending=release_pending_reviews,
+    batch_size=getattr(config, 'MODERATION_BATCH_SIZE', 10),
+    batch_wait=getattr(config, 'MODERATION_BATCH_WAIT', 0.5),
+    concurrency=getattr(config, 'MODERATION_CONCURRENCY', 2),
+    max_retries=getattr(config, 'MODERATION_MAX_RETRIES', 3),
+    retry_backoff=getattr(config, 'MODERATION_RETRY_BACKOFF', 1.0),
+    resweep_interval=getattr(config, 'MODERATION_RESWEEP_INTERVAL', 300.0),
+    verdict_cache=verdict_cache,
+    prefilter=review_prefilter,
+)
 
-    completion = client.chat.completions.create(
-        model="openai/gpt-4.1-nano",
-        temperature=0,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
-    )
 
-    content = (completion.choices[0].message.content or "").strip()
+def parse_cursor(after: Optional[str]) -> Optional[int]:
+    try:
+        return decode_id_cursor(after)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 
-    if content.startswith("1"):
-        return 1
-    if content.startswith("0"):
-        return 0
-    return 0
+def set_next_cursor(response: Response, items: list, limit: Optional[int], key: str = "id"):
+    cursor = next_cursor(items, limit, key)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+
+
+def review_thumbnails(reviews: list) -> list:
+    for review in reviews:
+        review["review_photos"] = [thumbnail_url(url) for url in review.get("review_photos") or []]
+    return reviews
+
+
+def place_thumbnails(places: list) -> list:
+    """Списки отдают превью вместо полноразмерных фото"""
+    for place in places:
+        place["photos"] = [thumbnail_url(url) for url in place.get("photos") or []]
+        review_thumbnails(place.get("reviews") or [])
+    return places
 
 
 @app.options("/{path:path}")
@@ -168,6 +229,7 @@ class placeResponseData(BaseModel):
     rating: Optional[int] = None
     sport_type: Optional[str] = None
     distance_to_center: Optional[float] = None
+    distance: Optional[float] = None
     is_moderated: Optional[bool] = None
     review_rank: Optional[float] = None
     products: list[productData] = []
@@ -179,14 +241,17 @@ class placeResponseData(BaseModel):
 
 @place_router.get("/", response_model=List[placeResponseData])
 async def get_all_points_h(
-        limit: Optional[int] = Query(None),
-        offset: Optional[int] = Query(None),
-        page: Optional[int] = Query(None)
+        response: Response,
+        limit: Optional[int] = Query(None, ge=1),
+        offset: Optional[int] = Query(None, ge=0),
+        page: Optional[int] = Query(None, ge=1),
+        after: Optional[str] = Query(None)
 ):
-    all_points = await get_all_places(limit=limit, offset=offset, page=page)
+    all_points = await get_all_places(limit=limit, offset=offset, page=page, after=parse_cursor(after))
     if not all_points:
         raise HTTPException(status_code=418, detail="i am a teapot ;)")
-    return all_points
+    set_next_cursor(response, all_points, limit)
+    return place_thumbnails(all_points)
 
 
 @place_router.get("/point/{id}")
@@ -226,6 +291,7 @@ async def change_place_h(id: int, data: placeData):
 
 @place_router.get("/search", response_model=List[placeResponseData])
 async def search_places_h(
+        response: Response,
         place_type: Optional[int] = Query(None),
         is_alcohol: Optional[bool] = Query(None),
         is_health: Optional[bool] = Query(None),
@@ -239,9 +305,10 @@ async def search_places_h(
         need_products: Optional[bool] = Query(None),
         need_equipment: Optional[bool] = Query(None),
         need_ads: Optional[bool] = Query(None),
-        limit: Optional[int] = Query(None),
-        offset: Optional[int] = Query(None),
-        page: Optional[int] = Query(None)
+        limit: Optional[int] = Query(None, ge=1),
+        offset: Optional[int] = Query(None, ge=0),
+        page: Optional[int] = Query(None, ge=1),
+        after: Optional[str] = Query(None)
 ):
     places = await search_places(
         place_type=place_type,
@@ -259,9 +326,113 @@ async def search_places_h(
         need_ads=need_ads,
         limit=limit,
         offset=offset,
-        page=page
+        page=page,
+        after=parse_cursor(after)
     )
-    return places
+    set_next_cursor(response, places, limit)
+    return place_thumbnails(places)
+
+
+@place_router.get("/nearby", response_model=List[placeResponseData])
+async def nearby_places_h(
+        lat: float = Query(..., ge=-90, le=90),
+        lon: float = Query(..., ge=-180, le=180),
+        radius: Optional[float] = Query(None, gt=0),
+        k: Optional[int] = Query(None, ge=1),
+        place_type: Optional[int] = Query(None),
+        is_alcohol: Optional[bool] = Query(None),
+        is_health: Optional[bool] = Query(None),
+        is_nosmoking: Optional[bool] = Query(None),
+        is_smoke: Optional[bool] = Query(None),
+        is_moderated: Optional[bool] = Query(None),
+        has_product_type: Optional[List[int]] = Query(None),
+        has_equipment_type: Optional[List[int]] = Query(None),
+        has_ads_type: Optional[List[int]] = Query(None),
+        need_products: Optional[bool] = Query(None),
+        need_equipment: Optional[bool] = Query(None),
+        need_ads: Optional[bool] = Query(None)
+):
+    places = await nearby_places(
+        lat=lat,
+        lon=lon,
+        radius=radius,
+        k=k,
+        place_type=place_type,
+        is_alcohol=is_alcohol,
+        is_health=is_health,
+        is_nosmoking=is_nosmoking,
+        is_smoke=is_smoke,
+        is_moderated=is_moderated,
+        has_product_type=has_product_type,
+        has_equipment_type=has_equipment_type,
+        has_ads_type=has_ads_type,
+        need_products=need_products,
+        need_equipment=need_equipment,
+        need_ads=need_ads
+    )
+    return place_thumbnails(places)
+
+
+class markerData(BaseModel):
+    id: int
+    coord1: float
+    coord2: float
+    type: Optional[str] = None
+    rating: Optional[int] = None
+    review_rank: Optional[float] = None
+
+
+class clusterData(BaseModel):
+    count: int
+    coord1: float
+    coord2: float
+    id: Optional[int] = None
+    rating: Optional[float] = None
+
+
+class bboxResponseData(BaseModel):
+    zoom: int
+    clustered: bool
+    markers: list[markerData] = []
+    clusters: list[clusterData] = []
+
+
+@place_router.get("/bbox", response_model=bboxResponseData)
+async def get_places_in_bbox_h(
+        min_lat: float = Query(..., ge=-90, le=90),
+        min_lon: float = Query(..., ge=-180, le=180),
+        max_lat: float = Query(..., ge=-90, le=90),
+        max_lon: float = Query(..., ge=-180, le=180),
+        zoom: int = Query(..., ge=0, le=22)
+):
+    if min_lat > max_lat or min_lon > max_lon:
+        raise HTTPException(status_code=400, detail="Invalid bounding box")
+    result = await get_places_in_bbox(min_lat, min_lon, max_lat, max_lon, zoom)
+    if result is None:
+        raise HTTPException(status_code=418, detail="i am a teapot ;)")
+    return result
+
+
+@place_router.get("/tiles/{z}/{x}/{y}.pbf")
+async def get_place_tile_h(z: int, x: int, y: int):
+    if z < 0 or z > TILE_MAX_ZOOM or not (0 <= x < 2 ** z) or not (0 <= y < 2 ** z):
+        raise HTTPException(status_code=404, detail="Tile out of range")
+
+    key = (z, x, y)
+    # Файлы кэша читаются и пишутся в потоке, чтобы диск не держал event loop
+    tile = tile_cache.get_memory(key)
+    if tile is None:
+        tile = await asyncio.to_thread(tile_cache.get, key)
+    if tile is None:
+        generation = tile_cache.generation
+        features = await get_places_in_tile(z, x, y)
+        if features is None:
+            raise HTTPException(status_code=418, detail="i am a teapot ;)")
+        tile = encode_tile(z, x, y, features)
+        await asyncio.to_thread(tile_cache.put, key, tile, generation)
+
+    return Response(content=tile, media_type="application/vnd.mapbox-vector-tile",
+                    headers={"Cache-Control": "public, max-age=60"})
 
 
 app.include_router(place_router, prefix="/place", tags=["place"])
@@ -348,15 +519,14 @@ async def add_review_h(data: UserReviewData):
     if data.rating < 1 or data.rating > 5:
         raise HTTPException(status_code=401, detail="Rating must be between 1 and 5")
 
-    toxic = classify_toxic_review(data.message)
-    if toxic:
-        raise HTTPException(status_code=418, detail="isNoGoodMessage")
-
     photo_urls = data.photos if data.photos else None
-    result = await add_review(data.message, data.user_id, data.place_id, data.rating, photo_urls)
-    if not result:
+    review_id = await add_review(data.message, data.user_id, data.place_id, data.rating, photo_urls)
+    if review_id is None:
         raise HTTPException(status_code=400, detail="error")
-    return {"status": "ok"}
+    # Отзыв появится в списках после проверки на токсичность. "status": "ok" —
+    # прежний ответ, на него рассчитаны клиенты; остальные поля только добавлены
+    moderation_pipeline.submit(review_id, data.message.strip())
+    return {"status": "ok", "review_id": review_id, "moderation": "pending"}
 
 
 @user_router.get("/{id}", response_model=UserResponseData)
@@ -369,11 +539,16 @@ async def get_user_h(id: int):
 
 @user_router.get("/", response_model=List[UserResponseData])
 async def get_all_users_h(
-        limit: Optional[int] = Query(None),
-        offset: Optional[int] = Query(None),
-        page: Optional[int] = Query(None)
+        response: Response,
+        limit: Optional[int] = Query(None, ge=1),
+        offset: Optional[int] = Query(None, ge=0),
+        page: Optional[int] = Query(None, ge=1),
+        after: Optional[str] = Query(None)
 ):
-    users = await get_all_users(limit=limit, offset=offset, page=page)
+    users = await get_all_users(limit=limit, offset=offset, page=page, after=parse_cursor(after))
+    set_next_cursor(response, users, limit, key="user_id")
+    for user in users:
+        user["photo"] = thumbnail_url(user.get("photo"))
     return users
 
 
@@ -415,12 +590,16 @@ async def add_follow_h(data: FollowData):
 @user_router.get("/follow/{user_id}", response_model=List[reviewData])
 async def get_followed_reviews_h(
         user_id: int,
-        limit: Optional[int] = Query(None),
-        offset: Optional[int] = Query(None),
-        page: Optional[int] = Query(None)
+        response: Response,
+        limit: Optional[int] = Query(None, ge=1),
+        offset: Optional[int] = Query(None, ge=0),
+        page: Optional[int] = Query(None, ge=1),
+        after: Optional[str] = Query(None)
 ):
-    reviews = await get_followed_reviews(user_id, limit=limit, offset=offset, page=page)
-    return reviews
+    """Отзывы подписок от новых к старым; без limit — страница FEED_PAGE_SIZE"""
+    reviews = await get_feed(user_id, limit=limit, offset=offset, page=page, after=parse_cursor(after))
+    set_next_cursor(response, reviews, limit or FEED_PAGE_SIZE)
+    return review_thumbnails(reviews)
 
 
 app.include_router(user_router, prefix="/user", tags=["user"])
@@ -455,47 +634,158 @@ app.include_router(review_router, prefix="/review", tags=["review"])
 photo_router = APIRouter()
 
 
-@photo_router.post("/upload")
-async def upload_photo_h(request: FastAPIRequest):
-    try:
-        file_data = await request.body()
+class PhotoPresignData(BaseModel):
+    content_type: str
+    # sha256 файла: если такие байты уже загружены, URL возвращается без загрузки
+    sha256: Optional[str] = None
 
-        if not file_data:
-            raise HTTPException(status_code=403, detail="No file data provided")
 
-        content_type = request.headers.get("content-type", "").lower()
+class PhotoCompleteData(BaseModel):
+    object_name: str
 
-        mime_to_extension = {
-            "image/png": "png",
-            "image/jpeg": "jpg",
-            "image/jpg": "jpg",
-            "image/gif": "gif",
-            "image/webp": "webp",
-            "image/bmp": "bmp",
-            "image/svg+xml": "svg",
-        }
 
-        file_extension = mime_to_extension.get(content_type, "jpg")
+def photo_response(photo: dict) -> dict:
+    # url — вариант full без EXIF; превью для списков получаются из него через thumbnail_url.
+    # Оригинал не отдаётся: после построения вариантов его уже нет в бакете
+    return {
+        "url": photo["url"],
+        "variants": {variant: public_url(name) for variant, name in photo["variants"].items()},
+    }
 
-        photo_url = upload_photo(file_data, file_extension)
 
-        # moderation = moderate_image_by_url(photo_url)
+async def store_photo(object_name: str, content_hash: Optional[str] = None) -> dict:
+    """Строит варианты загруженного оригинала, регистрирует его в photo_objects
+    и формирует ответ загрузки.
 
-        # if moderation not in [1, 2]:
-        #     return HTTPException(status_code=402, detail="Photo upload failed")
+    Если такие же байты уже загружены, новый объект удаляется и возвращается
+    прежнее фото. При известном заранее хэше варианты при этом не строятся.
+    """
+    if content_hash:
+        existing = await find_photo_object(content_hash)
+        if existing:
+            await asyncio.to_thread(delete_object, object_name)
+            logger.info(f"Duplicate photo {object_name}, reusing {existing['object_name']}")
+            return photo_response(existing)
 
-        # if moderation == 1:
-        #     return HTTPException(status_code=401, detail="Photo not moderation")
+    try:
+        processed = await process_photo(object_name)
+    except ImageDecodeError:
+        await asyncio.to_thread(delete_object, object_name)
+        raise UnsupportedImage("Cannot decode image")
+    except Exception as e:
+        # Оригинал с EXIF не публикуем: без вариантов загрузку нужно повторить
+        logger.error(f"Image processing failed for {object_name}: {e}")
+        # Вместе с вариантами, которые могли успеть выгрузиться
+        await asyncio.to_thread(delete_objects, [object_name, *photo_variant_names(object_name)])
+        raise HTTPException(status_code=503, detail="Photo processing failed, retry the upload")
+
+    variants = processed["variants"]
+    photo = {
+        "object_name": object_name,
+        # SVG вариантов не имеет и отдаётся как загружен
+        "url": public_url(variants["full"]) if "full" in variants else public_url(object_name),
+        "variants": variants,
+    }
+
+    if processed["hash"]:
+        try:
+            # original_url совпадает с url: отдельного публичного оригинала больше нет
+            stored = await register_photo_object(processed["hash"], object_name, photo["url"], photo["url"],
+                                                 variants, processed["size"])
+        except Exception as e:
+            # Незарегистрированный объект не учитывается сборщиком: не отдаём его клиенту
+            logger.error(f"Could not register photo {object_name}: {e}")
+            await asyncio.to_thread(delete_objects, [object_name, *variants.values()])
+            raise HTTPException(status_code=503, detail="Photo storage unavailable, retry the upload")
+        if stored["object_name"] != object_name:
+            # Те же байты успел зарегистрировать параллельный запрос
+            await asyncio.to_thread(delete_objects, [object_name, *variants.values()])
+        photo = stored
+
+    # moderation = await moderate_image_by_url(photo_url)
+
+    # if moderation not in [1, 2]:
+    #     return HTTPException(status_code=402, detail="Photo upload failed")
 
-        return {"url": photo_url}
+    # if moderation == 1:
+    #     return HTTPException(status_code=401, detail="Photo not moderation")
+
+    return photo_response(photo)
+
+
+@photo_router.post("/upload")
+async def upload_photo_h(request: FastAPIRequest):
+    try:
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > PHOTO_MAX_UPLOAD_SIZE:
+            raise HTTPException(status_code=413, detail="Photo is too large")
+
+        # Тело не буферизуется целиком: тип определяется по первым байтам,
+        # остальное частями уходит в MinIO
+        object_name, content_hash, _ = await upload_photo_stream(request.stream())
+        return await store_photo(object_name, content_hash)
     except HTTPException:
         raise
+    except EmptyUpload:
+        raise HTTPException(status_code=403, detail="No file data provided")
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="Photo is too large")
+    except UnsupportedImage:
+        raise HTTPException(status_code=415, detail="Unsupported image format")
     except Exception as e:
         logger.error(f"Error uploading photo: {e}")
         raise HTTPException(status_code=400, detail=f"Error uploading photo: {str(e)}")
 
 
+@photo_router.post("/presign")
+async def presign_photo_h(data: PhotoPresignData):
+    """URL для загрузки фото напрямую в MinIO, минуя API.
+
+    Клиент отправляет multipart/form-data POST на upload_url: поля из fields,
+    файл последним полем file (больше max_size хранилище не примет), затем
+    вызывает /photo/complete с object_name. Если upload_url пуст, фото с
+    переданным sha256 уже есть и ответ содержит его URL. Загрузки, которые не
+    завершили вызовом /photo/complete, удаляет сборщик /admin/storage/gc.
+    """
+    try:
+        if data.sha256:
+            existing = await find_photo_object(data.sha256.lower())
+            if existing:
+                return {"object_name": existing["object_name"], "upload_url": None, **photo_response(existing)}
+        upload = await asyncio.to_thread(presign_photo_upload, data.content_type)
+        await track_photo_upload(upload["object_name"])
+        return upload
+    except UnsupportedImage:
+        raise HTTPException(status_code=415, detail="Unsupported image format")
+    except Exception as e:
+        logger.error(f"Error presigning photo upload: {e}")
+        raise HTTPException(status_code=400, detail=f"Error presigning photo upload: {str(e)}")
+
+
+@photo_router.post("/complete")
+async def complete_photo_h(data: PhotoCompleteData):
+    """Регистрирует фото, загруженное по presigned URL, и строит его варианты"""
+    try:
+        await asyncio.to_thread(verify_uploaded_photo, data.object_name)
+        return await store_photo(data.object_name)
+    except HTTPException:
+        raise
+    except MissingUpload:
+        raise HTTPException(status_code=404, detail="Photo was not uploaded")
+    except EmptyUpload:
+        raise HTTPException(status_code=403, detail="No file data provided")
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="Photo is too large")
+    except UnsupportedImage:
+        raise HTTPException(status_code=415, detail="Unsupported image format")
+    except Exception as e:
+        logger.error(f"Error completing photo upload: {e}")
+        raise HTTPException(status_code=400, detail=f"Error completing photo upload: {str(e)}")
+
+
 @photo_router.options("/upload")
+@photo_router.options("/presign")
+@photo_router.options("/complete")
 async def upload_photo_options():
     return Response(status_code=204)
 
@@ -581,24 +871,178 @@ async def delete_review_admin_h(data: AdminDeleteReviewData) -> dict:
     return {}
 
 
+@admin_router.post("/aggregates/reconcile")
+async def reconcile_aggregates_h(dry_run: bool = False) -> dict:
+    try:
+        report = await reconcile_aggregates(fix=not dry_run)
+    except Exception:
+        raise HTTPException(status_code=500, detail="Reconciliation failed")
+    affected = report.pop("affected_place_ids")
+    if not dry_run:
+        for place_id in affected:
+            invalidate_place_cache(place_id)
+    return report
+
+
+@admin_router.post("/leaderboard/rebuild")
+async def rebuild_leaderboard_h() -> dict:
+    try:
+        users = await load_leaderboard()
+    except Exception:
+        raise HTTPException(status_code=500, detail="Leaderboard rebuild failed")
+    return {"users": users}
+
+
+@admin_router.post("/ratings/compact")
+async def compact_ratings_h() -> dict:
+    """Сворачивает старые события журнала рейтинга в итог по пользователю"""
+    try:
+        return await compact_rating_events()
+    except Exception:
+        raise HTTPException(status_code=500, detail="Rating compaction failed")
+
+
+@admin_router.post("/ratings/reconcile")
+async def reconcile_ratings_h(dry_run: bool = True) -> dict:
+    try:
+        return await reconcile_ratings(fix=not dry_run)
+    except Exception:
+        raise HTTPException(status_code=500, detail="Rating reconciliation failed")
+
+
+@admin_router.post("/feed/trim")
+async def trim_feeds_h() -> dict:
+    """Обрезает ленты подписок до FEED_MAX_ITEMS последних записей"""
+    try:
+        removed = await trim_feeds()
+    except Exception:
+        raise HTTPException(status_code=500, detail="Feed trim failed")
+    return {"removed": removed}
+
+
+@admin_router.post("/places/import")
+async def import_places_h(request: FastAPIRequest, dry_run: bool = False, skip_invalid: bool = False) -> dict:
+    """Загрузка мест из CSV/XLSX в теле запроса (формат файла — в db.bulk)"""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > PLACE_IMPORT_MAX_SIZE:
+        raise HTTPException(status_code=413, detail="File is too large")
+    data = await request.body()
+    if not data:
+        raise HTTPException(status_code=400, detail="No file data provided")
+    if len(data) > PLACE_IMPORT_MAX_SIZE:
+        raise HTTPException(status_code=413, detail="File is too large")
+
+    try:
+        report = await import_places(data, detect_format(data, request.headers.get("content-type")),
+                                     skip_invalid=skip_invalid, dry_run=dry_run)
+    except ImportFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Place import failed: {e}")
+        raise HTTPException(status_code=500, detail="Place import failed")
+
+    if report["imported"]:
+        # Новые места по всей карте: проще сбросить тайлы целиком, чем по точке.
+        # place_cache не трогаем — в нём только уже существующие id
+        await asyncio.to_thread(tile_cache.clear)
+    elif report["error_count"] and not dry_run:
+        raise HTTPException(status_code=422, detail=report)
+    return report
+
+
+@admin_router.get("/places/export")
+async def export_places_h(table: str = Query("places"), file_format: str = Query(CSV, alias="format")):
+    """Выгрузка мест потоком; CSV — по таблице, XLSX — все таблицы листами"""
+    if table not in EXPORT_QUERIES:
+        raise HTTPException(status_code=400, detail=f"Unknown table, expected one of {list(EXPORT_QUERIES)}")
+    if file_format == XLSX:
+        return StreamingResponse(
+            export_xlsx(),
+            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            headers={"Content-Disposition": 'attachment; filename="places.xlsx"'})
+    if file_format != CSV:
+        raise HTTPException(status_code=400, detail="Unknown format, expected csv or xlsx")
+    return StreamingResponse(export_csv(table), media_type="text/csv; charset=utf-8",
+                             headers={"Content-Disposition": f'attachment; filename="{table}.csv"'})
+
+
+@admin_router.post("/storage/reconcile")
+async def reconcile_storage_h() -> dict:
+    try:
+        await asyncio.to_thread(reconcile_bucket)
+    except Exception as e:
+        logger.error(f"Bucket reconcile failed: {e}")
+        raise HTTPException(status_code=500, detail="Bucket reconcile failed")
+    return {}
+
+
+@admin_router.post("/storage/gc")
+async def collect_photos_h(dry_run: bool = False, reconcile: bool = False,
+                           max_batches: Optional[int] = Query(None, ge=1)) -> dict:
+    """Удаляет фото, на которые дольше PHOTO_GC_GRACE нет ссылок, и брошенные presigned-загрузки"""
+    try:
+        fixed = await reconcile_photo_refs() if reconcile else 0
+        report = await asyncio.to_thread(collect_orphan_photos, max_batches=max_batches, dry_run=dry_run)
+        report["abandoned_uploads"] = await asyncio.to_thread(collect_abandoned_uploads,
+                                                              max_batches=max_batches, dry_run=dry_run)
+    except Exception as e:
+        logger.error(f"Photo GC failed: {e}")
+        raise HTTPException(status_code=500, detail="Photo GC failed")
+    report["ref_count_fixed"] = fixed
+    return report
+
+
 app.include_router(admin_router, prefix="/admin", tags=["admin"])
 
 leader_router = APIRouter()
 
 
-@leader_router.get("/")
-async def get_leaderboard_h():
+async def ranked_users():
     try:
-        result = await get_leaderboard()
-        if not result:
-            logger.error(f"Failed to get leaderboard")
-            raise HTTPException(status_code=400, detail="error")
-        return result
-    except HTTPException:
-        raise
+        await ensure_leaderboard()
     except Exception as e:
-        logger.error(f"Error in set_review_rank_h: {e}")
-        raise HTTPException(status_code=400, detail=f"error: {str(e)}")
+        logger.error(f"Failed to load leaderboard: {e}")
+        raise HTTPException(status_code=503, detail="Leaderboard unavailable")
+    return leaderboard
+
+
+def leaderboard_thumbnails(users: list) -> list:
+    for user in users:
+        user["user_photos"] = thumbnail_url(user.get("user_photos"))
+    return users
+
+
+@leader_router.get("/")
+async def get_leaderboard_h(limit: Optional[int] = Query(None, ge=1, le=1000),
+                            offset: Optional[int] = Query(None, ge=0)):
+    """Топ по рейтингу, по убыванию; rank у равных рейтингов общий.
+
+    Без limit и offset — как раньше: весь список по возрастанию рейтинга,
+    на это рассчитаны существующие клиенты. Страница — только по явному limit/offset.
+    """
+    index = await ranked_users()
+    if limit is None and offset is None:
+        return leaderboard_thumbnails(index.top(len(index))[::-1])
+    return leaderboard_thumbnails(index.top(limit or 100, offset or 0))
+
+
+@leader_router.get("/user/{user_id}")
+async def get_user_rank_h(user_id: int):
+    index = await ranked_users()
+    user = index.rank(user_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User is not ranked")
+    return leaderboard_thumbnails([user])[0]
+
+
+@leader_router.get("/around/{user_id}")
+async def get_leaderboard_around_h(user_id: int, radius: int = Query(5, ge=0, le=100)):
+    """Пользователь и radius соседей выше и ниже него"""
+    index = await ranked_users()
+    users = index.around(user_id, radius)
+    if not users:
+        raise HTTPException(status_code=404, detail="User is not ranked")
+    return leaderboard_thumbnails(users)
 
 
 app.include_router(leader_router, prefix="/leaderboard", tags=["leaderboard"])
@@ -612,16 +1056,28 @@ def image_bytes_to_data_url(data: bytes, fallback_ext: str = "jpg") -> str:
     return f"data:{mime_type};base64,{b64}"
 
 
-def moderate_image_by_url(image_url: str) -> int:
-    api_key = OPENROUTER_API_KEY
-    if not api_key:
-        raise RuntimeError("OPENROUTER_API_KEY не задан")
-
-    resp = requests.get(image_url)
+async def moderate_image_by_url(image_url: str) -> int:
+    """Модерация картинки; повторно загруженные байты не отправляются в модель"""
+    resp = await asyncio.to_thread(requests.get, image_url)
     resp.raise_for_status()
     image_bytes = resp.content
 
+    key = bytes_hash(image_bytes)
+    verdict = await verdict_cache.get(IMAGE_KIND, key)
+    if verdict is not None:
+        return verdict
+
     content_type = resp.headers.get("Content-Type", "").lower()
+    verdict = await asyncio.to_thread(moderate_image_bytes, image_bytes, content_type)
+    await verdict_cache.put(IMAGE_KIND, key, verdict)
+    return verdict
+
+
+def moderate_image_bytes(image_bytes: bytes, content_type: str) -> int:
+    api_key = OPENROUTER_API_KEY
+    if not api_key:
+        raise RuntimeError("OPENROUTER_API_KEY не задан")
+
     ext = "jpg"
     if "png" in content_type:
         ext = "png"
@@ -732,3 +1188,78 @@ async def gpt_chat_h(data: GPTRequest):
 
 
 app.include_router(gpt_router, prefix="/gpt", tags=["gpt"])
+
+stats_router = APIRouter()
+
+
+@stats_router.get("/pool")
+async def pool_stats_h():
+    return pool_stats()
+
+
+@stats_router.get("/place-cache")
+async def place_cache_stats_h():
+    return place_cache.stats()
+
+
+@stats_router.get("/leaderboard")
+async def leaderboard_stats_h():
+    return leaderboard.stats()
+
+
+@stats_router.get("/tiles")
+async def tile_cache_stats_h():
+    return tile_cache.stats()
+
+
+@stats_router.get("/moderation")
+async def moderation_stats_h():
+    return moderation_pipeline.stats()
+
+
+@stats_router.get("/verdict-cache")
+async def verdict_cache_stats_h():
+    return verdict_cache.stats()
+
+
+app.include_router(stats_router, prefix="/stats", tags=["stats"])
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_h():
+    return Response(content=REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+async def trim_feeds_periodically():
+    # fan-out не обрезает ленты подписчиков, это делает этот цикл
+    while True:
+        await asyncio.sleep(FEED_TRIM_INTERVAL)
+        try:
+            removed = await trim_feeds()
+            if removed:
+                logger.info(f"Trimmed {removed} feed items")
+        except Exception as e:
+            logger.error(f"Feed trim failed: {e}")
+
+
+@app.on_event("startup")
+async def startup_h():
+    await moderation_pipeline.start()
+    app.state.feed_trimmer = asyncio.create_task(trim_feeds_periodically(), name="feed-trim")
+    try:
+        await ensure_leaderboard()
+    except Exception as e:
+        logger.error(f"Leaderboard will be loaded on first request: {e}")
+
+
+@app.on_event("shutdown")
+async def shutdown_h():
+    await moderation_pipeline.stop()
+    feed_trimmer = getattr(app.state, "feed_trimmer", None)
+    if feed_trimmer is not None:
+        feed_trimmer.cancel()
+        await asyncio.gather(feed_trimmer, return_exceptions=True)
+    shutdown_executor()
+    close_pool()
+    close_minio_client()
+    shutdown_image_pool()
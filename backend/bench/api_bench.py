@@ -0,0 +1,325 @@
+"""Сценарный бенчмарк API на синтетическом городе (bench/dataset.py).
+
+    python -m bench.dataset --scale 10k --reset
+    python -m bench.api_bench --duration 10 --concurrency 8 --output bench-HEAD.json
+    python -m bench.api_bench compare bench-main.json bench-HEAD.json
+
+API запускается в отдельном процессе (uvicorn, как в main.py) с базой из
+config, MinIO заменён bench/fake_s3.py, модель модерации — FakeClassifier,
+клиент OpenRouter — заглушкой, поэтому внешние сервисы не нужны. Клиенты
+работают в этом процессе и не отнимают у сервера event loop.
+
+Для каждого сценария: rps, p50/p95/p99 задержки и число SQL-запросов и
+время в БД на запрос — из заголовка Server-Timing (metrics.py). Отчёт JSON
+с коммитом и размером данных; compare печатает изменения между двумя
+отчётами.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+SERVER_TIMING = re.compile(r'db;dur=([\d.]+);desc="(\d+) queries, (\d+) rows"')
+
+FEED_PAGE = 20
+LIST_PAGE = 50
+
+
+class FakeOpenRouter:
+    """Заглушка OpenAI-клиента для /gpt/chat: фиксированный ответ с задержкой"""
+
+    def __init__(self, latency: float = 0.2, answer: str = "Тестовый ответ"):
+        self.latency = latency
+        self.answer = answer
+        self.chat = self
+        self.completions = self
+
+    def create(self, **kwargs):
+        from types import SimpleNamespace
+        time.sleep(self.latency)
+        message = SimpleNamespace(content=self.answer)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def serve(args):
+    """Процесс сервера: подменяет внешние сервисы и запускает uvicorn"""
+    import config
+    from bench.fake_s3 import FakeS3Server
+
+    s3 = FakeS3Server(latency=args.s3_latency).start()
+    config.MINIO_ENDPOINT = s3.endpoint
+    config.MINIO_PUBLIC_URL = f"http://{s3.endpoint}"
+    config.MINIO_ACCESS_KEY = "bench"
+    config.MINIO_SECRET_KEY = "benchbench"
+    config.MINIO_SECURE = False
+    config.MINIO_REGION = "us-east-1"
+    config.MODERATION_CLASSIFIER = "fake"
+    config.OPENROUTER_API_KEY = "bench"
+    config.LOG_LEVEL = "WARNING"
+    config.LOG_FILE = None
+
+    import uvicorn
+    import app.app as api
+
+    api.client = FakeOpenRouter()
+    uvicorn.run(api.app, host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
+
+
+class Fixtures:
+    """Идентификаторы из загруженного набора: какие места и ленты запрашивать"""
+
+    def __init__(self):
+        from db.migration import db_connection
+
+        connection = db_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT id, review_count FROM places ORDER BY id")
+                rows = cursor.fetchall()
+                self.place_ids = [row[0] for row in rows]
+                # Популярные места открывают чаще: вес — число отзывов + 1
+                self.place_weights = [row[1] + 1 for row in rows]
+                cursor.execute("SELECT user_id FROM follow GROUP BY user_id")
+                self.followers = [row[0] for row in cursor.fetchall()]
+                cursor.execute("SELECT id FROM users ORDER BY id")
+                self.user_ids = [row[0] for row in cursor.fetchall()]
+                cursor.execute("SELECT id FROM places_type ORDER BY id")
+                self.place_types = [row[0] for row in cursor.fetchall()]
+                cursor.execute("""
+                    SELECT (SELECT count(*) FROM places), (SELECT count(*) FROM reviews),
+                           (SELECT count(*) FROM users), (SELECT count(*) FROM follow)
+                """)
+                places, reviews, users, follows = cursor.fetchone()
+                self.size = {"places": places, "reviews": reviews, "users": users, "follows": follows}
+        finally:
+            connection.close()
+        if not self.place_ids or not self.user_ids:
+            raise SystemExit("The database is empty: run python -m bench.dataset --reset first")
+
+
+def _place_list(rng, fx):
+    return "GET", f"/place/?limit={LIST_PAGE}", None
+
+
+def _place_search(rng, fx):
+    return "GET", f"/place/search?place_type={rng.choice(fx.place_types)}&max_distance=5&limit={LIST_PAGE}", None
+
+
+def _place_point(rng, fx):
+    place_id = rng.choices(fx.place_ids, weights=fx.place_weights)[0]
+    return "GET", f"/place/point/{place_id}", None
+
+
+def _follow_feed(rng, fx):
+    return "GET", f"/user/follow/{rng.choice(fx.followers or fx.user_ids)}?limit={FEED_PAGE}", None
+
+
+def _leaderboard(rng, fx):
+    return "GET", "/leaderboard/", None
+
+
+def _add_review(rng, fx):
+    body = {
+        "message": f"бенчмарк {rng.getrandbits(64):x} уютно и чисто",
+        "user_id": rng.choice(fx.user_ids),
+        "place_id": rng.choice(fx.place_ids),
+        "rating": rng.randint(1, 5),
+    }
+    return "POST", "/user/review", body
+
+
+SCENARIOS = {
+    "place_list": _place_list,
+    "place_search": _place_search,
+    "place_point": _place_point,
+    "follow_feed": _follow_feed,
+    "leaderboard": _leaderboard,
+    "add_review": _add_review,
+}
+
+
+def percentile(values: list, p: float) -> float:
+    """Ближайший ранг по отсортированному списку"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(p * len(values)) - 1))]
+
+
+async def _worker(client, scenario, fixtures, rng, deadline: float, samples: list, errors: list):
+    while time.monotonic() < deadline:
+        method, url, body = scenario(rng, fixtures)
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, json=body)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+            continue
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            errors.append(response.status_code)
+        timing = SERVER_TIMING.search(response.headers.get("server-timing", ""))
+        if timing:
+            samples.append((elapsed, int(timing.group(2)), float(timing.group(1)), int(timing.group(3))))
+        else:
+            samples.append((elapsed, None, None, None))
+
+
+async def run_scenario(name: str, args, fixtures: Fixtures) -> dict:
+    scenario = SCENARIOS[name]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        # Прогрев: кэши мест и плиток, соединения пула
+        warmup = time.monotonic() + args.warmup
+        await asyncio.gather(*[_worker(client, scenario, fixtures, random.Random(args.seed + i), warmup, [], [])
+                               for i in range(args.concurrency)])
+
+        samples, errors = [], []
+        started = time.monotonic()
+        deadline = started + args.duration
+        await asyncio.gather(*[_worker(client, scenario, fixtures, random.Random(args.seed + 1000 + i),
+                                       deadline, samples, errors)
+                               for i in range(args.concurrency)])
+        elapsed = time.monotonic() - started
+
+    latencies = sorted(sample[0] * 1000 for sample in samples)
+    queries = sorted(sample[1] for sample in samples if sample[1] is not None)
+    db_ms = sorted(sample[2] for sample in samples if sample[2] is not None)
+    rows = [sample[3] for sample in samples if sample[3] is not None]
+    return {
+        "requests": len(samples),
+        "errors": len(errors),
+        "error_codes": sorted({str(e) for e in errors}),
+        "rps": round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+        "queries_p95": percentile(queries, 0.95) if queries else None,
+        "db_ms_p50": round(percentile(db_ms, 0.50), 2) if db_ms else None,
+        "rows_per_request": round(sum(rows) / len(rows), 1) if rows else None,
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _wait_ready(base_url: str, server: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"API server exited with code {server.returncode}")
+        try:
+            if httpx.get(f"{base_url}/stats/pool", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit("API server did not start")
+
+
+def run(args) -> dict:
+    fixtures = Fixtures()
+    server = None
+    if not args.external:
+        command = [sys.executable, "-m", "bench.api_bench", "serve", "--port", str(args.port),
+                   "--s3-latency", str(args.s3_latency)]
+        server = subprocess.Popen(command, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        args.base_url = f"http://127.0.0.1:{args.port}/api"
+    try:
+        _wait_ready(args.base_url, server) if server else None
+        results = {}
+        for name in args.scenarios.split(","):
+            results[name] = asyncio.run(run_scenario(name, args, fixtures))
+            print(f"{name:>13}: {results[name]['rps']:8.1f} rps  p50={results[name]['p50_ms']:.1f}ms  "
+                  f"p99={results[name]['p99_ms']:.1f}ms  queries={results[name]['queries_per_request']}",
+                  file=sys.stderr)
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=30)
+
+    return {
+        "commit": _git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "dataset": fixtures.size,
+        "settings": {"concurrency": args.concurrency, "duration": args.duration, "warmup": args.warmup,
+                     "seed": args.seed, "s3_latency": args.s3_latency},
+        "scenarios": results,
+    }
+
+
+COMPARED = ("rps", "p50_ms", "p95_ms", "p99_ms", "queries_per_request", "db_ms_p50")
+
+
+def compare(old_path: str, new_path: str) -> str:
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    lines = [f"{old.get('commit')} -> {new.get('commit')}"]
+    if old.get("dataset") != new.get("dataset"):
+        lines.append(f"warning: datasets differ: {old.get('dataset')} vs {new.get('dataset')}")
+    for name, result in new["scenarios"].items():
+        before = old["scenarios"].get(name)
+        if before is None:
+            continue
+        changes = []
+        for key in COMPARED:
+            a, b = before.get(key), result.get(key)
+            if a is None or b is None:
+                continue
+            delta = f"{(b - a) / a * 100:+.1f}%" if a else "n/a"
+            changes.append(f"{key} {a} -> {b} ({delta})")
+        lines.append(f"{name}: " + ", ".join(changes))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", nargs="?", default="run", choices=("run", "serve", "compare"))
+    parser.add_argument("reports", nargs="*", help="compare: old.json new.json")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--s3-latency", type=float, default=0.002)
+    parser.add_argument("--external", action="store_true", help="use an already running API at --base-url")
+    parser.add_argument("--base-url", default="http://localhost:8000/api")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args)
+        return
+    if args.command == "compare":
+        if len(args.reports) != 2:
+            parser.error("compare needs two report files")
+        print(compare(*args.reports))
+        return
+
+    report = run(args)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
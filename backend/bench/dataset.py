@@ -0,0 +1,285 @@
+"""Синтетический город для бенчмарков: воспроизводимый по seed набор данных.
+
+    python -m bench.dataset --scale 10k --seed 42 --reset
+
+Заполняет справочники, места (с товарами, рекламой и инвентарём),
+пользователей, отзывы, оценки отзывов, подписки и фото в базе из config.
+--reset обязателен: перед загрузкой все таблицы данных очищаются.
+
+Распределения похожи на настоящие: места сгруппированы по районам вокруг
+центра Тулы, отзывы по местам и по авторам распределены по степенному
+закону (немного популярных мест и активных авторов, длинный хвост), на
+популярных авторов подписано больше людей. Данные грузятся через COPY, после
+чего пересчитываются агрегаты (db.aggregates), раскладываются ленты подписок
+(db.feed) и выполняется ANALYZE.
+"""
+import argparse
+import csv
+import hashlib
+import io
+import itertools
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from db.feed import rebuild_feeds
+from db.geo import haversine
+from db.migration import db_connection, migration_up, RECONCILE_PLACES_SQL, RECONCILE_REVIEWS_SQL, RATING_BASELINE_SQL
+
+SCALES = {"1k": 1000, "10k": 10000, "100k": 100000}
+
+CENTER = (54.1931, 37.6177)
+DISTRICTS = 24
+
+PLACE_TYPES = ["Кафе", "Ресторан", "Спортзал", "Бассейн", "Парк", "Магазин", "Бар", "Стадион"]
+FOOD_TYPES = ["Русская", "Европейская", "Азиатская", "Фастфуд", "Вегетарианская"]
+SPORT_TYPES = ["Фитнес", "Плавание", "Йога", "Единоборства", "Футбол"]
+PRODUCT_TYPES = ["Еда", "Напитки", "Алкоголь", "Табак", "Спортпит"]
+REKLAMA_TYPES = ["Баннер", "Листовка", "Вывеска"]
+SPORT_INTERFACES = ["Беговая дорожка", "Штанга", "Турник", "Велотренажёр", "Гребной тренажёр", "Брусья"]
+FOOD_PLACE_TYPES = {1, 2, 6, 7}
+SPORT_PLACE_TYPES = {3, 4, 5, 8}
+
+WORDS = ("хорошо отлично уютно чисто вкусно дорого шумно тихо быстро медленно персонал зал "
+         "меню кофе тренер душ раздевалка цены место рядом рекомендую вернусь понравилось "
+         "обслуживание атмосфера музыка порции парковка очередь вежливо грязно").split()
+
+# Пароль всех пользователей — «bench», хэш как в db.user.hash_password
+BENCH_PASSWORD = "bench"
+BENCH_PASSWORD_HASH = hashlib.sha256(BENCH_PASSWORD.encode()).hexdigest()
+
+REVIEWS_PER_PLACE = 4
+USERS_PER_PLACE = 0.2
+PLACE_SKEW = 0.9
+AUTHOR_SKEW = 0.8
+
+DATA_TABLES = (
+    "places", "places_type", "food_type", "sport_type", "product", "product_type", "reklama",
+    "reklama_type", "sport_interfaces", "sport_interfaces_place", "users", "reviews",
+    "reviews_photo", "reviews_ranks", "places_photos", "users_photos", "follow",
+    "photo_objects", "moderation_verdicts", "feed_items", "rating_events",
+)
+
+
+def _zipf_weights(n: int, skew: float) -> list:
+    return list(itertools.accumulate(1.0 / (rank ** skew) for rank in range(1, n + 1)))
+
+
+def _url(rng: random.Random) -> str:
+    return f"http://localhost:9000/reviews-photos/reviews/{rng.getrandbits(128):032x}.full.webp"
+
+
+def _text(rng: random.Random, low: int, high: int) -> str:
+    return " ".join(rng.choices(WORDS, k=rng.randint(low, high)))
+
+
+class Dataset:
+    """Строки всех таблиц; генерируются целиком в памяти (100k мест — сотни МБ)"""
+
+    def __init__(self, places: int, seed: int):
+        self.rng = random.Random(seed)
+        self.places_count = places
+        self.users_count = max(100, int(places * USERS_PER_PLACE))
+        self.epoch = datetime(2025, 1, 1)
+        self.tables = {}
+
+    def _add(self, table: str, columns: tuple, rows: list):
+        self.tables[table] = (columns, rows)
+
+    def _dictionaries(self):
+        for table, values in (("places_type", PLACE_TYPES), ("food_type", FOOD_TYPES),
+                              ("sport_type", SPORT_TYPES), ("product_type", PRODUCT_TYPES),
+                              ("reklama_type", REKLAMA_TYPES), ("sport_interfaces", SPORT_INTERFACES)):
+            self._add(table, ("id", "type"), [(i, value) for i, value in enumerate(values, start=1)])
+
+    def _places(self):
+        rng = self.rng
+        districts = [(CENTER[0] + rng.gauss(0, 0.04), CENTER[1] + rng.gauss(0, 0.07)) for _ in range(DISTRICTS)]
+        places, products, ads, equipment, photos = [], [], [], [], []
+        for place_id in range(1, self.places_count + 1):
+            lat0, lon0 = rng.choice(districts)
+            lat, lon = lat0 + rng.gauss(0, 0.01), lon0 + rng.gauss(0, 0.016)
+            place_type = rng.randint(1, len(PLACE_TYPES))
+            food = place_type in FOOD_PLACE_TYPES
+            sport = place_type in SPORT_PLACE_TYPES
+            created = self.epoch + timedelta(minutes=rng.randint(0, 500000))
+            places.append((
+                place_id, f"{PLACE_TYPES[place_type - 1]} №{place_id}", round(lat, 6), round(lon, 6), place_type,
+                rng.randint(1, len(FOOD_TYPES)) if food else None,
+                rng.randint(1, len(SPORT_TYPES)) if sport else None,
+                rng.random() < 0.2, food and rng.random() < 0.3, sport or rng.random() < 0.2,
+                _text(rng, 5, 20), rng.random() < 0.6, rng.random() < 0.1, rng.randint(0, 100),
+                created, rng.randint(1, self.users_count), created, None,
+                round(haversine(CENTER[0], CENTER[1], lat, lon) / 1000, 3), rng.random() < 0.7,
+            ))
+            if food:
+                for _ in range(rng.randint(0, 6)):
+                    products.append((place_id, rng.randint(1, len(PRODUCT_TYPES)), round(rng.uniform(50, 2000), 2),
+                                     rng.random() < 0.3, rng.random() < 0.2, rng.random() < 0.1, _text(rng, 1, 3)))
+            if sport:
+                for interface in rng.sample(range(1, len(SPORT_INTERFACES) + 1), rng.randint(1, 4)):
+                    equipment.append((place_id, interface, rng.randint(1, 12)))
+            for _ in range(rng.choice((0, 0, 0, 1, 2))):
+                ads.append((place_id, rng.randint(1, len(REKLAMA_TYPES)), _text(rng, 1, 3), rng.random() < 0.2))
+            for _ in range(rng.choice((0, 1, 1, 2, 3, 4))):
+                photos.append((place_id, _url(rng)))
+
+        self._add("places", ("id", "name", "coord1", "coord2", "type", "foodtype", "sporttype", "issmoke",
+                             "isalcohol", "ishealth", "info", "isnosmoking", "isinsurence", "rating",
+                             "creatat", "creatorid", "changeat", "changeid", "distance_to_center",
+                             "is_moderated"), places)
+        self._add("product", ("id_place", "type", "min_cost", "ishealth", "isalcohol", "issmoking", "name"), products)
+        self._add("reklama", ("id_place", "type", "name", "ishelth"), ads)
+        self._add("sport_interfaces_place", ("id_place", "id_interface", "count"), equipment)
+        self._add("places_photos", ("place_id", "url"), photos)
+
+    def _users_and_reviews(self):
+        rng = self.rng
+        place_order = list(range(1, self.places_count + 1))
+        rng.shuffle(place_order)
+        author_order = list(range(1, self.users_count + 1))
+        rng.shuffle(author_order)
+        place_weights = _zipf_weights(self.places_count, PLACE_SKEW)
+        author_weights = _zipf_weights(self.users_count, AUTHOR_SKEW)
+
+        total = self.places_count * REVIEWS_PER_PLACE
+        review_places = rng.choices(place_order, cum_weights=place_weights, k=total)
+        review_authors = rng.choices(author_order, cum_weights=author_weights, k=total)
+
+        reviews, photos, ranks = [], [], []
+        approved_by_author = {}
+        for review_id, (place_id, author_id) in enumerate(zip(review_places, review_authors), start=1):
+            roll = rng.random()
+            status = "pending" if roll < 0.02 else "rejected" if roll < 0.03 else "approved"
+            reviews.append((review_id, author_id, place_id, _text(rng, 4, 40), rng.choices((1, 2, 3, 4, 5), (1, 1, 2, 4, 6))[0], status))
+            if status == "approved":
+                approved_by_author[author_id] = approved_by_author.get(author_id, 0) + 1
+            if rng.random() < 0.15:
+                for _ in range(rng.randint(1, 3)):
+                    photos.append((review_id, _url(rng)))
+            # Оценок у отзыва: степенной хвост, у большинства 0–2
+            rank_count = min(int(rng.paretovariate(1.6)) - 1, 60, self.users_count)
+            for user_id in rng.sample(range(1, self.users_count + 1), rank_count):
+                like = rng.random() < 0.8
+                ranks.append((review_id, user_id, like, not like))
+
+        users, user_photos = [], []
+        for user_id in range(1, self.users_count + 1):
+            users.append((user_id, f"Пользователь {user_id}", f"user{user_id}@bench.local", BENCH_PASSWORD_HASH,
+                          100 + 5 * approved_by_author.get(user_id, 0), False, None, None, None, None))
+            if rng.random() < 0.6:
+                user_photos.append((user_id, _url(rng)))
+
+        follows = set()
+        for user_id in range(1, self.users_count + 1):
+            for author_id in rng.choices(author_order, cum_weights=author_weights, k=min(int(rng.paretovariate(1.2)), 200)):
+                if author_id != user_id:
+                    follows.add((user_id, author_id))
+
+        self._add("users", ("id", "name", "email", "password", "rating", "isbanned", "bannedto", "bannedat",
+                            "phone", "photo"), users)
+        self._add("users_photos", ("user_id", "url"), user_photos)
+        self._add("reviews", ("id", "iduser", "idplace", "text", "rating", "status"), reviews)
+        self._add("reviews_photo", ("review_id", "url"), photos)
+        self._add("reviews_ranks", ("review_id", "user_id", "like", "dislike"), ranks)
+        self._add("follow", ("user_id", "follow_id"), sorted(follows))
+
+    def build(self) -> "Dataset":
+        self._dictionaries()
+        self._places()
+        self._users_and_reviews()
+        return self
+
+    def counts(self) -> dict:
+        return {table: len(rows) for table, (_, rows) in self.tables.items()}
+
+
+def _copy(cursor, table: str, columns: tuple, rows: list, chunk: int = 50000):
+    quoted = ", ".join(f'"{column}"' for column in columns)
+    for start in range(0, len(rows), chunk):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows[start:start + chunk]:
+            writer.writerow(["" if value is None else value for value in row])
+        buffer.seek(0)
+        # Пустое поле без кавычек в CSV-режиме COPY — NULL
+        cursor.copy_expert(f"COPY {table} ({quoted}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def load(dataset: Dataset) -> dict:
+    """Очищает таблицы данных и загружает набор одной транзакцией; {таблица: секунды}"""
+    connection = db_connection()
+    cursor = connection.cursor()
+    timings = {}
+    try:
+        cursor.execute(f"TRUNCATE {', '.join(DATA_TABLES)} RESTART IDENTITY")
+        for table, (columns, rows) in dataset.tables.items():
+            started = time.perf_counter()
+            _copy(cursor, table, columns, rows)
+            timings[table] = round(time.perf_counter() - started, 3)
+            if "id" in columns:
+                cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), GREATEST(MAX(id), 1)) FROM {table}")
+
+        started = time.perf_counter()
+        cursor.execute(RECONCILE_PLACES_SQL)
+        cursor.execute(RECONCILE_REVIEWS_SQL)
+        cursor.execute(RATING_BASELINE_SQL)
+        timings["aggregates"] = round(time.perf_counter() - started, 3)
+
+        started = time.perf_counter()
+        rebuild_feeds(cursor)
+        timings["feeds"] = round(time.perf_counter() - started, 3)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+        connection.close()
+
+    connection = db_connection()
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            started = time.perf_counter()
+            cursor.execute("ANALYZE")
+            timings["analyze"] = round(time.perf_counter() - started, 3)
+    finally:
+        connection.close()
+    return timings
+
+
+def seed(scale: str, seed_value: int = 42) -> dict:
+    places = SCALES[scale] if scale in SCALES else int(scale)
+    error = migration_up()
+    if error:
+        raise RuntimeError(f"Migration failed: {error}")
+    started = time.perf_counter()
+    dataset = Dataset(places, seed_value).build()
+    generated = time.perf_counter() - started
+    timings = load(dataset)
+    return {
+        "scale": scale,
+        "seed": seed_value,
+        "rows": dataset.counts(),
+        "generate_s": round(generated, 3),
+        "load_s": timings,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", default="1k", help="1k, 10k, 100k or a number of places")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="required: truncates all data tables")
+    args = parser.parse_args()
+    if not args.reset:
+        parser.error("--reset is required: the dataset replaces all data in the configured database")
+    json.dump(seed(args.scale, args.seed), sys.stdout, indent=2, ensure_ascii=False)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""Минимальная замена MinIO/S3 для бенчмарков без внешних сервисов.
+
+Понимает ровно то, что делает s3_client: проверку и создание бакета, запрос
+региона, политику бакета, PUT/GET (в том числе Range)/HEAD/DELETE объекта, пакетное удаление и
+multipart-загрузку.
+Подписи не проверяются. Считает запросы и новые TCP-соединения, latency
+добавляет к каждому ответу задержку, имитируя сеть до хранилища.
+"""
+import hashlib
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+class FakeS3State:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.buckets = set()
+        self.objects = {}
+        self.uploads = {}
+        self.requests = 0
+        self.connections = 0
+        self.by_operation = {}
+
+    def count(self, operation: str):
+        with self.lock:
+            self.requests += 1
+            self.by_operation[operation] = self.by_operation.get(operation, 0) + 1
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = 0
+            self.connections = 0
+            self.by_operation = {}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeS3"
+
+    def setup(self):
+        super().setup()
+        with self.server.state.lock:
+            self.server.state.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self) -> FakeS3State:
+        return self.server.state
+
+    def _parse(self):
+        url = urlsplit(self.path)
+        parts = url.path.lstrip("/").split("/", 1)
+        bucket = parts[0]
+        key = parts[1] if len(parts) > 1 else ""
+        return bucket, key, parse_qs(url.query, keep_blank_values=True)
+
+    def _body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _reply(self, status: int, body: bytes = b"", headers: dict = None):
+        if self.state.latency:
+            time.sleep(self.state.latency)
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if "Content-Length" not in (headers or {}):
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _xml(self, status: int, xml: str):
+        self._reply(status, xml.encode("utf-8"), {"Content-Type": "application/xml"})
+
+    def _not_found(self, code: str = "NoSuchKey"):
+        self._xml(404, f"<Error><Code>{code}</Code><Message>{code}</Message></Error>")
+
+    def do_HEAD(self):
+        bucket, key, _ = self._parse()
+        if not key:
+            self.state.count("head_bucket")
+            return self._reply(200 if bucket in self.state.buckets else 404)
+        self.state.count("head_object")
+        data = self.state.objects.get((bucket, key))
+        if data is None:
+            return self._reply(404)
+        self._reply(200, headers={"Content-Length": str(len(data)), "ETag": f'"{hashlib.md5(data).hexdigest()}"'})
+
+    def do_GET(self):
+        bucket, key, query = self._parse()
+        if not key and "location" in query:
+            self.state.count("get_location")
+            return self._xml(200, "<LocationConstraint>us-east-1</LocationConstraint>")
+        self.state.count("get_object")
+        data = self.state.objects.get((bucket, key))
+        if data is None:
+            return self._not_found()
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        byte_range = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range") or "")
+        if byte_range:
+            start = int(byte_range.group(1))
+            end = int(byte_range.group(2)) if byte_range.group(2) else len(data) - 1
+            return self._reply(206, data[start:end + 1], {"ETag": etag})
+        self._reply(200, data, {"ETag": etag})
+
+    def do_PUT(self):
+        bucket, key, query = self._parse()
+        body = self._body()
+        if not key:
+            if "policy" in query:
+                self.state.count("put_policy")
+                return self._reply(204)
+            self.state.count("make_bucket")
+            self.state.buckets.add(bucket)
+            return self._reply(200)
+        if "uploadId" in query:
+            self.state.count("upload_part")
+            upload_id = query["uploadId"][0]
+            part = int(query["partNumber"][0])
+            self.state.uploads[upload_id][part] = body
+            return self._reply(200, headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+        self.state.count("put_object")
+        self.state.objects[(bucket, key)] = body
+        self._reply(200, headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+
+    def do_POST(self):
+        bucket, key, query = self._parse()
+        body = self._body()
+        if "uploads" in query:
+            self.state.count("create_multipart_upload")
+            upload_id = uuid.uuid4().hex
+            self.state.uploads[upload_id] = {}
+            return self._xml(200, f"<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                                  f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>")
+        if "delete" in query:
+            self.state.count("delete_objects")
+            keys = [key.decode("utf-8") for key in re.findall(rb"<Key>([^<]+)</Key>", body)]
+            for key in keys:
+                self.state.objects.pop((bucket, key), None)
+            deleted = "".join(f"<Deleted><Key>{key}</Key></Deleted>" for key in keys)
+            return self._xml(200, f"<DeleteResult>{deleted}</DeleteResult>")
+        if "uploadId" in query:
+            self.state.count("complete_multipart_upload")
+            parts = self.state.uploads.pop(query["uploadId"][0], {})
+            numbers = [int(n) for n in re.findall(rb"<PartNumber>(\d+)</PartNumber>", body)]
+            data = b"".join(parts[n] for n in sorted(numbers))
+            self.state.objects[(bucket, key)] = data
+            return self._xml(200, f"<CompleteMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                                  f"<ETag>\"{hashlib.md5(data).hexdigest()}\"</ETag></CompleteMultipartUploadResult>")
+        self._reply(400)
+
+    def do_DELETE(self):
+        bucket, key, query = self._parse()
+        if "uploadId" in query:
+            self.state.count("abort_multipart_upload")
+            self.state.uploads.pop(query["uploadId"][0], None)
+            return self._reply(204)
+        self.state.count("delete_object")
+        self.state.objects.pop((bucket, key), None)
+        self._reply(204)
+
+
+class FakeS3Server:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.state = FakeS3State(latency)
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.state = self.state
+        self._thread = None
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-s3", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
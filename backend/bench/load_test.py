@@ -0,0 +1,80 @@
+"""Нагрузочный тест: как пропускная способность растёт с конкурентностью.
+
+Запуск против поднятого API (python main.py):
+
+    python bench/load_test.py --base-url http://localhost:8000/api --place-id 1
+
+Для каждого уровня конкурентности одновременно работают N клиентов, которые
+в течение --duration секунд по кругу дёргают /place/point/{id} и /user/login.
+Если обращения к БД блокируют event loop, rps почти не растёт с N; при
+неблокирующем слое данных он растёт примерно до размера пула соединений.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def _worker(client: httpx.AsyncClient, args, deadline: float, latencies: list, errors: list):
+    i = 0
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        try:
+            if i % 2 == 0:
+                response = await client.get(f"/place/point/{args.place_id}")
+            else:
+                response = await client.post("/user/login", json={"email": args.email, "password": args.password})
+            if response.status_code >= 500:
+                errors.append(response.status_code)
+        except httpx.HTTPError as e:
+            errors.append(str(e))
+        latencies.append(time.monotonic() - started)
+        i += 1
+
+
+async def run_level(args, concurrency: int) -> dict:
+    latencies = []
+    errors = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=30) as client:
+        deadline = time.monotonic() + args.duration
+        started = time.monotonic()
+        await asyncio.gather(*[_worker(client, args, deadline, latencies, errors) for _ in range(concurrency)])
+        elapsed = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else 0.0,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else 0.0,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://localhost:8000/api")
+    parser.add_argument("--place-id", type=int, default=1)
+    parser.add_argument("--email", default="bench@example.com")
+    parser.add_argument("--password", default="bench")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--levels", default="1,2,4,8,16,32")
+    args = parser.parse_args()
+
+    results = []
+    for level in [int(x) for x in args.levels.split(",")]:
+        result = await run_level(args, level)
+        results.append(result)
+        print(f"concurrency={result['concurrency']:>3}  rps={result['rps']:8.1f}  "
+              f"p50={result['p50_ms']:7.1f}ms  p95={result['p95_ms']:7.1f}ms  errors={result['errors']}")
+
+    base = results[0]["rps"] or 1.0
+    print("\nscaling vs concurrency=1: " + ", ".join(f"{r['concurrency']}x -> {r['rps'] / base:.2f}" for r in results))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
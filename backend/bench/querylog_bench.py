@@ -0,0 +1,156 @@
+"""Накладные расходы учёта SQL (db.querylog) на один запрос.
+
+    python -m bench.querylog_bench --calls 200000
+    python -m bench.querylog_bench --db --calls 20000   # плюс замер на живой БД из config
+
+Без --db база не нужна: вместо execute ничего не выполняется, замеряется
+только то, что добавляет обвязка. Режимы:
+
+* bare — пустой вызов, точка отсчёта;
+* legacy — прежний log_and_execute: подстановка параметров в текст и два
+  logger.info в синхронный FileHandler;
+* querylog — record_query с учётом в QueryStats и выборкой в журнал через
+  очередь (logs.setup_logging) с QUERY_LOG_SAMPLE_RATE из config.
+
+С --db тот же SELECT по первичному ключу выполняется обычным курсором и
+InstrumentedCursor.
+"""
+import argparse
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import statistics
+import sys
+import tempfile
+import time
+
+from db import querylog
+
+QUERY = """
+    SELECT p.id, p.name, p.latitude, p.longitude
+    FROM places p
+    WHERE p.id = %s AND p.type = %s
+"""
+PARAMS = (42, "Спортзал")
+
+
+class _FakeCursor:
+    rowcount = 1
+
+    def execute(self, query, params=None):
+        pass
+
+
+def _legacy_logger(path: str) -> logging.Logger:
+    legacy = logging.getLogger("bench.legacy")
+    legacy.propagate = False
+    legacy.setLevel(logging.INFO)
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    legacy.handlers[:] = [handler]
+    return legacy
+
+
+def legacy_execute(legacy: logging.Logger, cursor, query, params):
+    # Копия удалённого db.map.log_and_execute
+    log_query = query
+    for param in list(params):
+        if isinstance(param, str):
+            escaped_param = param.replace("'", "''")
+            log_query = log_query.replace('%s', f"'{escaped_param}'", 1)
+        else:
+            log_query = log_query.replace('%s', str(param), 1)
+    legacy.info(f"Executing SQL query: {log_query}")
+    legacy.info(f"Query params: {params}")
+    cursor.execute(query, params)
+
+
+def querylog_execute(cursor, query, params):
+    started = time.perf_counter()
+    cursor.execute(query, params)
+    querylog.record_query(cursor, query, params, time.perf_counter() - started, depth=2)
+
+
+def _per_call(func, calls: int, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for _ in range(calls):
+            func()
+        timings.append((time.perf_counter() - started) / calls)
+    return statistics.median(timings)
+
+
+def run_micro(args, log_dir: str) -> dict:
+    cursor = _FakeCursor()
+    legacy = _legacy_logger(os.path.join(log_dir, "legacy.log"))
+
+    records = queue.SimpleQueue()
+    handler = logging.FileHandler(os.path.join(log_dir, "querylog.log"))
+    listener = logging.handlers.QueueListener(records, handler)
+    query_logger = logging.getLogger("db.query")
+    query_logger.propagate = False
+    query_logger.setLevel(logging.INFO)
+    query_logger.handlers[:] = [logging.handlers.QueueHandler(records)]
+    listener.start()
+
+    stats, token = querylog.start_query_stats()
+    try:
+        results = {
+            "bare_us": _per_call(lambda: cursor.execute(QUERY, PARAMS), args.calls, args.repeats),
+            "legacy_us": _per_call(lambda: legacy_execute(legacy, cursor, QUERY, PARAMS), args.calls, args.repeats),
+            "querylog_us": _per_call(lambda: querylog_execute(cursor, QUERY, PARAMS), args.calls, args.repeats),
+        }
+    finally:
+        querylog.stop_query_stats(token)
+        listener.stop()
+
+    results = {name: round(value * 1e6, 3) for name, value in results.items()}
+    results["querylog_overhead_us"] = round(results["querylog_us"] - results["bare_us"], 3)
+    results["legacy_overhead_us"] = round(results["legacy_us"] - results["bare_us"], 3)
+    results["sample_rate"] = querylog.QUERY_LOG_SAMPLE_RATE
+    results["queries_counted"] = stats.queries
+    return results
+
+
+def run_db(args) -> dict:
+    import psycopg2
+    from db.migration import db_config
+
+    out = {}
+    for name, factory in (("plain", None), ("instrumented", querylog.InstrumentedCursor)):
+        connection = psycopg2.connect(**db_config, cursor_factory=factory)
+        try:
+            cursor = connection.cursor()
+            for _ in range(100):
+                cursor.execute("SELECT id FROM places WHERE id = %s", (1,))
+            started = time.perf_counter()
+            for _ in range(args.calls):
+                cursor.execute("SELECT id FROM places WHERE id = %s", (1,))
+                cursor.fetchall()
+            out[f"{name}_us"] = round((time.perf_counter() - started) / args.calls * 1e6, 2)
+        finally:
+            connection.close()
+    out["overhead_pct"] = round((out["instrumented_us"] / out["plain_us"] - 1) * 100, 2)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200_000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--db", action="store_true", help="also measure against the database from config")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        report = {"micro": run_micro(args, log_dir)}
+    if args.db:
+        report["db"] = run_db(args)
+    json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Параллельные начисления рейтинга: потерянные обновления и пропускная способность.
+
+    python -m bench.rating_bench --threads 16 --awards 500 --users 4
+
+Нужна база из config со схемой (python -m bench.dataset ... --reset). Потоки
+начисляют по +1 небольшому числу «горячих» пользователей, как лайки
+популярным авторам, двумя способами:
+
+* legacy — прежний код: SELECT rating, затем UPDATE абсолютным значением;
+* ledger — db.ratings.award: событие и rating = rating + 1 одним выражением.
+
+Для каждого режима печатается число начислений в секунду и сколько из них
+потеряно (ожидаемый прирост минус фактический). Изменения откатываются
+обратными начислениями, журнал сверяется в конце.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+
+from db.migration import db_connection
+from db.ratings import award, DRIFT_SQL
+
+REASON = "bench"
+
+
+def legacy_award(cursor, user_id: int, delta: int):
+    cursor.execute("SELECT id, rating FROM users WHERE id = %s", (user_id,))
+    row = cursor.fetchone()
+    cursor.execute("UPDATE users SET rating = %s WHERE id = %s", (row[1] + delta, user_id))
+
+
+def ledger_award(cursor, user_id: int, delta: int):
+    award(cursor, user_id, delta, REASON)
+
+
+def _ratings(cursor, user_ids: list) -> dict:
+    cursor.execute("SELECT id, COALESCE(rating, 0) FROM users WHERE id = ANY(%s)", (user_ids,))
+    return dict(cursor.fetchall())
+
+
+def run_mode(name: str, func, user_ids: list, threads: int, awards: int) -> dict:
+    control = db_connection()
+    control.autocommit = True
+    cursor = control.cursor()
+    before = _ratings(cursor, user_ids)
+    errors = []
+
+    def worker(index: int):
+        connection = db_connection()
+        try:
+            with connection.cursor() as worker_cursor:
+                for n in range(awards):
+                    try:
+                        func(worker_cursor, user_ids[(index + n) % len(user_ids)], 1)
+                        connection.commit()
+                    except Exception as e:
+                        connection.rollback()
+                        errors.append(type(e).__name__)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    after = _ratings(cursor, user_ids)
+    applied = sum(after[u] - before[u] for u in user_ids)
+    expected = threads * awards - len(errors)
+
+    # Откат: ledger — обратными событиями, legacy — прямым UPDATE, как и писал
+    for user_id in user_ids:
+        change = after[user_id] - before[user_id]
+        if func is ledger_award:
+            award(cursor, user_id, -change, REASON)
+        else:
+            cursor.execute("UPDATE users SET rating = rating - %s WHERE id = %s", (change, user_id))
+    control.close()
+    return {
+        "mode": name,
+        "awards_per_s": round(threads * awards / elapsed),
+        "expected": expected,
+        "applied": applied,
+        "lost": expected - applied,
+        "errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--awards", type=int, default=500, help="awards per thread")
+    parser.add_argument("--users", type=int, default=4, help="number of hot users")
+    args = parser.parse_args()
+
+    connection = db_connection()
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT id FROM users WHERE isbanned = false ORDER BY id LIMIT %s", (args.users,))
+        user_ids = [row[0] for row in cursor.fetchall()]
+    if not user_ids:
+        raise SystemExit("No users: run python -m bench.dataset --reset first")
+
+    results = [
+        run_mode("legacy", legacy_award, user_ids, args.threads, args.awards),
+        run_mode("ledger", ledger_award, user_ids, args.threads, args.awards),
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM rating_events WHERE reason = %s", (REASON,))
+        cursor.execute(DRIFT_SQL)
+        drift = cursor.fetchall()
+    connection.close()
+    json.dump({"users": user_ids, "results": results, "ledger_drift_users": len(drift)}, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
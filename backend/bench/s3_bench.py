@@ -0,0 +1,133 @@
+"""Бенчмарк загрузки фото: клиент на каждую загрузку против общего клиента.
+
+Поднимает bench/fake_s3.py вместо MinIO, поэтому внешние сервисы не нужны:
+
+    python -m bench.s3_bench --uploads 200 --concurrency 8 --size 200000 --latency 0.002
+
+legacy повторяет прежний upload_photo: три новых клиента (свой пул и TCP-
+соединение, запрос региона у каждого), bucket_exists и set_bucket_policy
+перед каждым PUT. pooled — текущий s3_client: общий клиент, бакет
+подготовлен один раз, загрузка — upload_photo_stream, как в /photo/upload.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from minio import Minio
+
+from bench.fake_s3 import FakeS3Server
+
+BUCKET = "bench-photos"
+# Сигнатура JPEG: без неё upload_photo_stream отклонит загрузку
+JPEG_HEAD = b"\xff\xd8\xff"
+CHUNK_SIZE = 64 * 1024
+
+
+def _legacy_client(endpoint: str) -> Minio:
+    return Minio(endpoint, access_key="bench", secret_key="benchbench", secure=False)
+
+
+def legacy_upload(endpoint: str, data: bytes) -> str:
+    client = _legacy_client(endpoint)
+    # ensure_bucket_exists() и set_bucket_public_policy() создавали каждый свой клиент
+    if not _legacy_client(endpoint).bucket_exists(BUCKET):
+        _legacy_client(endpoint).make_bucket(BUCKET)
+    policy = {"Version": "2012-10-17", "Statement": [{
+        "Effect": "Allow", "Principal": {"AWS": "*"}, "Action": ["s3:GetObject"],
+        "Resource": [f"arn:aws:s3:::{BUCKET}/*"]}]}
+    _legacy_client(endpoint).set_bucket_policy(BUCKET, json.dumps(policy))
+    object_name = f"reviews/{uuid.uuid4()}.jpg"
+    client.put_object(BUCKET, object_name, BytesIO(data), len(data), content_type="image/jpeg")
+    return object_name
+
+
+def _configure_s3_client(endpoint: str):
+    import config
+    config.MINIO_ENDPOINT = endpoint
+    config.MINIO_ACCESS_KEY = "bench"
+    config.MINIO_SECRET_KEY = "benchbench"
+    config.MINIO_SECURE = False
+    config.MINIO_BUCKET = BUCKET
+    config.MINIO_PUBLIC_URL = f"http://{endpoint}"
+    config.MINIO_REGION = "us-east-1"
+
+    import s3_client
+    s3_client.close_minio_client()
+    s3_client.ensure_bucket_exists()
+    return s3_client
+
+
+async def _chunks(data: bytes):
+    # Так тело запроса приходит из request.stream()
+    for start in range(0, len(data), CHUNK_SIZE):
+        yield data[start:start + CHUNK_SIZE]
+
+
+def run(mode: str, server: FakeS3Server, args) -> dict:
+    payloads = [JPEG_HEAD + os.urandom(args.size - len(JPEG_HEAD)) for _ in range(args.uploads)]
+    loop = None
+    if mode == "legacy":
+        upload = lambda data: legacy_upload(server.endpoint, data)
+    else:
+        s3_client = _configure_s3_client(server.endpoint)
+        # Один event loop на все загрузки, как у процесса API
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+        upload = lambda data: asyncio.run_coroutine_threadsafe(
+            s3_client.upload_photo_stream(_chunks(data)), loop).result()
+    server.state.reset_counters()
+
+    def timed(data):
+        started = time.perf_counter()
+        upload(data)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        latencies = sorted(pool.map(timed, payloads))
+    elapsed = time.perf_counter() - started
+    if loop is not None:
+        loop.call_soon_threadsafe(loop.stop)
+
+    return {
+        "mode": mode,
+        "uploads": args.uploads,
+        "uploads_per_s": round(args.uploads / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+        "requests_per_upload": round(server.state.requests / args.uploads, 2),
+        "connections_per_upload": round(server.state.connections / args.uploads, 3),
+        "operations": dict(server.state.by_operation),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uploads", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--size", type=int, default=200_000, help="bytes per photo")
+    parser.add_argument("--latency", type=float, default=0.002, help="simulated storage RTT, seconds")
+    parser.add_argument("--modes", default="legacy,pooled")
+    args = parser.parse_args()
+    # Логи каждого запроса к хранилищу искажают замер
+    logging.disable(logging.INFO)
+
+    results = []
+    with FakeS3Server(latency=args.latency) as server:
+        for mode in args.modes.split(","):
+            results.append(run(mode, server, args))
+    json.dump(results, sys.stdout, indent=2, ensure_ascii=False)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,3 +3,52 @@ DB_PORT = 5432
 DB_PASSWORD = "1234"
 DB_USER = "root"
 DB_HOST = "localhost"
+DB_POOL_MIN_SIZE = 1
+DB_POOL_MAX_SIZE = 10
+DB_POOL_TIMEOUT = 5.0
+DB_POOL_HEALTH_CHECK_INTERVAL = 30.0
+DB_EXECUTOR_WORKERS = 10
+TILE_MAX_ZOOM = 18
+TILE_CACHE_MAX_ENTRIES = 2048
+TILE_CACHE_DIR = "tile_cache"
+PLACE_CACHE_MAX_ENTRIES = 1024
+PLACE_CACHE_TTL = 300.0
+MODERATION_CLASSIFIER = "llm"
+MODERATION_BATCH_SIZE = 10
+MODERATION_BATCH_WAIT = 0.5
+MODERATION_CONCURRENCY = 2
+MODERATION_MAX_RETRIES = 3
+MODERATION_RETRY_BACKOFF = 1.0
+MODERATION_RESWEEP_INTERVAL = 300.0
+MODERATION_CLAIM_TTL = 900.0
+MODERATION_VERDICT_TTL = 2592000
+MODERATION_VERDICT_MAX_ENTRIES = 100000
+MODERATION_VERDICT_MEMORY_ENTRIES = 10000
+MODERATION_PREFILTER = False
+MODERATION_PREFILTER_CLEAN_THRESHOLD = 0.15
+PHOTO_MAX_UPLOAD_SIZE = 20971520
+PHOTO_UPLOAD_PART_SIZE = 5242880
+PHOTO_PRESIGN_EXPIRES = 600
+PHOTO_GC_GRACE = 86400
+PHOTO_GC_BATCH_SIZE = 500
+PHOTO_UPLOAD_GRACE = 3600
+S3_POOL_MAXSIZE = 32
+S3_CONNECT_TIMEOUT = 5.0
+S3_READ_TIMEOUT = 60.0
+IMAGE_FORMAT = "webp"
+IMAGE_WORKERS = 2
+IMAGE_MAX_PIXELS = 40000000
+LOG_LEVEL = "INFO"
+LOG_LEVELS = {"db.query": "INFO", "urllib3": "WARNING"}
+LOG_FILE = "app.log"
+QUERY_LOG_SAMPLE_RATE = 0.01
+QUERY_LOG_SLOW_MS = 200.0
+LEADERBOARD_MAX_AGE = 3600.0
+FEED_FANOUT_LIMIT = 1000
+FEED_MAX_ITEMS = 500
+FEED_BACKFILL = 50
+FEED_PAGE_SIZE = 20
+FEED_TRIM_INTERVAL = 600.0
+RATING_COMPACT_AFTER = 2592000
+PLACE_IMPORT_MAX_SIZE = 104857600
+PLACE_EXPORT_BATCH = 5000
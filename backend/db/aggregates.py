@@ -0,0 +1,105 @@
+"""Денормализованные агрегаты отзывов.
+
+places.review_count/rating_count/rating_sum/review_rank и
+reviews.like_count/dislike_count обновляются в той же транзакции, что и
+сами отзывы и оценки, поэтому списки читают их без AVG и COUNT.
+
+Сверка с исходными таблицами (исправляет и печатает расхождения):
+
+    python -m db.aggregates
+"""
+import logging
+import sys
+from typing import Optional
+
+import psycopg2
+from psycopg2 import sql
+
+from db.executor import run_in_db_thread
+from db.migration import RECONCILE_PLACES_SQL, RECONCILE_REVIEWS_SQL
+from db.pool import get_connection
+
+logger = logging.getLogger(__name__)
+
+
+def apply_review_added(cursor, place_id: int, rating: Optional[int]):
+    _apply_review_delta(cursor, place_id, 1, rating)
+
+
+def apply_review_removed(cursor, place_id: int, rating: Optional[int]):
+    _apply_review_delta(cursor, place_id, -1, rating)
+
+
+def _apply_review_delta(cursor, place_id: int, sign: int, rating: Optional[int]):
+    rated = sign if rating is not None else 0
+    rating_delta = sign * rating if rating is not None else 0
+    query = sql.SQL("""
+        UPDATE places SET
+            review_count = review_count + %(sign)s,
+            rating_count = rating_count + %(rated)s,
+            rating_sum = rating_sum + %(rating_delta)s,
+            review_rank = CASE WHEN rating_count + %(rated)s > 0
+                THEN round((rating_sum + %(rating_delta)s)::numeric / (rating_count + %(rated)s), 2)
+                ELSE 0 END
+        WHERE id = %(place_id)s
+    """)
+    cursor.execute(query, {"sign": sign, "rated": rated, "rating_delta": rating_delta, "place_id": place_id})
+
+
+def apply_rank_delta(cursor, review_id: int, like_delta: int, dislike_delta: int):
+    if not like_delta and not dislike_delta:
+        return
+    query = sql.SQL("""
+        UPDATE reviews SET
+            like_count = like_count + %s,
+            dislike_count = dislike_count + %s
+        WHERE id = %s
+    """)
+    cursor.execute(query, (like_delta, dislike_delta, review_id))
+
+
+@run_in_db_thread
+def reconcile_aggregates(fix: bool = True) -> dict:
+    """Пересчитывает агрегаты целиком и сообщает, где они разошлись.
+
+    С fix=False изменения откатываются, и функция только считает расхождения.
+    """
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            cursor.execute(RECONCILE_PLACES_SQL)
+            drifted_places = [row[0] for row in cursor.fetchall()]
+            cursor.execute(RECONCILE_REVIEWS_SQL)
+            review_rows = cursor.fetchall()
+            drifted_reviews = [row[0] for row in review_rows]
+
+            if fix:
+                connection.commit()
+            else:
+                connection.rollback()
+
+            report = {
+                "fixed": fix,
+                "places_drifted": len(drifted_places),
+                "reviews_drifted": len(drifted_reviews),
+                "place_ids": drifted_places[:100],
+                "review_ids": drifted_reviews[:100],
+                "affected_place_ids": sorted({row[1] for row in review_rows} | set(drifted_places)),
+            }
+            if drifted_places or drifted_reviews:
+                logger.warning(f"Aggregate drift: {len(drifted_places)} places, {len(drifted_reviews)} reviews")
+            return report
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+if __name__ == "__main__":
+    result = reconcile_aggregates.sync(fix="--dry-run" not in sys.argv)
+    result.pop("affected_place_ids")
+    print(result)
@@ -0,0 +1,551 @@
+"""Массовый импорт и экспорт мест (CSV/XLSX).
+
+Файл импорта — таблица мест, по строке на место:
+
+    ref, name, info, coord1, coord2, type, food_type, sport_type,
+    is_alcohol, is_health, is_insurance, is_nosmoking, is_smoke, photos
+
+ref — ключ строки внутри файла (по умолчанию номер строки), photos — url
+через «;». Типы задаются названием из справочника или id. В XLSX кроме
+листа places (или первого листа) могут быть листы products (ref, type,
+name, min_cost, is_health, is_alcohol, is_smoking), ads (ref, type, name,
+is_health) и equipment (ref, type, count), строки которых ссылаются на
+место по ref. Лишние колонки игнорируются, экспорт пишет тот же формат,
+поэтому выгрузку можно загрузить в другую базу.
+
+Текст, который начинается с =, +, -, @ (или табуляции, возврата каретки),
+Excel выполнил бы как формулу. В CSV такие ячейки выгружаются с апострофом
+впереди, импорт его снимает; в XLSX они записываются строковыми ячейками.
+
+Проверка идёт целыми колонками pandas, названия типов переводятся в id по
+справочникам, загруженным одним запросом на таблицу. Строки уходят через
+COPY во временные таблицы, а оттуда несколькими INSERT ... SELECT и одним
+пересчётом рейтинга полезности попадают в places и дочерние таблицы в одной
+транзакции: файл загружается целиком или не загружается вовсе. Рейтинг
+пользователям за импорт не начисляется.
+
+    python -m db.bulk import places.xlsx [--dry-run] [--skip-invalid]
+    python -m db.bulk export places.csv [--table products]
+"""
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import Optional
+
+import pandas as pd
+import psycopg2
+
+import config as config
+from db.executor import run_in_db_thread
+from db.map import HEALTH_RATING_SQL
+from db.pool import get_connection
+
+logger = logging.getLogger(__name__)
+
+PLACE_IMPORT_MAX_SIZE = getattr(config, 'PLACE_IMPORT_MAX_SIZE', 100 * 1024 * 1024)
+PLACE_EXPORT_BATCH = getattr(config, 'PLACE_EXPORT_BATCH', 5000)
+# Сколько ошибок проверки возвращать в отчёте; считаются все
+PLACE_IMPORT_MAX_ERRORS = 100
+
+CSV = "csv"
+XLSX = "xlsx"
+
+# Начало ячейки, с которого табличные редакторы читают формулу
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+_ESCAPED_FORMULA = r"^'(?=[=+\-@\t\r])"
+
+SHEETS = ("places", "products", "ads", "equipment")
+
+# Колонка файла -> (справочник, обязательна ли)
+TYPE_COLUMNS = {
+    "places": {"type": ("places_type", False), "food_type": ("food_type", False),
+               "sport_type": ("sport_type", False)},
+    "products": {"type": ("product_type", False)},
+    "ads": {"type": ("reklama_type", False)},
+    "equipment": {"type": ("sport_interfaces", True)},
+}
+BOOL_COLUMNS = {
+    "places": ("is_alcohol", "is_health", "is_insurance", "is_nosmoking", "is_smoke"),
+    "products": ("is_health", "is_alcohol", "is_smoking"),
+    "ads": ("is_health",),
+    "equipment": (),
+}
+TEXT_COLUMNS = {
+    "places": ("name", "info", "photos"),
+    "products": ("name",),
+    "ads": ("name",),
+    "equipment": (),
+}
+
+_TRUE = {"true", "1", "yes", "y", "да", "+"}
+_FALSE = {"false", "0", "no", "n", "нет", "-"}
+
+# Временные таблицы живут до конца транзакции; line — порядок строк в файле
+STAGING_SQL = """
+    CREATE TEMP TABLE import_places (
+        line int, ref varchar, name varchar, info varchar, coord1 float, coord2 float,
+        type int, foodtype int, sporttype int, isalcohol bool, ishealth bool, isinsurence bool,
+        isnosmoking bool, issmoke bool,
+        id int DEFAULT nextval(pg_get_serial_sequence('places', 'id'))
+    ) ON COMMIT DROP;
+    CREATE TEMP TABLE import_products (
+        line int, ref varchar, type int, name varchar, min_cost float,
+        ishealth bool, isalcohol bool, issmoking bool
+    ) ON COMMIT DROP;
+    CREATE TEMP TABLE import_ads (line int, ref varchar, type int, name varchar, ishelth bool) ON COMMIT DROP;
+    CREATE TEMP TABLE import_equipment (line int, ref varchar, id_interface int, count int) ON COMMIT DROP;
+    CREATE TEMP TABLE import_photos (position int, ref varchar, url varchar) ON COMMIT DROP;
+"""
+
+# (временная таблица, её колонки, колонки DataFrame в том же порядке)
+STAGING_COLUMNS = {
+    "places": ("import_places",
+               ("line", "ref", "name", "info", "coord1", "coord2", "type", "foodtype", "sporttype",
+                "isalcohol", "ishealth", "isinsurence", "isnosmoking", "issmoke"),
+               ("line", "ref", "name", "info", "coord1", "coord2", "type", "food_type", "sport_type",
+                "is_alcohol", "is_health", "is_insurance", "is_nosmoking", "is_smoke")),
+    "products": ("import_products",
+                 ("line", "ref", "type", "name", "min_cost", "ishealth", "isalcohol", "issmoking"),
+                 ("line", "ref", "type", "name", "min_cost", "is_health", "is_alcohol", "is_smoking")),
+    "ads": ("import_ads", ("line", "ref", "type", "name", "ishelth"),
+            ("line", "ref", "type", "name", "is_health")),
+    "equipment": ("import_equipment", ("line", "ref", "id_interface", "count"),
+                  ("line", "ref", "type", "count")),
+    "photos": ("import_photos", ("position", "ref", "url"), ("position", "ref", "url")),
+}
+
+# id мест выдаются из последовательности places ещё при COPY (DEFAULT
+# временной таблицы), поэтому дочерние строки вставляются первыми, а рейтинг
+# полезности считается в том же INSERT мест, без второго прохода по ним
+MERGE_SQL = f"""
+    ANALYZE import_places;
+
+    INSERT INTO product (id_place, type, name, min_cost, ishealth, isalcohol, issmoking)
+    SELECT p.id, s.type, s.name, s.min_cost,
+        COALESCE(s.ishealth, false), COALESCE(s.isalcohol, false), COALESCE(s.issmoking, false)
+    FROM import_products s JOIN import_places p ON p.ref = s.ref ORDER BY s.line;
+
+    INSERT INTO reklama (id_place, type, name, ishelth)
+    SELECT p.id, s.type, s.name, COALESCE(s.ishelth, false)
+    FROM import_ads s JOIN import_places p ON p.ref = s.ref ORDER BY s.line;
+
+    INSERT INTO sport_interfaces_place (id_place, id_interface, count)
+    SELECT p.id, s.id_interface, s.count
+    FROM import_equipment s JOIN import_places p ON p.ref = s.ref ORDER BY s.line;
+
+    INSERT INTO places_photos (place_id, url)
+    SELECT p.id, s.url
+    FROM import_photos s JOIN import_places p ON p.ref = s.ref ORDER BY s.position;
+
+    INSERT INTO places (id, name, info, coord1, coord2, type, foodtype, sporttype,
+        isalcohol, ishealth, isinsurence, isnosmoking, issmoke, rating)
+    SELECT id, name, info, coord1, coord2, type, foodtype, sporttype,
+        COALESCE(isalcohol, false), COALESCE(ishealth, false), COALESCE(isinsurence, false),
+        COALESCE(isnosmoking, false), COALESCE(issmoke, false), {HEALTH_RATING_SQL}
+    FROM import_places p ORDER BY line;
+
+    SELECT count(*), min(id), max(id) FROM import_places;
+"""
+
+# Выгрузка: (заголовок, запрос). Типы выгружаются названиями, ref — id места
+EXPORT_QUERIES = {
+    "places": (
+        ("ref", "name", "info", "coord1", "coord2", "type", "food_type", "sport_type",
+         "is_alcohol", "is_health", "is_insurance", "is_nosmoking", "is_smoke", "photos",
+         "rating", "is_moderated"),
+        """
+        SELECT p.id, p.name, p.info, p.coord1, p.coord2, pt.type, ft.type, st.type,
+            p.isalcohol, p.ishealth, p.isinsurence, p.isnosmoking, p.issmoke,
+            (SELECT string_agg(url, ';' ORDER BY id) FROM places_photos WHERE place_id = p.id),
+            p.rating, p.is_moderated
+        FROM places p
+        LEFT JOIN places_type pt ON pt.id = p.type
+        LEFT JOIN food_type ft ON ft.id = p.foodtype
+        LEFT JOIN sport_type st ON st.id = p.sporttype
+        ORDER BY p.id
+        """),
+    "products": (
+        ("ref", "type", "name", "min_cost", "is_health", "is_alcohol", "is_smoking"),
+        """
+        SELECT pr.id_place, prt.type, pr.name, pr.min_cost, pr.ishealth, pr.isalcohol, pr.issmoking
+        FROM product pr LEFT JOIN product_type prt ON prt.id = pr.type
+        ORDER BY pr.id_place, pr.id
+        """),
+    "ads": (
+        ("ref", "type", "name", "is_health"),
+        """
+        SELECT r.id_place, rt.type, r.name, r.ishelth
+        FROM reklama r LEFT JOIN reklama_type rt ON rt.id = r.type
+        ORDER BY r.id_place, r.id
+        """),
+    "equipment": (
+        ("ref", "type", "count"),
+        """
+        SELECT sp.id_place, si.type, sp.count
+        FROM sport_interfaces_place sp LEFT JOIN sport_interfaces si ON si.id = sp.id_interface
+        ORDER BY sp.id_place, sp.id_interface
+        """),
+}
+
+
+class ImportFormatError(Exception):
+    """Файл не читается как CSV/XLSX или в нём нет обязательных колонок"""
+
+
+def detect_format(data: bytes, content_type: Optional[str] = None) -> str:
+    """XLSX — zip-архив, всё остальное читается как CSV"""
+    if data[:4] == b"PK\x03\x04" or (content_type or "").endswith("spreadsheetml.sheet"):
+        return XLSX
+    return CSV
+
+
+def _delimiter(data: bytes) -> str:
+    """Разделитель по строке заголовка: Excel в русской локали сохраняет CSV через «;»"""
+    header = data[:4096].decode("utf-8", errors="ignore").lstrip("\ufeff").splitlines()[:1]
+    try:
+        return csv.Sniffer().sniff(header[0], delimiters=",;\t").delimiter
+    except (csv.Error, IndexError):
+        return ","
+
+
+def read_frames(data: bytes, kind: str) -> dict:
+    """Листы файла как DataFrame со строковыми колонками: {"places": ..., "products": ...}"""
+    try:
+        if kind == XLSX:
+            sheets = pd.read_excel(io.BytesIO(data), sheet_name=None, dtype=str, keep_default_na=False)
+            named = {name.strip().lower(): frame for name, frame in sheets.items()}
+            frames = {sheet: named[sheet] for sheet in SHEETS if sheet in named}
+            if "places" not in frames and sheets:
+                frames["places"] = next(iter(sheets.values()))
+        else:
+            frames = {"places": pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False,
+                                            sep=_delimiter(data), encoding="utf-8-sig")}
+    except Exception as error:
+        raise ImportFormatError(f"Cannot read {kind} file: {error}")
+
+    out = {}
+    for sheet, frame in frames.items():
+        frame = frame.fillna("")
+        frame.columns = [str(column).strip().lower() for column in frame.columns]
+        # Апостроф перед формулой добавляет export_csv — снимаем его
+        out[sheet] = frame.apply(
+            lambda column: column.astype(str).str.strip().str.replace(_ESCAPED_FORMULA, "", regex=True))
+    if "places" not in out or "name" not in out["places"].columns:
+        raise ImportFormatError("Places sheet must have a 'name' column")
+    return out
+
+
+class _Checker:
+    """Копит ошибки проверки и маски отклонённых строк по листам"""
+
+    def __init__(self):
+        self.errors = []
+        self.error_count = 0
+        self.rejected = {}
+
+    def check(self, sheet: str, frame: pd.DataFrame, bad: pd.Series, column: str, message: str):
+        if not bad.any():
+            return
+        self.rejected[sheet] = self.rejected.get(sheet, False) | bad
+        lines = frame.loc[bad, "line"]
+        self.error_count += len(lines)
+        room = PLACE_IMPORT_MAX_ERRORS - len(self.errors)
+        for line in lines.head(max(room, 0)):
+            self.errors.append({"sheet": sheet, "line": int(line), "column": column, "message": message})
+
+    def valid(self, sheet: str, frame: pd.DataFrame) -> pd.Series:
+        rejected = self.rejected.get(sheet)
+        if rejected is None:
+            return pd.Series(True, index=frame.index)
+        return ~rejected
+
+
+def _column(frame: pd.DataFrame, name: str) -> pd.Series:
+    return frame[name] if name in frame.columns else pd.Series("", index=frame.index)
+
+
+def _bools(checker: _Checker, sheet: str, frame: pd.DataFrame, name: str) -> pd.Series:
+    values = _column(frame, name).str.lower()
+    out = pd.Series(None, index=frame.index, dtype="boolean")
+    out[values.isin(_TRUE)] = True
+    out[values.isin(_FALSE)] = False
+    checker.check(sheet, frame, values.ne("") & out.isna(), name, "expected true/false")
+    return out
+
+
+def _numbers(checker: _Checker, sheet: str, frame: pd.DataFrame, name: str, low=None, high=None,
+             required: bool = False, integer: bool = False) -> pd.Series:
+    raw = _column(frame, name)
+    values = pd.to_numeric(raw.str.replace(",", ".", regex=False), errors="coerce")
+    checker.check(sheet, frame, raw.ne("") & values.isna(), name, "expected a number")
+    if required:
+        checker.check(sheet, frame, raw.eq(""), name, "required")
+    out_of_range = pd.Series(False, index=frame.index)
+    if low is not None:
+        out_of_range |= values < low
+    if high is not None:
+        out_of_range |= values > high
+    bounds = f"in [{low}, {high}]" if high is not None else f">= {low}"
+    checker.check(sheet, frame, out_of_range, name, f"expected a value {bounds}")
+    if integer:
+        checker.check(sheet, frame, values.notna() & (values % 1 != 0), name, "expected an integer")
+        return values.where(values % 1 == 0).astype("Int64")
+    return values
+
+
+def _types(checker: _Checker, sheet: str, frame: pd.DataFrame, name: str, lookup: dict,
+           required: bool) -> pd.Series:
+    """Название типа или его id -> id справочника одним map по колонке"""
+    raw = _column(frame, name)
+    ids = raw.str.lower().map(lookup).astype("Int64")
+    checker.check(sheet, frame, raw.ne("") & ids.isna(), name, "unknown type")
+    if required:
+        checker.check(sheet, frame, raw.eq(""), name, "required")
+    return ids
+
+
+def load_type_lookups(cursor) -> dict:
+    """{справочник: {название в нижнем регистре или id строкой: id}}"""
+    lookups = {}
+    for table in sorted({table for columns in TYPE_COLUMNS.values() for table, _ in columns.values()}):
+        cursor.execute(f"SELECT id, type FROM {table}")
+        lookup = {}
+        for type_id, name in cursor.fetchall():
+            lookup[str(type_id)] = type_id
+            if name:
+                lookup.setdefault(name.strip().lower(), type_id)
+        lookups[table] = lookup
+    return lookups
+
+
+def validate(frames: dict, lookups: dict) -> tuple:
+    """Проверяет и приводит листы к типам временных таблиц: (листы, _Checker)"""
+    checker = _Checker()
+    out = {}
+    for sheet in SHEETS:
+        if sheet not in frames:
+            continue
+        frame = frames[sheet].reset_index(drop=True)
+        # Номер строки как в редакторе: первая строка — заголовок
+        frame["line"] = frame.index + 2
+        clean = pd.DataFrame({"line": frame["line"]})
+
+        if sheet == "places":
+            clean["ref"] = frame["ref"] if "ref" in frame.columns else frame["line"].astype(str)
+            checker.check(sheet, frame, clean["ref"].eq(""), "ref", "required")
+            checker.check(sheet, frame, clean["ref"].duplicated(keep=False) & clean["ref"].ne(""), "ref",
+                          "duplicate ref")
+            checker.check(sheet, frame, frame["name"].eq(""), "name", "required")
+            clean["coord1"] = _numbers(checker, sheet, frame, "coord1", -90, 90, required=True)
+            clean["coord2"] = _numbers(checker, sheet, frame, "coord2", -180, 180, required=True)
+        else:
+            clean["ref"] = _column(frame, "ref")
+            checker.check(sheet, frame, clean["ref"].eq(""), "ref", "required")
+            if sheet == "products":
+                clean["min_cost"] = _numbers(checker, sheet, frame, "min_cost", 0)
+            if sheet == "equipment":
+                clean["count"] = _numbers(checker, sheet, frame, "count", 0, integer=True)
+
+        for name in TEXT_COLUMNS[sheet]:
+            clean[name] = _column(frame, name).replace("", None)
+        for name in BOOL_COLUMNS[sheet]:
+            clean[name] = _bools(checker, sheet, frame, name)
+        for name, (table, required) in TYPE_COLUMNS[sheet].items():
+            clean[name] = _types(checker, sheet, frame, name, lookups[table], required)
+        out[sheet] = (frame, clean)
+
+    places_frame, places = out["places"]
+    for sheet in SHEETS[1:]:
+        if sheet in out:
+            frame, clean = out[sheet]
+            checker.check(sheet, frame, clean["ref"].ne("") & ~clean["ref"].isin(places["ref"]), "ref",
+                          "no place with this ref")
+
+    # Дочерние строки отклонённого места тоже не загружаются
+    valid_refs = places.loc[checker.valid("places", places_frame), "ref"]
+    result = {}
+    for sheet, (frame, clean) in out.items():
+        keep = checker.valid(sheet, frame)
+        if sheet != "places":
+            keep &= clean["ref"].isin(valid_refs)
+        result[sheet] = clean[keep]
+
+    places = result["places"]
+    photos = places[["ref", "photos"]].dropna(subset=["photos"])
+    photos = photos.assign(url=photos["photos"].str.split(r"[;\s]+")).explode("url")
+    photos = photos[photos["url"].notna() & photos["url"].ne("")]
+    # Порядок фото места сохраняется по сквозному номеру, строки файла у них общие
+    result["photos"] = photos.assign(position=range(len(photos)))
+    return result, checker
+
+
+def _copy(cursor, sheet: str, frame: pd.DataFrame):
+    table, columns, source = STAGING_COLUMNS[sheet]
+    if frame.empty:
+        return
+    buffer = io.StringIO()
+    # Пустое поле без кавычек в CSV-режиме COPY — NULL
+    frame[list(source)].to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+@run_in_db_thread
+def import_places(data: bytes, kind: str, skip_invalid: bool = False, dry_run: bool = False) -> dict:
+    """Загружает файл мест одной транзакцией.
+
+    С ошибками в строках ничего не записывается, если не передан skip_invalid:
+    тогда пропускаются только неверные строки (и дочерние строки неверных мест).
+    dry_run только проверяет файл. Бросает ImportFormatError, если файл не читается.
+    """
+    started = time.perf_counter()
+    frames = read_frames(data, kind)
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            sheets, checker = validate(frames, load_type_lookups(cursor))
+            report = {
+                "format": kind,
+                "rows": {sheet: len(frame) for sheet, frame in frames.items()},
+                "valid": {sheet: len(frame) for sheet, frame in sheets.items()},
+                "error_count": checker.error_count,
+                "errors": checker.errors,
+                "imported": False,
+                "place_ids": None,
+            }
+            if dry_run or (checker.error_count and not skip_invalid) or sheets["places"].empty:
+                return report
+
+            cursor.execute(STAGING_SQL)
+            for sheet, frame in sheets.items():
+                _copy(cursor, sheet, frame)
+            cursor.execute(MERGE_SQL)
+            count, first_id, last_id = cursor.fetchone()
+            connection.commit()
+
+            report["imported"] = True
+            report["place_ids"] = [first_id, last_id]
+            report["elapsed_ms"] = round((time.perf_counter() - started) * 1000)
+            logger.info(f"Imported {count} places in {report['elapsed_ms']} ms")
+            return report
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+def _csv_cell(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _csv_chunk(rows: list) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([_csv_cell(value) for value in row] for row in rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+def _export_rows(table: str):
+    """Строки выгрузки пачками по PLACE_EXPORT_BATCH через именованный курсор на сервере"""
+    with get_connection() as connection:
+        cursor = connection.cursor(name=f"export_{table}")
+        cursor.itersize = PLACE_EXPORT_BATCH
+        try:
+            cursor.execute(EXPORT_QUERIES[table][1])
+            while True:
+                rows = cursor.fetchmany(PLACE_EXPORT_BATCH)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+            connection.rollback()
+
+
+def export_csv(table: str = "places"):
+    """Генератор CSV по частям; соединение из пула занято, пока выгрузку читают"""
+    # BOM: Excel иначе открывает кириллицу в CSV не в той кодировке
+    yield "\ufeff".encode("utf-8") + _csv_chunk([EXPORT_QUERIES[table][0]])
+    for rows in _export_rows(table):
+        yield _csv_chunk(rows)
+
+
+def export_xlsx(chunk_size: int = 1024 * 1024):
+    """Генератор XLSX со всеми листами.
+
+    Книга пишется в режиме write_only во временный файл (строки не копятся в
+    памяти), затем файл отдаётся частями и удаляется.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+
+    def xlsx_cell(sheet, value):
+        # Строку с «=» openpyxl записал бы формулой
+        if isinstance(value, str) and value.startswith("="):
+            cell = WriteOnlyCell(sheet, value=value)
+            cell.data_type = "s"
+            return cell
+        return value
+
+    workbook = Workbook(write_only=True)
+    for table, (header, _) in EXPORT_QUERIES.items():
+        sheet = workbook.create_sheet(table)
+        sheet.append(list(header))
+        for rows in _export_rows(table):
+            for row in rows:
+                sheet.append([xlsx_cell(sheet, value) for value in row])
+    with tempfile.TemporaryFile(suffix=".xlsx") as f:
+        workbook.save(f)
+        f.seek(0)
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            yield data
+
+
+def main(argv: list) -> int:
+    if len(argv) < 2 or argv[0] not in ("import", "export"):
+        print(__doc__)
+        return 2
+    command, path = argv[0], argv[1]
+    if command == "export":
+        table = argv[argv.index("--table") + 1] if "--table" in argv else "places"
+        chunks = export_xlsx() if path.endswith(".xlsx") else export_csv(table)
+        with open(path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        print(f"Exported to {path}")
+        return 0
+
+    if os.path.getsize(path) > PLACE_IMPORT_MAX_SIZE:
+        print(f"File is larger than PLACE_IMPORT_MAX_SIZE ({PLACE_IMPORT_MAX_SIZE} bytes)")
+        return 1
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        report = import_places.sync(data, detect_format(data), skip_invalid="--skip-invalid" in argv,
+                                    dry_run="--dry-run" in argv)
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(f"Import failed: {error}")
+        return 1
+    # Тайлы на диске собраны без новых мест; память работающего сервера не сбросить отсюда
+    if report["imported"]:
+        from tiles import tile_cache
+        tile_cache.clear()
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0 if report["imported"] or "--dry-run" in argv else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,47 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import config as config
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # Потоков не больше, чем соединений в пуле: лишние всё равно ждали бы соединение
+                workers = getattr(config, 'DB_EXECUTOR_WORKERS', getattr(config, 'DB_POOL_MAX_SIZE', 10))
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db")
+    return _executor
+
+
+def run_in_db_thread(func):
+    """Превращает блокирующую функцию работы с БД в корутину.
+
+    Вызов выполняется в ограниченном пуле потоков, поэтому ожидание Postgres
+    не блокирует event loop, а параллельные запросы перекрываются.
+    """
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, func, *args, **kwargs)
+        return await loop.run_in_executor(get_executor(), call)
+
+    wrapper.sync = func
+    return wrapper
+
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
@@ -0,0 +1,100 @@
+"""Проверяет через EXPLAIN, что горячие запросы из db/ идут по индексам.
+
+    python -m db.explain_check
+
+На маленькой базе планировщик честно предпочитает Seq Scan, поэтому проверка
+выключает enable_seqscan: если запрос всё равно сканирует таблицу целиком,
+подходящего индекса нет. Код возврата 1, если хоть один запрос не прошёл.
+"""
+import json
+import sys
+
+from db.feed import FEED_SQL, FAN_OUT_SQL, TRIM_USER_SQL
+from db.geo import PROJECTED_POINT, LONLAT_POINT
+from db.hydration import PLACE_COLUMNS, PLACE_JOINS
+from db.migration import db_connection
+from db.ratings import AWARD_SQL
+
+HOT_TABLES = {
+    "places", "reviews", "reviews_photo", "reviews_ranks", "product", "reklama",
+    "sport_interfaces_place", "places_photos", "users_photos", "follow", "users", "admins",
+    "photo_objects", "feed_items", "rating_events",
+}
+
+QUERIES = [
+    ("map.get_place", "SELECT " + PLACE_COLUMNS + PLACE_JOINS + " WHERE p.id = %s", (1,)),
+    ("map.nearby_places (k)", "SELECT p.id FROM places p ORDER BY " + PROJECTED_POINT + " <-> point(%s, %s) LIMIT 20",
+     (22.0, 54.19)),
+    ("map.nearby_places (radius)", "SELECT p.id FROM places p WHERE " + PROJECTED_POINT +
+     " <@ box(point(%s, %s), point(%s, %s))", (21.9, 54.1, 22.1, 54.3)),
+    ("map.get_places_in_bbox", "SELECT p.id FROM places p WHERE " + LONLAT_POINT +
+     " <@ box(point(%s, %s), point(%s, %s))", (37.5, 54.1, 37.7, 54.3)),
+    ("hydration.load_products", "SELECT id FROM product WHERE id_place = ANY(%s)", ([1, 2],)),
+    ("hydration.load_ads", "SELECT id FROM reklama WHERE id_place = ANY(%s)", ([1, 2],)),
+    ("hydration.load_equipment", "SELECT count FROM sport_interfaces_place WHERE id_place = ANY(%s)", ([1, 2],)),
+    ("hydration.load_place_photos", "SELECT url FROM places_photos WHERE place_id = ANY(%s)", ([1, 2],)),
+    ("hydration.load_reviews", "SELECT id FROM reviews WHERE idplace = ANY(%s)", ([1, 2],)),
+    ("hydration.review_photos", "SELECT url FROM reviews_photo WHERE review_id = %s", (1,)),
+    ("map.calculate_health_rating", "SELECT EXISTS(SELECT 1 FROM product WHERE id_place = %s AND ishealth = true)", (1,)),
+    ("user.create_user", "SELECT id FROM users WHERE email = %s", ("a@b.c",)),
+    ("user.login_user", "SELECT id FROM users WHERE email = %s AND password = %s", ("a@b.c", "x")),
+    ("user.get_user_by_id", "SELECT url FROM users_photos WHERE user_id = %s LIMIT 1", (1,)),
+    ("user.delete_review", "SELECT idUser FROM reviews WHERE id = %s", (1,)),
+    ("user.set_review_rank", 'SELECT id, "like", dislike FROM reviews_ranks WHERE review_id = %s AND user_id = %s', (1, 1)),
+    ("user.add_follow", "SELECT user_id FROM follow WHERE user_id = %s AND follow_id = %s", (1, 2)),
+    ("leaderboard.read_leaderboard_user",
+     "SELECT url FROM users_photos WHERE user_id = %s ORDER BY id DESC LIMIT 1", (1,)),
+    ("feed.get_feed", FEED_SQL, {"user_id": 1, "before": 2 ** 31 - 1, "window": 20, "limit": 20, "offset": 0,
+                                 "fanout": 1000}),
+    ("feed.fan_out_review", FAN_OUT_SQL, {"review_id": 1, "author_id": 1, "fanout": 1000}),
+    ("feed.trim_user_feed", TRIM_USER_SQL, {"user_id": 1, "max_items": 500}),
+    ("feed.remove_review_from_feeds", "SELECT 1 FROM feed_items WHERE review_id = %s", (1,)),
+    ("ratings.award", AWARD_SQL, {"user_id": 1, "delta": 1, "reason": "follow", "ref_id": None}),
+    ("moderation.claim_pending_reviews",
+     "SELECT id FROM reviews WHERE status = 'pending' AND (moderation_claimed_until IS NULL "
+     "OR moderation_claimed_until < now()) ORDER BY id LIMIT 100 FOR UPDATE SKIP LOCKED", ()),
+    ("photos.photo_objects_ref", "SELECT hash FROM photo_objects WHERE url = %s OR original_url = %s",
+     ("http://x/a.jpg", "http://x/a.jpg")),
+    ("photos.claim_orphan_photos", """
+        SELECT hash FROM photo_objects
+        WHERE ref_count = 0 AND orphaned_at < now() - make_interval(secs => %s)
+        ORDER BY orphaned_at LIMIT %s
+    """, (86400, 500)),
+    ("user.reviews_by_author", "SELECT id FROM reviews WHERE idUser = %s", (1,)),
+    ("admin.login_admin", "SELECT id FROM admins WHERE email = %s AND password = %s", ("a@b.c", "x")),
+]
+
+
+def _seq_scans(plan: dict) -> list:
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in HOT_TABLES:
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found.extend(_seq_scans(child))
+    return found
+
+
+def check() -> list:
+    failures = []
+    conn = db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SET enable_seqscan = off")
+        for name, query, params in QUERIES:
+            cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            scans = _seq_scans(plan[0]["Plan"])
+            status = "ok" if not scans else "SEQ SCAN on " + ", ".join(scans)
+            print(f"{name:<32} {status}")
+            if scans:
+                failures.append((name, scans))
+    finally:
+        cur.close()
+        conn.close()
+    return failures
+
+
+if __name__ == "__main__":
+    sys.exit(1 if check() else 0)
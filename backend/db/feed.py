@@ -0,0 +1,255 @@
+"""Лента отзывов по подпискам (/user/follow/{user_id}).
+
+Ленты хранятся готовыми: когда модерация одобряет отзыв, его id попадает в
+feed_items каждого подписчика автора в той же транзакции (fan-out on write),
+а новая подписка сразу получает FEED_BACKFILL последних отзывов автора.
+Чтение — диапазон по первичному ключу (user_id, review_id) от новых к старым.
+
+Авторы, у которых больше FEED_FANOUT_LIMIT подписчиков, не раскладываются по
+лентам: их отзывы подмешиваются при чтении по индексу
+reviews (idUser, id) WHERE status = 'approved' (fan-out on read). Если автор
+перешёл порог, старые записи остаются в лентах, UNION убирает повторы.
+
+Длина ленты ограничена FEED_MAX_ITEMS. Ленту нового подписчика обрезает
+сама add_follow, остальные — фоновая обрезка раз в FEED_TRIM_INTERVAL секунд
+(fan-out добавляет по одной записи в тысячи лент, считать длину каждой при
+записи дороже). Вручную:
+
+    python -m db.feed             # обрезать ленты
+    python -m db.feed --rebuild   # пересчитать follower_count и заново разложить отзывы
+"""
+import logging
+import sys
+from typing import Optional
+
+import psycopg2
+
+import config as config
+from db.executor import run_in_db_thread
+from db.migration import db_connection
+from db.pool import get_connection
+
+logger = logging.getLogger(__name__)
+
+FEED_FANOUT_LIMIT = getattr(config, 'FEED_FANOUT_LIMIT', 1000)
+FEED_MAX_ITEMS = getattr(config, 'FEED_MAX_ITEMS', 500)
+FEED_BACKFILL = getattr(config, 'FEED_BACKFILL', 50)
+FEED_PAGE_SIZE = getattr(config, 'FEED_PAGE_SIZE', 20)
+FEED_TRIM_INTERVAL = getattr(config, 'FEED_TRIM_INTERVAL', 600.0)
+
+# Ключ pg_try_advisory_xact_lock: ленты обрезает одна реплика за раз
+FEED_TRIM_LOCK_KEY = 7251202
+
+# Авторы, которых раскладывают по лентам при записи
+_FANOUT_AUTHOR = "a.follower_count <= %(fanout)s"
+
+FAN_OUT_SQL = f"""
+    INSERT INTO feed_items (user_id, review_id, author_id)
+    SELECT f.user_id, %(review_id)s, f.follow_id
+    FROM follow f
+    JOIN users a ON a.id = f.follow_id AND {_FANOUT_AUTHOR}
+    WHERE f.follow_id = %(author_id)s
+    ON CONFLICT DO NOTHING
+"""
+
+BACKFILL_SQL = f"""
+    INSERT INTO feed_items (user_id, review_id, author_id)
+    SELECT f.user_id, r.id, r.idUser
+    FROM follow f
+    JOIN users a ON a.id = f.follow_id AND {_FANOUT_AUTHOR}
+    CROSS JOIN LATERAL (
+        SELECT id, idUser FROM reviews
+        WHERE idUser = f.follow_id AND status = 'approved'
+        ORDER BY id DESC LIMIT %(per_author)s
+    ) r
+    WHERE %(user_id)s IS NULL OR (f.user_id = %(user_id)s AND f.follow_id = %(follow_id)s)
+    ON CONFLICT DO NOTHING
+"""
+
+TRIM_SQL = """
+    DELETE FROM feed_items fi USING (
+        SELECT user_id, review_id FROM (
+            SELECT user_id, review_id,
+                row_number() OVER (PARTITION BY user_id ORDER BY review_id DESC) AS position
+            FROM feed_items
+            WHERE user_id IN (
+                SELECT user_id FROM feed_items GROUP BY user_id HAVING count(*) > %(max_items)s
+            )
+        ) ranked
+        WHERE position > %(max_items)s
+    ) extra
+    WHERE fi.user_id = extra.user_id AND fi.review_id = extra.review_id
+"""
+
+# Одна лента: всё не новее записи на позиции max_items + 1 (по первичному ключу)
+TRIM_USER_SQL = """
+    DELETE FROM feed_items
+    WHERE user_id = %(user_id)s AND review_id <= (
+        SELECT review_id FROM feed_items WHERE user_id = %(user_id)s
+        ORDER BY review_id DESC OFFSET %(max_items)s LIMIT 1
+    )
+"""
+
+RECONCILE_FOLLOWER_COUNTS_SQL = """
+    UPDATE users u SET follower_count = counts.followers
+    FROM (
+        SELECT users.id, count(f.user_id) AS followers
+        FROM users LEFT JOIN follow f ON f.follow_id = users.id
+        GROUP BY users.id
+    ) counts
+    WHERE u.id = counts.id AND u.follower_count <> counts.followers
+"""
+
+# Одна выборка: своя лента по первичному ключу плюс последние отзывы
+# авторов с большим числом подписчиков, затем отзывы, авторы и фото
+FEED_SQL = f"""
+    WITH page AS (
+        (SELECT review_id AS id FROM feed_items
+         WHERE user_id = %(user_id)s AND review_id < %(before)s
+         ORDER BY review_id DESC LIMIT %(window)s)
+        UNION
+        (SELECT recent.id FROM follow f
+         JOIN users a ON a.id = f.follow_id AND NOT {_FANOUT_AUTHOR}
+         CROSS JOIN LATERAL (
+             SELECT id FROM reviews
+             WHERE idUser = f.follow_id AND status = 'approved' AND id < %(before)s
+             ORDER BY id DESC LIMIT %(window)s
+         ) recent
+         WHERE f.user_id = %(user_id)s)
+        ORDER BY id DESC LIMIT %(limit)s OFFSET %(offset)s
+    )
+    SELECT r.id, r.idUser, u.name, r.idPlace, r.text, r.rating, r.like_count, r.dislike_count,
+        ARRAY(SELECT url FROM reviews_photo WHERE review_id = r.id ORDER BY id)
+    FROM page
+    JOIN reviews r ON r.id = page.id AND r.status = 'approved'
+    JOIN users u ON u.id = r.idUser
+    ORDER BY r.id DESC
+"""
+
+# Больше любого id: первая страница
+_NO_CURSOR = 2 ** 31 - 1
+
+
+def fan_out_review(cursor, review_id: int, author_id: int) -> int:
+    """Кладёт одобренный отзыв в ленты подписчиков автора; вызывается в транзакции одобрения"""
+    cursor.execute(FAN_OUT_SQL, {"review_id": review_id, "author_id": author_id, "fanout": FEED_FANOUT_LIMIT})
+    return cursor.rowcount
+
+
+def backfill_follow(cursor, user_id: int, follow_id: int) -> int:
+    """Последние отзывы автора в ленту нового подписчика; вызывается в транзакции add_follow.
+
+    Лента сразу обрезается до FEED_MAX_ITEMS: подписка добавляет до
+    FEED_BACKFILL записей в одну ленту.
+    """
+    cursor.execute(BACKFILL_SQL, {"user_id": user_id, "follow_id": follow_id,
+                                  "fanout": FEED_FANOUT_LIMIT, "per_author": FEED_BACKFILL})
+    added = cursor.rowcount
+    if added:
+        cursor.execute(TRIM_USER_SQL, {"user_id": user_id, "max_items": FEED_MAX_ITEMS})
+    return added
+
+
+def remove_review_from_feeds(cursor, review_id: int):
+    cursor.execute("DELETE FROM feed_items WHERE review_id = %s", (review_id,))
+
+
+def rebuild_feeds(cursor) -> int:
+    """Пересчитывает follower_count и раскладывает последние отзывы по всем подпискам"""
+    cursor.execute(RECONCILE_FOLLOWER_COUNTS_SQL)
+    cursor.execute(BACKFILL_SQL, {"user_id": None, "follow_id": None,
+                                  "fanout": FEED_FANOUT_LIMIT, "per_author": FEED_BACKFILL})
+    added = cursor.rowcount
+    cursor.execute(TRIM_SQL, {"max_items": FEED_MAX_ITEMS})
+    return added
+
+
+def _review_from_row(row) -> dict:
+    return {
+        "id": row[0],
+        "id_user": row[1],
+        "user_name": row[2],
+        "id_place": row[3],
+        "text": row[4],
+        "rating": row[5],
+        "review_photos": list(row[8]),
+        "like": row[6],
+        "dislike": row[7],
+    }
+
+
+@run_in_db_thread
+def get_feed(user_id: int, limit: Optional[int] = None, offset: Optional[int] = None, page: Optional[int] = None,
+             after: Optional[int] = None) -> list:
+    """Страница ленты от новых отзывов к старым; after — id последнего отзыва предыдущей страницы"""
+    limit = limit or FEED_PAGE_SIZE
+    skip = 0
+    if after is None and offset is not None:
+        skip = offset * (page - 1) if page is not None else offset
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            cursor.execute(FEED_SQL, {
+                "user_id": user_id,
+                "before": after if after is not None else _NO_CURSOR,
+                "window": limit + skip,
+                "limit": limit,
+                "offset": skip,
+                "fanout": FEED_FANOUT_LIMIT,
+            })
+            return [_review_from_row(row) for row in cursor.fetchall()]
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            return []
+        finally:
+            cursor.close()
+
+
+@run_in_db_thread
+def trim_feeds(max_items: int = FEED_MAX_ITEMS) -> int:
+    """Удаляет из лент всё старше max_items последних записей; возвращает число удалённых.
+
+    Если обрезку уже выполняет другая реплика, ничего не делает и возвращает 0.
+    """
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (FEED_TRIM_LOCK_KEY,))
+            if not cursor.fetchone()[0]:
+                connection.rollback()
+                return 0
+            cursor.execute(TRIM_SQL, {"max_items": max_items})
+            removed = cursor.rowcount
+            connection.commit()
+            return removed
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+def main(argv: list) -> int:
+    connection = db_connection()
+    try:
+        with connection.cursor() as cursor:
+            if "--rebuild" in argv:
+                print(f"Feed items added: {rebuild_feeds(cursor)}")
+            else:
+                cursor.execute(TRIM_SQL, {"max_items": FEED_MAX_ITEMS})
+                print(f"Feed items trimmed: {cursor.rowcount}")
+        connection.commit()
+        return 0
+    except (Exception, psycopg2.DatabaseError) as error:
+        connection.rollback()
+        print(f"Feed maintenance failed: {error}")
+        return 1
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,39 @@
+import math
+
+# coord1 — широта, coord2 — долгота (так их заполняет фронтенд)
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEGREE = 111320.0
+
+# Равнопромежуточная проекция: долгота сжимается на cos(широты), после чего евклидово
+# расстояние в градусах в пределах города почти совпадает с настоящим. Выражение должно
+# совпадать с выражением индекса places_geo_knn_idx, иначе планировщик его не использует.
+PROJECTED_POINT = "point(p.coord2 * cos(radians(p.coord1)), p.coord1)"
+
+# Точка (долгота, широта) без проекции, для выборки по прямоугольнику карты; индекс places_lonlat_idx
+LONLAT_POINT = "point(p.coord2, p.coord1)"
+
+
+def projected(lat: float, lon: float) -> tuple:
+    return lon * math.cos(math.radians(lat)), lat
+
+
+def haversine_sql(lat_param: str = "%s", lon_param: str = "%s") -> str:
+    """SQL-выражение расстояния в метрах от p до точки (lat, lon).
+
+    Широта подставляется в выражение дважды, так что параметры идут в порядке
+    lat, lat, lon.
+    """
+    return (
+        f"2 * {EARTH_RADIUS_M} * asin(sqrt("
+        f"power(sin(radians(p.coord1 - {lat_param}) / 2), 2) + "
+        f"cos(radians({lat_param})) * cos(radians(p.coord1)) * "
+        f"power(sin(radians(p.coord2 - {lon_param}) / 2), 2)))"
+    )
+
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    d_lat = math.radians(lat2 - lat1)
+    d_lon = math.radians(lon2 - lon1)
+    a = (math.sin(d_lat / 2) ** 2 +
+         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(d_lon / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
@@ -0,0 +1,150 @@
+from psycopg2 import sql
+
+PLACE_COLUMNS = """
+    p.id, p.name, p.coord1, p.coord2, pt.type, ft.type,
+    p.isalcohol, p.ishealth, p.isinsurence, p.isnosmoking, p.issmoke, p.rating, st.type, p.info,
+    p.distance_to_center, p.is_moderated, p.review_rank
+"""
+
+PLACE_JOINS = """
+FROM places p
+LEFT JOIN places_type pt ON p.type = pt.id
+LEFT JOIN food_type ft ON p.foodtype = ft.id
+LEFT JOIN sport_type st ON st.id = p.sporttype
+"""
+
+
+def place_from_row(row) -> dict:
+    """Собирает словарь места из строки SELECT PLACE_COLUMNS"""
+    return {"id": row[0], "name": row[1], "coord1": row[2], "coord2": row[3],
+            "type": row[4], "food_type": row[5], "is_alcohol": row[6],
+            "is_health": row[7], "is_insurance": row[8], "is_nosmoking": row[9],
+            "is_smoke": row[10], "rating": row[11], "sport_type": row[12], "info": row[13],
+            "distance_to_center": row[14], "is_moderated": row[15],
+            "review_rank": float(row[16]) if row[16] is not None else 0.0}
+
+
+def _group(rows, build) -> dict:
+    out = dict()
+    for row in rows:
+        out.setdefault(row[0], []).append(build(row))
+    return out
+
+
+def load_products(cursor, place_ids: list) -> dict:
+    query = sql.SQL("""
+        SELECT pr.id_place, pr.id, prt.type, pr.min_cost, pr.ishealth, pr.isalcohol, pr.issmoking, pr.name
+        FROM product pr
+        LEFT JOIN product_type prt ON prt.id = pr.type
+        WHERE pr.id_place = ANY(%s)
+        ORDER BY pr.id
+    """)
+    cursor.execute(query, (place_ids,))
+    return _group(cursor.fetchall(), lambda row: {
+        "id": row[1],
+        "type": row[2],
+        "min_cost": row[3],
+        "is_health": row[4],
+        "is_alcohol": row[5],
+        "is_smoking": row[6],
+        "name": row[7]
+    })
+
+
+def load_ads(cursor, place_ids: list) -> dict:
+    query = sql.SQL("""
+        SELECT r.id_place, r.id, rt.type, r.name, r.ishelth
+        FROM reklama r
+        LEFT JOIN reklama_type rt ON rt.id = r.type
+        WHERE r.id_place = ANY(%s)
+        ORDER BY r.id
+    """)
+    cursor.execute(query, (place_ids,))
+    return _group(cursor.fetchall(), lambda row: {
+        "id": row[1],
+        "type": row[2],
+        "name": row[3],
+        "is_health": row[4],
+    })
+
+
+def load_equipment(cursor, place_ids: list) -> dict:
+    query = sql.SQL("""
+        SELECT sip.id_place, si.type, sip.count
+        FROM sport_interfaces_place sip
+        LEFT JOIN sport_interfaces si ON si.id = sip.id_interface
+        WHERE sip.id_place = ANY(%s)
+    """)
+    cursor.execute(query, (place_ids,))
+    return _group(cursor.fetchall(), lambda row: {
+        "name": row[1],
+        "count": row[2],
+    })
+
+
+def load_place_photos(cursor, place_ids: list) -> dict:
+    query = sql.SQL("""
+        SELECT place_id, url FROM places_photos
+        WHERE place_id = ANY(%s)
+        ORDER BY id
+    """)
+    cursor.execute(query, (place_ids,))
+    return _group(cursor.fetchall(), lambda row: row[1])
+
+
+def load_reviews(cursor, place_ids: list) -> dict:
+    """Отзывы мест вместе с фото и лайками одним запросом"""
+    query = sql.SQL("""
+        SELECT r.idplace, r.id, r.iduser, u.name, r.text, r.rating,
+            COALESCE(rp.urls, '{}'), r.like_count, r.dislike_count
+        FROM reviews r
+        LEFT JOIN users u ON u.id = r.iduser
+        LEFT JOIN LATERAL (
+            SELECT array_agg(url ORDER BY id) AS urls
+            FROM reviews_photo WHERE review_id = r.id
+        ) rp ON true
+        WHERE r.idplace = ANY(%s) AND r.status = 'approved'
+        ORDER BY r.id
+    """)
+    cursor.execute(query, (place_ids,))
+    return _group(cursor.fetchall(), lambda row: {
+        "id": row[1],
+        "id_user": row[2],
+        "user_name": row[3],
+        "id_place": row[0],
+        "text": row[4],
+        "review_photos": list(row[6]),
+        "like": row[7],
+        "dislike": row[8],
+        "rating": row[5],
+    })
+
+
+def hydrate_places(cursor, places: list, products: bool = True, ads: bool = True,
+                   equipment: bool = True) -> list:
+    """Дополняет страницу мест дочерними коллекциями.
+
+    Каждая коллекция загружается одним запросом на всю страницу, поэтому число
+    запросов не зависит от количества мест и отзывов.
+    """
+    if not places:
+        return places
+    place_ids = [place["id"] for place in places]
+
+    reviews_by_place = load_reviews(cursor, place_ids)
+    photos_by_place = load_place_photos(cursor, place_ids)
+    products_by_place = load_products(cursor, place_ids) if products else None
+    ads_by_place = load_ads(cursor, place_ids) if ads else None
+    equipment_by_place = load_equipment(cursor, place_ids) if equipment else None
+
+    for place in places:
+        id = place["id"]
+        place["reviews"] = reviews_by_place.get(id, [])
+        place["photos"] = photos_by_place.get(id, [])
+        if products_by_place is not None:
+            place["products"] = products_by_place.get(id, [])
+        if ads_by_place is not None:
+            place["ads"] = ads_by_place.get(id, [])
+        if equipment_by_place is not None:
+            place["equipment"] = equipment_by_place.get(id, [])
+    return places
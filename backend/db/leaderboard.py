@@ -0,0 +1,90 @@
+"""Рейтинг пользователей.
+
+Весь рейтинг (незабаненные пользователи, последнее фото) держится в памяти
+в ranking.RankIndex и читается без запросов к базе. Функции, которые меняют
+users.rating, имя, фото или бан, получают новые значения через RETURNING и
+после commit передают их в update_leaderboard. Полная перестройка — при
+старте, по истечении LEADERBOARD_MAX_AGE и через /admin/leaderboard/rebuild:
+она исправляет расхождения, если изменение прошло мимо этих функций (правка
+руками в базе, другой процесс).
+"""
+import asyncio
+import logging
+import time
+
+import psycopg2
+
+import config as config
+from db.executor import run_in_db_thread
+from db.pool import get_connection
+from ranking import RankIndex
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_MAX_AGE = getattr(config, 'LEADERBOARD_MAX_AGE', 3600.0)
+
+leaderboard = RankIndex()
+_rebuild_lock = asyncio.Lock()
+
+# Последнее фото пользователя, как раньше в get_leaderboard
+LEADERBOARD_USER_SQL = """
+    SELECT u.id, u.name, COALESCE(u.rating, 0), u.isbanned,
+        (SELECT url FROM users_photos WHERE user_id = u.id ORDER BY id DESC LIMIT 1)
+    FROM users u
+"""
+
+
+def _user_from_row(row) -> dict:
+    return {"id": row[0], "user_name": row[1], "rating": row[2], "user_photos": row[4]}
+
+
+def update_leaderboard(user_id: int, rating, banned: bool = False, **changes):
+    """Вызывается после commit с новым значением users.rating"""
+    if banned:
+        leaderboard.update(user_id, removed=True)
+    else:
+        leaderboard.update(user_id, rating=rating or 0, removed=False, **changes)
+
+
+def read_leaderboard_user(cursor, user_id: int) -> dict:
+    """Аргументы update_leaderboard по текущей строке; для update_user, где меняются имя и фото"""
+    cursor.execute(LEADERBOARD_USER_SQL + " WHERE u.id = %s", (user_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return {"rating": None, "banned": True}
+    return {"rating": row[2], "banned": row[3], "user_name": row[1], "user_photos": row[4]}
+
+
+@run_in_db_thread
+def load_leaderboard() -> int:
+    """Перестраивает индекс из базы одним запросом; возвращает число пользователей"""
+    started = time.perf_counter()
+    leaderboard.begin_load()
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            cursor.execute(LEADERBOARD_USER_SQL + " WHERE u.isbanned = false")
+            leaderboard.load([_user_from_row(row) for row in cursor.fetchall()])
+            logger.info(f"Leaderboard rebuilt: {len(leaderboard)} users in "
+                        f"{(time.perf_counter() - started) * 1000:.0f} ms")
+            return len(leaderboard)
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            leaderboard.abort_load()
+            logger.error(error)
+            raise
+        finally:
+            cursor.close()
+
+
+async def ensure_leaderboard():
+    """Загружает индекс при первом обращении и перестраивает устаревший"""
+    stats = leaderboard.stats()
+    if stats["loaded"] and stats["age"] < LEADERBOARD_MAX_AGE:
+        return
+    async with _rebuild_lock:
+        stats = leaderboard.stats()
+        if stats["loaded"] and stats["age"] < LEADERBOARD_MAX_AGE:
+            return
+        await load_leaderboard()
@@ -4,428 +4,167 @@ from typing import Optional, List
 import psycopg2
 from psycopg2 import sql
 
-from db.migration import db_connection
+import config as config
+from cache import MemoryCache
+from db.executor import run_in_db_thread
+from db.geo import PROJECTED_POINT, LONLAT_POINT, METERS_PER_DEGREE, haversine_sql, projected
+from db.hydration import PLACE_COLUMNS, PLACE_JOINS, place_from_row, hydrate_places
+from db.leaderboard import update_leaderboard
+from db.pagination import paginate
+from db.ratings import award, PLACE_ADDED, PLACE_UPDATED
+from db.pool import get_connection
+from tiles import invalidate_place, tile_bounds, TILE_BUFFER
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("app.log"),
-        logging.StreamHandler()
-    ]
-)
-
-
-def log_and_execute(cursor, query, params=None):
-    """Выполняет SQL запрос с логированием"""
-    if params:
-        # Формируем запрос с подстановкой параметров для логирования
-        log_query = query
-        if isinstance(params, tuple):
-            params_list = list(params)
-        else:
-            params_list = [params] if params else []
-        for param in params_list:
-            if isinstance(param, str):
-                escaped_param = param.replace("'", "''")  # Экранируем одинарные кавычки
-                log_query = log_query.replace('%s', f"'{escaped_param}'", 1)
-            else:
-                log_query = log_query.replace('%s', str(param), 1)
-        logger.info(f"Executing SQL query: {log_query}")
-        logger.info(f"Query params: {params}")
-        cursor.execute(query, params)
-    else:
-        logger.info(f"Executing SQL query: {query}")
-        cursor.execute(query)
-
-
-async def get_all_places(limit: Optional[int] = None, offset: Optional[int] = None, page: Optional[int] = None) -> list:
-    connection = db_connection()
-    cursor = connection.cursor()
 
-    try:
-        query = """
-SELECT p.id, p.name, p.coord1, p.coord2, pt.type, ft.type,
-    p.isalcohol, p.ishealth, p.isinsurence, p.isnosmoking, p.issmoke, p.rating, st.type, p.info
-FROM places p
-LEFT JOIN places_type pt ON p.type = pt.id
-LEFT JOIN food_type ft ON p.foodtype = ft.id
-LEFT JOIN sport_type st ON st.id = p.sporttype
-        """
-
-        if limit is not None:
-            if offset is not None and page is not None:
-                calculated_offset = offset * (page - 1)
-                query += f" LIMIT {limit} OFFSET {calculated_offset}"
-            elif offset is not None:
-                query += f" LIMIT {limit} OFFSET {offset}"
-            else:
-                query += f" LIMIT {limit}"
-
-        logger.info(f"Executing SQL query: {query}")
-        cursor.execute(query)
-
-        rows = cursor.fetchall()
-        logger.info(f"Found {len(rows)} places in database")
-        places = []
-        for row in rows:
-            id = row[0]
 
-            query_product = """
-            SELECT id, (SELECT product_type.type from product_type where product_type.id = product.type),
-            min_cost, ishealth, isalcohol, issmoking, name 
-            from product where id_place = %s
-            """
-            logger.info(f"Executing SQL query: {query_product} with params: ({id},)")
-            cursor.execute(query_product, (id,))
-            rows_product = cursor.fetchall()
-            products = []
-            for row_p in rows_product:
-                product = {
-                    "id": row_p[0],
-                    "type": row_p[1],
-                    "min_cost": row_p[2],
-                    "is_health": row_p[3],
-                    "is_alcohol": row_p[4],
-                    "is_smoking": row_p[5],
-                    "name": row_p[6]
-                }
-                products.append(product)
-            query_ads = """
-                        SELECT id, (SELECT reklama_type.type from reklama_type where reklama_type.id = reklama.type),
-                        name, ishelth 
-                        from reklama where id_place = %s
-                        """
-            log_and_execute(cursor, query_ads, (id,))
-            rows_ads = cursor.fetchall()
-            ads = []
-            for row_a in rows_ads:
-                ad = {
-                    "id": row_a[0],
-                    "type": row_a[1],
-                    "name": row_a[2],
-                    "is_health": row_a[3],
-                }
-                ads.append(ad)
-
-            query_review = """SELECT id, iduser, (SELECT users.name from users where users.id = reviews.iduser), idplace, text 
-                from reviews where idplace=%s"""
-            logger.info(f"Executing SQL query: {query_review} with params: ({id},)")
-            cursor.execute(query_review, (id,))
-            rows_review = cursor.fetchall()
-            reviews = []
-            for row_r in rows_review:
-                review_id = row_r[0]
-                query_photos = sql.SQL("""
-                    SELECT url FROM reviews_photo WHERE review_id = %s
-                """)
-                cursor.execute(query_photos, (review_id,))
-                rows_photos = cursor.fetchall()
-                review_photos = [row_photo[0] for row_photo in rows_photos]
-
-                query_ranks = sql.SQL("""
-                    SELECT 
-                        COUNT(*) FILTER (WHERE "like" = true) as like_count,
-                        COUNT(*) FILTER (WHERE dislike = true) as dislike_count
-                    FROM reviews_ranks 
-                    WHERE review_id = %s
-                """)
-                cursor.execute(query_ranks, (review_id,))
-                ranks_row = cursor.fetchone()
-                like_count = ranks_row[0] if ranks_row else 0
-                dislike_count = ranks_row[1] if ranks_row else 0
-
-                review = {
-                    "id": review_id,
-                    "id_user": row_r[1],
-                    "user_name": row_r[2],
-                    "id_place": row_r[3],
-                    "text": row_r[4],
-                    "review_photos": review_photos,
-                    "like": like_count,
-                    "dislike": dislike_count,
-                }
-                reviews.append(review)
-
-            query_sport = """SELECT (SELECT type from sport_interfaces as si where si.id = sip.id_interface), count 
-                from sport_interfaces_place as sip where id_place = %s"""
-            log_and_execute(cursor, query_sport, (id,))
-            rows_sport = cursor.fetchall()
-            sports = []
-            for row_s in rows_sport:
-                sport = {
-                    "name": row_s[0],
-                    "count": row_s[1],
-                }
-                sports.append(sport)
-
-            query_review_rank = sql.SQL("""
-                SELECT COALESCE(AVG(rating)::numeric(10,2), 0)
-                FROM reviews 
-                WHERE idPlace = %s AND rating IS NOT NULL
-            """)
-            cursor.execute(query_review_rank, (id,))
-            review_rank_row = cursor.fetchone()
-            review_rank = float(review_rank_row[0]) if review_rank_row[0] is not None else 0.0
+place_cache = MemoryCache(max_entries=getattr(config, 'PLACE_CACHE_MAX_ENTRIES', 1024),
+                          ttl=getattr(config, 'PLACE_CACHE_TTL', 300.0))
 
-            query_photos = sql.SQL("""
-                SELECT url FROM places_photos WHERE place_id = %s
-            """)
-            cursor.execute(query_photos, (id,))
-            rows_photos = cursor.fetchall()
-            photos = [row_photo[0] for row_photo in rows_photos]
-
-            place = {"id": row[0], "name": row[1], "coord1": row[2], "coord2": row[3],
-                     "type": row[4], "food_type": row[5], "is_alcohol": row[6],
-                     "is_health": row[7], "is_insurance": row[8], "is_nosmoking": row[9],
-                     "is_smoke": row[10], "rating": row[11], "sport_type": row[12], "info": row[13],
-                     "products": products,
-                     "ads": ads,
-                     "reviews": reviews, "equipment": sports, "review_rank": review_rank, "photos": photos}
-            places.append(place)
-        return places
-
-    except (Exception, psycopg2.DatabaseError) as error:
-        logger.error(error)
-    finally:
-        if connection:
-            cursor.close()
-            connection.close()
-            logger.info('Database connection closed.')
 
+def invalidate_place_cache(place_id: int):
+    place_cache.delete(place_id)
 
-async def get_place(id):
-    connection = db_connection()
-    cursor = connection.cursor()
-    out = dict()
 
-    try:
-        query = """
-SELECT p.id, p.name, p.coord1, p.coord2, pt.type, ft.type,
-    p.isalcohol, p.ishealth, p.isinsurence, p.isnosmoking, p.issmoke, p.rating, st.type, p.info
-FROM places p
-LEFT JOIN places_type pt ON p.type = pt.id
-LEFT JOIN food_type ft ON p.foodtype = ft.id
-LEFT JOIN sport_type st ON st.id = p.sporttype WHERE p.id = %s
-        """
-        log_and_execute(cursor, query, (id,))
+@run_in_db_thread
+def get_all_places(limit: Optional[int] = None, offset: Optional[int] = None, page: Optional[int] = None,
+                   after: Optional[int] = None) -> list:
+    with get_connection() as connection:
+        cursor = connection.cursor()
 
-        row = cursor.fetchone()
-        id = row[0]
-
-        query_product = """
-        SELECT id, (SELECT product_type.type from product_type where product_type.id = product.type),
-        min_cost, ishealth, isalcohol, issmoking, name 
-        from product where id_place = %s
-        """
-        log_and_execute(cursor, query_product, (id,))
-        rows_product = cursor.fetchall()
-        products = []
-        for row_p in rows_product:
-            product = {
-                "id": row_p[0],
-                "type": row_p[1],
-                "min_cost": row_p[2],
-                "is_health": row_p[3],
-                "is_alcohol": row_p[4],
-                "is_smoking": row_p[5],
-                "name": row_p[6]
-            }
-            products.append(product)
-        query_ads = """
-                    SELECT id, (SELECT reklama_type.type from reklama_type where reklama_type.id = reklama.type),
-                    name, ishelth 
-                    from reklama where id_place = %s
-                    """
-        log_and_execute(cursor, query_ads, (id,))
-        rows_ads = cursor.fetchall()
-        ads = []
-        for row_a in rows_ads:
-            ad = {
-                "id": row_a[0],
-                "type": row_a[1],
-                "name": row_a[2],
-                "is_health": row_a[3],
-            }
-            ads.append(ad)
-
-        query_review = """SELECT id, iduser, (SELECT users.name from users where users.id = reviews.iduser), idplace, text, rating 
-            from reviews where idplace=%s"""
-        log_and_execute(cursor, query_review, (id,))
-        rows_review = cursor.fetchall()
-        reviews = []
-        for row_r in rows_review:
-            review_id = row_r[0]
-            query_photos = "SELECT url FROM reviews_photo WHERE review_id = %s"
-            log_and_execute(cursor, query_photos, (review_id,))
-            rows_photos = cursor.fetchall()
-            review_photos = [row_photo[0] for row_photo in rows_photos]
-
-            query_ranks = """
-                SELECT 
-                    COUNT(*) FILTER (WHERE "like" = true) as like_count,
-                    COUNT(*) FILTER (WHERE dislike = true) as dislike_count
-                FROM reviews_ranks 
-                WHERE review_id = %s
-            """
-            log_and_execute(cursor, query_ranks, (review_id,))
-            ranks_row = cursor.fetchone()
-            like_count = ranks_row[0] if ranks_row else 0
-            dislike_count = ranks_row[1] if ranks_row else 0
-
-            review = {
-                "id": review_id,
-                "id_user": row_r[1],
-                "user_name": row_r[2],
-                "id_place": row_r[3],
-                "text": row_r[4],
-                "review_photos": review_photos,
-                "like": like_count,
-                "dislike": dislike_count,
-                "rating": row_r[5],
-            }
-            reviews.append(review)
-
-        query_sport = """SELECT (SELECT type from sport_interfaces as si where si.id = sip.id_interface), count 
-            from sport_interfaces_place as sip where id_place = %s"""
-        log_and_execute(cursor, query_sport, (id,))
-        rows_sport = cursor.fetchall()
-        sports = []
-        for row_s in rows_sport:
-            sport = {
-                "name": row_s[0],
-                "count": row_s[1],
-            }
-            sports.append(sport)
-
-        query_review_rank = """
-            SELECT COALESCE(AVG(rating)::numeric(10,2), 0)
-            FROM reviews 
-            WHERE idPlace = %s AND rating IS NOT NULL
-        """
-        log_and_execute(cursor, query_review_rank, (id,))
-        review_rank_row = cursor.fetchone()
-        review_rank = float(review_rank_row[0]) if review_rank_row[0] is not None else 0.0
-
-        query_photos = "SELECT url FROM places_photos WHERE place_id = %s"
-        log_and_execute(cursor, query_photos, (id,))
-        rows_photos = cursor.fetchall()
-        photos = [row_photo[0] for row_photo in rows_photos]
-
-        place = {"id": row[0], "name": row[1], "coord1": row[2], "coord2": row[3],
-                 "type": row[4], "food_type": row[5], "is_alcohol": row[6],
-                 "is_health": row[7], "is_insurance": row[8], "is_nosmoking": row[9],
-                 "is_smoke": row[10], "rating": row[11], "sport_type": row[12], "info": row[13], "products": products,
-                 "ads": ads,
-                 "reviews": reviews, "equipment": sports, "review_rank": review_rank, "photos": photos}
+        try:
+            query = "SELECT " + PLACE_COLUMNS + PLACE_JOINS
 
-        return place
+            condition, params, suffix, suffix_params = paginate("p.id", limit, offset, page, after)
+            if condition:
+                query += " WHERE " + condition
+            query += suffix
+
+            cursor.execute(query, tuple(params + suffix_params))
+
+            rows = cursor.fetchall()
+            logger.info(f"Found {len(rows)} places in database")
+            places = [place_from_row(row) for row in rows]
+            return hydrate_places(cursor, places)
 
-    except (Exception, psycopg2.DatabaseError) as error:
-        logger.error(error)
-    finally:
-        if connection:
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+        finally:
             cursor.close()
-            connection.close()
-            logger.info('Database connection closed.')
 
 
-async def get_all_types() -> dict:
-    connection = db_connection()
-    cursor = connection.cursor()
-    out = dict()
-    try:
-        query = sql.SQL("""
-SELECT id, type from places_type 
-        """)
-        cursor.execute(query)
-
-        rows = cursor.fetchall()
-        places = []
-        for row in rows:
-            place = {"id": row[0], "type": row[1]}
-            places.append(place)
-        out['place_type'] = places
-
-        query = sql.SQL("""
-        SELECT id, type from product_type 
-                """)
-        cursor.execute(query)
+async def get_place(id):
+    # Попадание в кэш не занимает ни поток исполнителя, ни соединение из пула
+    place = place_cache.get(id)
+    if place is not None:
+        return place
+    return await _load_place(id, place_cache.generation)
 
-        rows = cursor.fetchall()
-        products = []
-        for row in rows:
-            product = {"id": row[0], "type": row[1]}
-            products.append(product)
-        out['product_type'] = products
 
-        query = sql.SQL("""
-        SELECT id, type from reklama_type 
-                """)
-        cursor.execute(query)
+@run_in_db_thread
+def _load_place(id, generation: int):
+    with get_connection() as connection:
+        cursor = connection.cursor()
 
-        rows = cursor.fetchall()
-        places = []
-        for row in rows:
-            place = {"id": row[0], "type": row[1]}
-            places.append(place)
-        out['ads_type'] = places
+        try:
+            query = "SELECT " + PLACE_COLUMNS + PLACE_JOINS + " WHERE p.id = %s"
+            cursor.execute(query, (id,))
 
-        query = sql.SQL("""
-        SELECT id, type from sport_interfaces 
-                """)
-        cursor.execute(query)
+            row = cursor.fetchone()
+            if not row:
+                return None
 
-        rows = cursor.fetchall()
-        places = []
-        for row in rows:
-            place = {"id": row[0], "type": row[1]}
-            places.append(place)
-        out['equipment_type'] = places
+            place = place_from_row(row)
+            hydrate_places(cursor, [place])
+            place_cache.set(id, place, generation)
+            return place
 
-        query = sql.SQL("""
-        SELECT id, type from sport_type 
-                """)
-        cursor.execute(query)
-
-        rows = cursor.fetchall()
-        places = []
-        for row in rows:
-            place = {"id": row[0], "type": row[1]}
-            places.append(place)
-        out['sport_type'] = places
-        return out
-
-    except (Exception, psycopg2.DatabaseError) as error:
-        logger.error(error)
-    finally:
-        if connection:
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+        finally:
             cursor.close()
-            connection.close()
-            logger.info('Database connection closed.')
 
 
-async def add_place(place) -> int:
-    connection = db_connection()
-    cursor = connection.cursor()
+@run_in_db_thread
+def get_all_types() -> dict:
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        out = dict()
+        try:
+            query = sql.SQL("""
+SELECT id, type from places_type 
+            """)
+            cursor.execute(query)
 
-    try:
-        check_user = sql.SQL("SELECT id, rating FROM users WHERE id = %s")
-        cursor.execute(check_user, (place['id_user'],))
-        row = cursor.fetchone()
-        if not row:
-            return False
-        else:
-            add_rating_cnt = 5
-            if 'photos' in place and place['photos'] is not None and len(place['photos']) > 0:
-                add_rating_cnt += 10
-            add_rating = """UPDATE users 
-                                       SET rating = %s
-                                       WHERE id = %s"""
-            cursor.execute(add_rating, (row[1] + add_rating_cnt, place['id_user']))
+            rows = cursor.fetchall()
+            places = []
+            for row in rows:
+                place = {"id": row[0], "type": row[1]}
+                places.append(place)
+            out['place_type'] = places
+
+            query = sql.SQL("""
+            SELECT id, type from product_type 
+                    """)
+            cursor.execute(query)
+
+            rows = cursor.fetchall()
+            products = []
+            for row in rows:
+                product = {"id": row[0], "type": row[1]}
+                products.append(product)
+            out['product_type'] = products
+
+            query = sql.SQL("""
+            SELECT id, type from reklama_type 
+                    """)
+            cursor.execute(query)
+
+            rows = cursor.fetchall()
+            places = []
+            for row in rows:
+                place = {"id": row[0], "type": row[1]}
+                places.append(place)
+            out['ads_type'] = places
+
+            query = sql.SQL("""
+            SELECT id, type from sport_interfaces 
+                    """)
+            cursor.execute(query)
+
+            rows = cursor.fetchall()
+            places = []
+            for row in rows:
+                place = {"id": row[0], "type": row[1]}
+                places.append(place)
+            out['equipment_type'] = places
+
+            query = sql.SQL("""
+            SELECT id, type from sport_type 
+                    """)
+            cursor.execute(query)
+
+            rows = cursor.fetchall()
+            places = []
+            for row in rows:
+                place = {"id": row[0], "type": row[1]}
+                places.append(place)
+            out['sport_type'] = places
+            return out
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+        finally:
+            cursor.close()
+
+
+@run_in_db_thread
+def add_place(place) -> int:
+    with get_connection() as connection:
+        cursor = connection.cursor()
 
-        query = sql.SQL("""
+        try:
+            query = sql.SQL("""
 INSERT INTO places 
 (name, info, coord1, coord2, type, foodtype, 
 isalcohol, ishealth, isinsurence, isnosmoking, issmoke,
@@ -433,248 +172,292 @@ rating, sporttype)
 
 VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
 returning id; 
-        """)
-        cursor.execute(query, (place['name'], place['info'], place['coord1'], place['coord2'],
-                               place['type'], place['food_type'],
-                               place['is_alcohol'], place['is_health'], place['is_insurance'],
-                               place["is_nosmoking"], place["is_smoke"], None, place["sport_type"]))
-
-        row = cursor.fetchone()
-        id = row[0]
-        if place['products']:
-            query_product = sql.SQL("""
-            INSERT INTO product (type, min_cost, ishealth, isalcohol, issmoking, name, id_place) 
-            VALUES (%s, %s, %s, %s, %s, %s, %s);
             """)
+            cursor.execute(query, (place['name'], place['info'], place['coord1'], place['coord2'],
+                                   place['type'], place['food_type'],
+                                   place['is_alcohol'], place['is_health'], place['is_insurance'],
+                                   place["is_nosmoking"], place["is_smoke"], None, place["sport_type"]))
 
-            for product in place['products']:
-                cursor.execute(query_product,
-                               (product['type'], product['min_cost'], product['is_health'], product['is_alcohol'],
-                                product['is_smoking'], product['name'], id))
-        if place['ads']:
-            query_ads = sql.SQL("""
-                        INSERT INTO reklama (id_place, type, name, ishelth) VALUES (%s, %s, %s, %s);
-                        """)
-            for ad in place['ads']:
-                cursor.execute(query_ads, (id, ad['type'], ad['name'], ad['is_health']))
-        if place['equipment']:
-            query_sport = sql.SQL(
-                """ INSERT INTO sport_interfaces_place (id_place, id_interface, count) VALUES (%s, %s, %s)"""
-            )
+            row = cursor.fetchone()
+            id = row[0]
 
-            for sport in place['equipment']:
-                cursor.execute(query_sport, (id, sport['type'], sport['count']))
+            add_rating_cnt = 5
+            if 'photos' in place and place['photos'] is not None and len(place['photos']) > 0:
+                add_rating_cnt += 10
+            ranked = award(cursor, place['id_user'], add_rating_cnt, PLACE_ADDED, id)
+            if not ranked:
+                return False
 
-        if place.get('photos'):
-            query_photo = sql.SQL("""
-                INSERT INTO places_photos (place_id, url) VALUES (%s, %s)
-            """)
-            for photo_url in place['photos']:
-                cursor.execute(query_photo, (id, photo_url))
+            if place['products']:
+                query_product = sql.SQL("""
+                INSERT INTO product (type, min_cost, ishealth, isalcohol, issmoking, name, id_place) 
+                VALUES (%s, %s, %s, %s, %s, %s, %s);
+                """)
 
-        cursor.connection.commit()
+                for product in place['products']:
+                    cursor.execute(query_product,
+                                   (product['type'], product['min_cost'], product['is_health'], product['is_alcohol'],
+                                    product['is_smoking'], product['name'], id))
+            if place['ads']:
+                query_ads = sql.SQL("""
+                            INSERT INTO reklama (id_place, type, name, ishelth) VALUES (%s, %s, %s, %s);
+                            """)
+                for ad in place['ads']:
+                    cursor.execute(query_ads, (id, ad['type'], ad['name'], ad['is_health']))
+            if place['equipment']:
+                query_sport = sql.SQL(
+                    """ INSERT INTO sport_interfaces_place (id_place, id_interface, count) VALUES (%s, %s, %s)"""
+                )
+
+                for sport in place['equipment']:
+                    cursor.execute(query_sport, (id, sport['type'], sport['count']))
+
+            if place.get('photos'):
+                query_photo = sql.SQL("""
+                    INSERT INTO places_photos (place_id, url) VALUES (%s, %s)
+                """)
+                for photo_url in place['photos']:
+                    cursor.execute(query_photo, (id, photo_url))
 
-        new_rating = await calculate_health_rating(id)
-        update_rating_query = sql.SQL("UPDATE places SET rating = %s WHERE id = %s")
-        cursor.execute(update_rating_query, (new_rating, id))
-        cursor.connection.commit()
+            new_rating = calculate_health_rating(cursor, id)
+            update_rating_query = sql.SQL("UPDATE places SET rating = %s WHERE id = %s")
+            cursor.execute(update_rating_query, (new_rating, id))
+            cursor.connection.commit()
+            invalidate_place(place['coord1'], place['coord2'])
+            update_leaderboard(place['id_user'], *ranked)
 
-        return id
+            return id
 
-    except (Exception, psycopg2.DatabaseError) as error:
-        logger.error(error)
-    finally:
-        if connection:
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+        finally:
             cursor.close()
-            connection.close()
-            logger.info('Database connection closed.')
 
 
-async def calculate_health_rating(place_id: int) -> int:
-    connection = db_connection()
-    cursor = connection.cursor()
-
+# Рейтинг полезности места (0..100) по строке places p. Одно выражение
+# для add_place/update_place и для пересчёта множества мест (db.bulk)
+HEALTH_RATING_SQL = """
+    GREATEST(0, LEAST(100, 30
+        + CASE WHEN COALESCE(p.ishealth, false) THEN 25 ELSE 0 END
+        + CASE WHEN COALESCE(p.isnosmoking, false) THEN 20 ELSE 0 END
+        + CASE WHEN COALESCE(p.issmoke, false) THEN -5 ELSE 15 END
+        + CASE WHEN COALESCE(p.isalcohol, false) THEN -5 ELSE 15 END
+        + CASE WHEN COALESCE(p.isinsurence, false) THEN 15 ELSE 0 END
+        + CASE WHEN EXISTS (SELECT 1 FROM product WHERE id_place = p.id AND ishealth = true)
+            THEN 20 ELSE 0 END
+        + CASE WHEN EXISTS (SELECT 1 FROM sport_interfaces_place WHERE id_place = p.id)
+            THEN 15 ELSE 0 END
+        + CASE WHEN EXISTS (SELECT 1 FROM reklama WHERE id_place = p.id AND ishelth = true)
+            THEN 15 ELSE 0 END
+    ))
+"""
+
+
+def calculate_health_rating(cursor, place_id: int) -> int:
+    """Считает рейтинг полезности места в текущей транзакции вызывающего"""
     try:
-        query = sql.SQL("""
-            SELECT ishealth, isnosmoking, issmoke, isalcohol, isinsurence
-            FROM places WHERE id = %s
-        """)
-        cursor.execute(query, (place_id,))
+        cursor.execute("SELECT " + HEALTH_RATING_SQL + " FROM places p WHERE p.id = %s", (place_id,))
         row = cursor.fetchone()
+        return row[0] if row else 0
 
-        if not row:
-            return 0
-
-        ishealth, isnosmoking, issmoke, isalcohol, isinsurence = row
-        rating_score = 30
-
-        if ishealth:
-            rating_score += 25
-
-        if isnosmoking:
-            rating_score += 20
-
-        if not issmoke:
-            rating_score += 15
-        else:
-            rating_score -= 5
-
-        if not isalcohol:
-            rating_score += 15
-        else:
-            rating_score -= 5
-
-        if isinsurence:
-            rating_score += 15
-
-        query_products = sql.SQL("""
-            SELECT EXISTS(SELECT 1 FROM product WHERE id_place = %s AND ishealth = true)
-        """)
-        cursor.execute(query_products, (place_id,))
-        has_health_products = cursor.fetchone()[0]
-        if has_health_products:
-            rating_score += 20
-
-        query_equipment = sql.SQL("""
-            SELECT EXISTS(SELECT 1 FROM sport_interfaces_place WHERE id_place = %s)
-        """)
-        cursor.execute(query_equipment, (place_id,))
-        has_equipment = cursor.fetchone()[0]
-        if has_equipment:
-            rating_score += 15
-
-        query_ads = sql.SQL("""
-            SELECT EXISTS(SELECT 1 FROM reklama WHERE id_place = %s AND ishelth = true)
-        """)
-        cursor.execute(query_ads, (place_id,))
-        has_health_ads = cursor.fetchone()[0]
-        if has_health_ads:
-            rating_score += 15
-
-        rating_score = max(0, min(100, rating_score))
-
-        return rating_score
-
-    except (Exception, psycopg2.DatabaseError) as error:
+    except psycopg2.DatabaseError as error:
         logger.error(f"Ошибка при расчете рейтинга: {error}")
-        return 0
-    finally:
-        if connection:
-            cursor.close()
-            connection.close()
+        raise
 
 
-async def update_place(place_id: int, place_data: dict) -> bool:
-    connection = db_connection()
-    cursor = connection.cursor()
+@run_in_db_thread
+def update_place(place_id: int, place_data: dict) -> bool:
+    with get_connection() as connection:
+        cursor = connection.cursor()
 
-    try:
-        check_user = sql.SQL("SELECT id, rating FROM users WHERE id = %s")
-        cursor.execute(check_user, (place_data['id_user'],))
-        row = cursor.fetchone()
-        if not row:
-            return False
-        else:
+        try:
             add_rating_cnt = 5
             if 'photos' in place_data and place_data['photos'] is not None and len(place_data["photos"]) > 0:
                 add_rating_cnt += 10
-            add_rating = """UPDATE users 
-                                       SET rating = %s
-                                       WHERE id = %s"""
-            cursor.execute(add_rating, (row[1] + add_rating_cnt, place_data['id_user']))
-        check_query = sql.SQL("SELECT id FROM places WHERE id = %s")
-        cursor.execute(check_query, (place_id,))
-        if not cursor.fetchone():
-            return False
+            ranked = award(cursor, place_data['id_user'], add_rating_cnt, PLACE_UPDATED, place_id)
+            if not ranked:
+                return False
+            check_query = sql.SQL("SELECT id, coord1, coord2 FROM places WHERE id = %s")
+            cursor.execute(check_query, (place_id,))
+            place_row = cursor.fetchone()
+            if not place_row:
+                return False
+
+            update_fields = []
+            update_values = []
+
+            if 'info' in place_data and place_data['info'] is not None:
+                update_fields.append("info = %s")
+                update_values.append(place_data['info'])
+            if 'food_type' in place_data and place_data['food_type'] is not None:
+                update_fields.append("foodtype = %s")
+                update_values.append(place_data['food_type'])
+            if 'is_alcohol' in place_data and place_data['is_alcohol'] is not None:
+                update_fields.append("isalcohol = %s")
+                update_values.append(place_data['is_alcohol'])
+            if 'is_health' in place_data and place_data['is_health'] is not None:
+                update_fields.append("ishealth = %s")
+                update_values.append(place_data['is_health'])
+            if 'is_insurance' in place_data and place_data['is_insurance'] is not None:
+                update_fields.append("isinsurence = %s")
+                update_values.append(place_data['is_insurance'])
+            if 'is_nosmoking' in place_data and place_data['is_nosmoking'] is not None:
+                update_fields.append("isnosmoking = %s")
+                update_values.append(place_data['is_nosmoking'])
+            if 'is_smoke' in place_data and place_data['is_smoke'] is not None:
+                update_fields.append("issmoke = %s")
+                update_values.append(place_data['is_smoke'])
+            if 'sport_type' in place_data and place_data['sport_type'] is not None:
+                update_fields.append("sporttype = %s")
+                update_values.append(place_data['sport_type'])
+
+            if update_fields:
+                update_query = "UPDATE places SET " + ", ".join(update_fields) + " WHERE id = %s"
+                update_values.append(place_id)
+                cursor.execute(update_query, tuple(update_values))
+
+            if 'products' in place_data and place_data['products']:
+                query_product = sql.SQL("""
+                    INSERT INTO product (type, min_cost, ishealth, isalcohol, issmoking, name, id_place) 
+                    VALUES (%s, %s, %s, %s, %s, %s, %s);
+                """)
+                for product in place_data['products']:
+                    cursor.execute(query_product,
+                                   (product.get('type'), product.get('min_cost'), product.get('is_health'),
+                                    product.get('is_alcohol'), product.get('is_smoking'), product.get('name'), place_id))
+
+            if 'ads' in place_data and place_data['ads']:
+                query_ads = sql.SQL("""
+                    INSERT INTO reklama (id_place, type, name, ishelth) VALUES (%s, %s, %s, %s);
+                """)
+                for ad in place_data['ads']:
+                    cursor.execute(query_ads, (place_id, ad.get('type'), ad.get('name'), ad.get('is_health')))
 
-        update_fields = []
-        update_values = []
-
-        if 'info' in place_data and place_data['info'] is not None:
-            update_fields.append("info = %s")
-            update_values.append(place_data['info'])
-        if 'food_type' in place_data and place_data['food_type'] is not None:
-            update_fields.append("foodtype = %s")
-            update_values.append(place_data['food_type'])
-        if 'is_alcohol' in place_data and place_data['is_alcohol'] is not None:
-            update_fields.append("isalcohol = %s")
-            update_values.append(place_data['is_alcohol'])
-        if 'is_health' in place_data and place_data['is_health'] is not None:
-            update_fields.append("ishealth = %s")
-            update_values.append(place_data['is_health'])
-        if 'is_insurance' in place_data and place_data['is_insurance'] is not None:
-            update_fields.append("isinsurence = %s")
-            update_values.append(place_data['is_insurance'])
-        if 'is_nosmoking' in place_data and place_data['is_nosmoking'] is not None:
-            update_fields.append("isnosmoking = %s")
-            update_values.append(place_data['is_nosmoking'])
-        if 'is_smoke' in place_data and place_data['is_smoke'] is not None:
-            update_fields.append("issmoke = %s")
-            update_values.append(place_data['is_smoke'])
-        if 'sport_type' in place_data and place_data['sport_type'] is not None:
-            update_fields.append("sporttype = %s")
-            update_values.append(place_data['sport_type'])
-
-        if update_fields:
-            update_query = "UPDATE places SET " + ", ".join(update_fields) + " WHERE id = %s"
-            update_values.append(place_id)
-            cursor.execute(update_query, tuple(update_values))
-
-        if 'products' in place_data and place_data['products']:
-            query_product = sql.SQL("""
-                INSERT INTO product (type, min_cost, ishealth, isalcohol, issmoking, name, id_place) 
-                VALUES (%s, %s, %s, %s, %s, %s, %s);
-            """)
-            for product in place_data['products']:
-                cursor.execute(query_product,
-                               (product.get('type'), product.get('min_cost'), product.get('is_health'),
-                                product.get('is_alcohol'), product.get('is_smoking'), product.get('name'), place_id))
-
-        if 'ads' in place_data and place_data['ads']:
-            query_ads = sql.SQL("""
-                INSERT INTO reklama (id_place, type, name, ishelth) VALUES (%s, %s, %s, %s);
-            """)
-            for ad in place_data['ads']:
-                cursor.execute(query_ads, (place_id, ad.get('type'), ad.get('name'), ad.get('is_health')))
+            if 'equipment' in place_data and place_data['equipment']:
+                query_sport = sql.SQL("""
+                    INSERT INTO sport_interfaces_place (id_place, id_interface, count) VALUES (%s, %s, %s)
+                """)
+                for sport in place_data['equipment']:
+                    cursor.execute(query_sport, (place_id, sport.get('type'), sport.get('count')))
 
-        if 'equipment' in place_data and place_data['equipment']:
-            query_sport = sql.SQL("""
-                INSERT INTO sport_interfaces_place (id_place, id_interface, count) VALUES (%s, %s, %s)
-            """)
-            for sport in place_data['equipment']:
-                cursor.execute(query_sport, (place_id, sport.get('type'), sport.get('count')))
+            if 'photos' in place_data and place_data['photos'] is not None:
+                query_delete_photos = sql.SQL("DELETE FROM places_photos WHERE place_id = %s")
+                cursor.execute(query_delete_photos, (place_id,))
 
-        if 'photos' in place_data and place_data['photos'] is not None:
-            query_delete_photos = sql.SQL("DELETE FROM places_photos WHERE place_id = %s")
-            cursor.execute(query_delete_photos, (place_id,))
+                query_photo = sql.SQL("""
+                    INSERT INTO places_photos (place_id, url) VALUES (%s, %s)
+                """)
+                for photo_url in place_data['photos']:
+                    cursor.execute(query_photo, (place_id, photo_url))
+
+            new_rating = calculate_health_rating(cursor, place_id)
+            update_rating_query = sql.SQL("UPDATE places SET rating = %s WHERE id = %s")
+            cursor.execute(update_rating_query, (new_rating, place_id))
+            cursor.connection.commit()
+            invalidate_place(place_row[1], place_row[2])
+            invalidate_place_cache(place_id)
+            update_leaderboard(place_data['id_user'], *ranked)
+
+            return True
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(f"Error in replace: {error}")
+            cursor.connection.rollback()
+            return False
+        finally:
+            cursor.close()
 
-            query_photo = sql.SQL("""
-                INSERT INTO places_photos (place_id, url) VALUES (%s, %s)
-            """)
-            for photo_url in place_data['photos']:
-                cursor.execute(query_photo, (place_id, photo_url))
 
-        cursor.connection.commit()
+def _search_conditions(
+        place_type: Optional[int] = None,
+        is_alcohol: Optional[bool] = None,
+        is_health: Optional[bool] = None,
+        is_nosmoking: Optional[bool] = None,
+        is_smoke: Optional[bool] = None,
+        max_distance: Optional[float] = None,
+        is_moderated: Optional[bool] = None,
+        has_product_type: Optional[List[int]] = None,
+        has_equipment_type: Optional[List[int]] = None,
+        has_ads_type: Optional[List[int]] = None,
+        need_products: Optional[bool] = None,
+        need_equipment: Optional[bool] = None,
+        need_ads: Optional[bool] = None,
+) -> tuple:
+    """Условия WHERE фильтров поиска мест и их параметры"""
+    conditions = []
+    params = []
+
+    if place_type is not None:
+        conditions.append("p.type = %s")
+        params.append(place_type)
+
+    if is_alcohol is not None:
+        conditions.append("p.isalcohol = %s")
+        params.append(is_alcohol)
+
+    if is_health is not None:
+        conditions.append("p.ishealth = %s")
+        params.append(is_health)
+
+    if is_nosmoking is not None:
+        conditions.append("p.isnosmoking = %s")
+        params.append(is_nosmoking)
+
+    if is_smoke is not None:
+        conditions.append("p.issmoke = %s")
+        params.append(is_smoke)
+
+    if max_distance is not None:
+        conditions.append("p.distance_to_center <= %s")
+        params.append(max_distance)
+
+    if is_moderated is not None:
+        conditions.append("p.is_moderated = %s")
+        params.append(is_moderated)
+
+    if has_product_type is not None and len(has_product_type) > 0:
+        placeholders = ','.join(['%s'] * len(has_product_type))
+        conditions.append(
+            f"EXISTS (SELECT 1 FROM product WHERE product.id_place = p.id AND product.type IN ({placeholders}))")
+        params.extend(has_product_type)
+
+    if has_equipment_type is not None and len(has_equipment_type) > 0:
+        placeholders = ','.join(['%s'] * len(has_equipment_type))
+        conditions.append(
+            f"EXISTS (SELECT 1 FROM sport_interfaces_place WHERE sport_interfaces_place.id_place = p.id AND sport_interfaces_place.id_interface IN ({placeholders}))")
+        params.extend(has_equipment_type)
+
+    if has_ads_type is not None and len(has_ads_type) > 0:
+        placeholders = ','.join(['%s'] * len(has_ads_type))
+        conditions.append(
+            f"EXISTS (SELECT 1 FROM reklama WHERE reklama.id_place = p.id AND reklama.type IN ({placeholders}))")
+        params.extend(has_ads_type)
+
+    if need_products is not None:
+        if need_products:
+            conditions.append("EXISTS (SELECT 1 FROM product WHERE product.id_place = p.id)")
+        else:
+            conditions.append("NOT EXISTS (SELECT 1 FROM product WHERE product.id_place = p.id)")
 
-        new_rating = await calculate_health_rating(place_id)
-        update_rating_query = sql.SQL("UPDATE places SET rating = %s WHERE id = %s")
-        cursor.execute(update_rating_query, (new_rating, place_id))
-        cursor.connection.commit()
+    if need_equipment is not None:
+        if need_equipment:
+            conditions.append(
+                "EXISTS (SELECT 1 FROM sport_interfaces_place WHERE sport_interfaces_place.id_place = p.id)")
+        else:
+            conditions.append(
+                "NOT EXISTS (SELECT 1 FROM sport_interfaces_place WHERE sport_interfaces_place.id_place = p.id)")
 
-        return True
+    if need_ads is not None:
+        if need_ads:
+            conditions.append("EXISTS (SELECT 1 FROM reklama WHERE reklama.id_place = p.id)")
+        else:
+            conditions.append("NOT EXISTS (SELECT 1 FROM reklama WHERE reklama.id_place = p.id)")
 
-    except (Exception, psycopg2.DatabaseError) as error:
-        logger.error(f"Error in replace: {error}")
-        cursor.connection.rollback()
-        return False
-    finally:
-        if connection:
-            cursor.close()
-            connection.close()
-            logger.info('Database connection closed.')
+    return conditions, params
 
 
-async def search_places(
+@run_in_db_thread
+def search_places(
         place_type: Optional[int] = None,
         is_alcohol: Optional[bool] = None,
         is_health: Optional[bool] = None,
@@ -690,240 +473,228 @@ async def search_places(
         need_ads: Optional[bool] = None,
         limit: Optional[int] = None,
         offset: Optional[int] = None,
-        page: Optional[int] = None
+        page: Optional[int] = None,
+        after: Optional[int] = None
 ) -> list:
-    connection = db_connection()
-    cursor = connection.cursor()
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            base_query = "SELECT " + PLACE_COLUMNS + PLACE_JOINS
+
+            conditions, params = _search_conditions(
+                place_type=place_type,
+                is_alcohol=is_alcohol,
+                is_health=is_health,
+                is_nosmoking=is_nosmoking,
+                is_smoke=is_smoke,
+                max_distance=max_distance,
+                is_moderated=is_moderated,
+                has_product_type=has_product_type,
+                has_equipment_type=has_equipment_type,
+                has_ads_type=has_ads_type,
+                need_products=need_products,
+                need_equipment=need_equipment,
+                need_ads=need_ads,
+            )
 
-    try:
-        base_query = """
-SELECT p.id, p.name, p.coord1, p.coord2, pt.type, ft.type,
-    p.isalcohol, p.ishealth, p.isinsurence, p.isnosmoking, p.issmoke, p.rating, st.type, p.info,
-    p.distance_to_center, p.is_moderated
-FROM places p
-LEFT JOIN places_type pt ON p.type = pt.id
-LEFT JOIN food_type ft ON p.foodtype = ft.id
-LEFT JOIN sport_type st ON st.id = p.sporttype
-        """
-
-        conditions = []
-        params = []
-
-        if place_type is not None:
-            conditions.append("p.type = %s")
-            params.append(place_type)
-
-        if is_alcohol is not None:
-            conditions.append("p.isalcohol = %s")
-            params.append(is_alcohol)
-
-        if is_health is not None:
-            conditions.append("p.ishealth = %s")
-            params.append(is_health)
-
-        if is_nosmoking is not None:
-            conditions.append("p.isnosmoking = %s")
-            params.append(is_nosmoking)
-
-        if is_smoke is not None:
-            conditions.append("p.issmoke = %s")
-            params.append(is_smoke)
-
-        if max_distance is not None:
-            conditions.append("p.distance_to_center <= %s")
-            params.append(max_distance)
-
-        if is_moderated is not None:
-            conditions.append("p.is_moderated = %s")
-            params.append(is_moderated)
-
-        if has_product_type is not None and len(has_product_type) > 0:
-            placeholders = ','.join(['%s'] * len(has_product_type))
-            conditions.append(
-                f"EXISTS (SELECT 1 FROM product WHERE product.id_place = p.id AND product.type IN ({placeholders}))")
-            params.extend(has_product_type)
+            condition, condition_params, suffix, suffix_params = paginate("p.id", limit, offset, page, after)
+            if condition:
+                conditions.append(condition)
+                params.extend(condition_params)
+
+            if conditions:
+                base_query += " WHERE " + " AND ".join(conditions)
+            base_query += suffix
+
+            cursor.execute(base_query, tuple(params + suffix_params))
+
+            rows = cursor.fetchall()
+            logger.info(f"Found {len(rows)} places matching search criteria")
+            places = [place_from_row(row) for row in rows]
+            return hydrate_places(cursor, places,
+                                  products=need_products is True,
+                                  ads=need_ads is True,
+                                  equipment=need_equipment is True)
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            return []
+        finally:
+            cursor.close()
 
-        if has_equipment_type is not None and len(has_equipment_type) > 0:
-            placeholders = ','.join(['%s'] * len(has_equipment_type))
-            conditions.append(
-                f"EXISTS (SELECT 1 FROM sport_interfaces_place WHERE sport_interfaces_place.id_place = p.id AND sport_interfaces_place.id_interface IN ({placeholders}))")
-            params.extend(has_equipment_type)
 
-        if has_ads_type is not None and len(has_ads_type) > 0:
-            placeholders = ','.join(['%s'] * len(has_ads_type))
-            conditions.append(
-                f"EXISTS (SELECT 1 FROM reklama WHERE reklama.id_place = p.id AND reklama.type IN ({placeholders}))")
-            params.extend(has_ads_type)
-
-        if need_products is not None:
-            if need_products:
-                conditions.append("EXISTS (SELECT 1 FROM product WHERE product.id_place = p.id)")
-            else:
-                conditions.append("NOT EXISTS (SELECT 1 FROM product WHERE product.id_place = p.id)")
-
-        if need_equipment is not None:
-            if need_equipment:
-                conditions.append(
-                    "EXISTS (SELECT 1 FROM sport_interfaces_place WHERE sport_interfaces_place.id_place = p.id)")
-            else:
-                conditions.append(
-                    "NOT EXISTS (SELECT 1 FROM sport_interfaces_place WHERE sport_interfaces_place.id_place = p.id)")
-
-        if need_ads is not None:
-            if need_ads:
-                conditions.append("EXISTS (SELECT 1 FROM reklama WHERE reklama.id_place = p.id)")
-            else:
-                conditions.append("NOT EXISTS (SELECT 1 FROM reklama WHERE reklama.id_place = p.id)")
-
-        if conditions:
-            base_query += " WHERE " + " AND ".join(conditions)
-
-        if limit is not None:
-            if offset is not None and page is not None:
-                calculated_offset = offset * (page - 1)
-                base_query += f" LIMIT {limit} OFFSET {calculated_offset}"
-            elif offset is not None:
-                base_query += f" LIMIT {limit} OFFSET {offset}"
-            else:
-                base_query += f" LIMIT {limit}"
-
-        log_and_execute(cursor, base_query, tuple(params))
-
-        rows = cursor.fetchall()
-        logger.info(f"Found {len(rows)} places matching search criteria")
-        places = []
-        for row in rows:
-            id = row[0]
+NEARBY_MAX_RESULTS = 200
 
-            products = []
-            if need_products is True:
-                query_product = """
-                SELECT id, (SELECT product_type.type from product_type where product_type.id = product.type),
-                min_cost, ishealth, isalcohol, issmoking, name 
-                from product where id_place = %s
-                """
-                log_and_execute(cursor, query_product, (id,))
-                rows_product = cursor.fetchall()
-                for row_p in rows_product:
-                    product = {
-                        "id": row_p[0],
-                        "type": row_p[1],
-                        "min_cost": row_p[2],
-                        "is_health": row_p[3],
-                        "is_alcohol": row_p[4],
-                        "is_smoking": row_p[5],
-                        "name": row_p[6]
-                    }
-                    products.append(product)
-
-            ads = []
-            if need_ads is True:
-                query_ads = """
-                            SELECT id, (SELECT reklama_type.type from reklama_type where reklama_type.id = reklama.type),
-                            name, ishelth 
-                            from reklama where id_place = %s
-                            """
-                log_and_execute(cursor, query_ads, (id,))
-                rows_ads = cursor.fetchall()
-                for row_a in rows_ads:
-                    ad = {
-                        "id": row_a[0],
-                        "type": row_a[1],
-                        "name": row_a[2],
-                        "is_health": row_a[3],
-                    }
-                    ads.append(ad)
-
-            query_review = """SELECT id, iduser, (SELECT users.name from users where users.id = reviews.iduser), idplace, text 
-                from reviews where idplace=%s"""
-            logger.info(f"Executing SQL query: {query_review} with params: ({id},)")
-            cursor.execute(query_review, (id,))
-            rows_review = cursor.fetchall()
-            reviews = []
-            for row_r in rows_review:
-                review_id = row_r[0]
-                query_photos = sql.SQL("""
-                    SELECT url FROM reviews_photo WHERE review_id = %s
-                """)
-                cursor.execute(query_photos, (review_id,))
-                rows_photos = cursor.fetchall()
-                review_photos = [row_photo[0] for row_photo in rows_photos]
-
-                query_ranks = sql.SQL("""
-                    SELECT 
-                        COUNT(*) FILTER (WHERE "like" = true) as like_count,
-                        COUNT(*) FILTER (WHERE dislike = true) as dislike_count
-                    FROM reviews_ranks 
-                    WHERE review_id = %s
+
+@run_in_db_thread
+def nearby_places(
+        lat: float,
+        lon: float,
+        radius: Optional[float] = None,
+        k: Optional[int] = None,
+        need_products: Optional[bool] = None,
+        need_equipment: Optional[bool] = None,
+        need_ads: Optional[bool] = None,
+        **filters
+) -> list:
+    """Места вокруг точки по возрастанию настоящего расстояния (в метрах).
+
+    Кандидатов отбирает GiST-индекс places_geo_knn_idx: по радиусу через
+    попадание в прямоугольник, по k через KNN-сортировку <->. Точное расстояние
+    считается по гаверсинусу только для кандидатов.
+    """
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            if k is None:
+                k = NEARBY_MAX_RESULTS if radius is not None else 20
+            k = max(1, min(k, NEARBY_MAX_RESULTS))
+
+            conditions, params = _search_conditions(need_products=need_products,
+                                                    need_equipment=need_equipment,
+                                                    need_ads=need_ads, **filters)
+            center_x, center_y = projected(lat, lon)
+
+            if radius is not None:
+                # Проекция искажает расстояние на доли процента, запас покрывает это
+                half = radius / METERS_PER_DEGREE * 1.01
+                conditions.append(PROJECTED_POINT + " <@ box(point(%s, %s), point(%s, %s))")
+                params.extend([center_x - half, center_y - half, center_x + half, center_y + half])
+
+            inner = ("SELECT " + PLACE_COLUMNS + ", " + haversine_sql() + " AS distance" + PLACE_JOINS)
+            inner_params = [lat, lat, lon] + params
+            if conditions:
+                inner += " WHERE " + " AND ".join(conditions)
+            # Порядок <-> в проекции почти совпадает с настоящим, запас кандидатов добирает расхождения
+            inner += " ORDER BY " + PROJECTED_POINT + " <-> point(%s, %s) LIMIT %s"
+            inner_params.extend([center_x, center_y, k * 2 + 10])
+
+            query = "SELECT * FROM (" + inner + ") AS candidates"
+            query_params = inner_params
+            if radius is not None:
+                query += " WHERE distance <= %s"
+                query_params.append(radius)
+            query += " ORDER BY distance LIMIT %s"
+            query_params.append(k)
+
+            cursor.execute(query, tuple(query_params))
+
+            rows = cursor.fetchall()
+            places = []
+            for row in rows:
+                place = place_from_row(row)
+                place["distance"] = round(row[17], 1)
+                places.append(place)
+            return hydrate_places(cursor, places,
+                                  products=need_products is True,
+                                  ads=need_ads is True,
+                                  equipment=need_equipment is True)
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            return []
+        finally:
+            cursor.close()
+
+
+# С этого зума и ближе отдаются отдельные маркеры, дальше — кластеры по сетке
+CLUSTER_MAX_ZOOM = 15
+# Ячеек сетки на ширину тайла 256px: кластер занимает примерно 32px экрана
+CLUSTER_CELLS_PER_TILE = 8
+BBOX_MAX_MARKERS = 500
+BBOX_MAX_CLUSTERS = 1000
+
+
+def _cluster_cell_size(zoom: int) -> float:
+    return 360.0 / (2 ** zoom) / CLUSTER_CELLS_PER_TILE
+
+
+@run_in_db_thread
+def get_places_in_bbox(min_lat: float, min_lon: float, max_lat: float, max_lon: float, zoom: int) -> dict:
+    """Лёгкие маркеры или кластеры мест в окне карты.
+
+    Размер ответа ограничен: на мелком масштабе места сводятся в кластеры по
+    ячейкам сетки, а если маркеров в окне больше BBOX_MAX_MARKERS, вместо них
+    тоже отдаются кластеры.
+    """
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            box = (min_lon, min_lat, max_lon, max_lat)
+            in_box = LONLAT_POINT + " <@ box(point(%s, %s), point(%s, %s))"
+
+            if zoom >= CLUSTER_MAX_ZOOM:
+                query = ("""
+                    SELECT p.id, p.coord1, p.coord2, pt.type, p.rating, p.review_rank
+                    FROM places p
+                    LEFT JOIN places_type pt ON p.type = pt.id
+                    WHERE """ + in_box + """
+                    ORDER BY p.id
+                    LIMIT %s
                 """)
-                cursor.execute(query_ranks, (review_id,))
-                ranks_row = cursor.fetchone()
-                like_count = ranks_row[0] if ranks_row else 0
-                dislike_count = ranks_row[1] if ranks_row else 0
-
-                review = {
-                    "id": review_id,
-                    "id_user": row_r[1],
-                    "user_name": row_r[2],
-                    "id_place": row_r[3],
-                    "text": row_r[4],
-                    "review_photos": review_photos,
-                    "like": like_count,
-                    "dislike": dislike_count,
-                }
-                reviews.append(review)
-
-            sports = []
-            if need_equipment is True:
-                query_sport = """SELECT (SELECT type from sport_interfaces as si where si.id = sip.id_interface), count 
-                    from sport_interfaces_place as sip where id_place = %s"""
-                log_and_execute(cursor, query_sport, (id,))
-                rows_sport = cursor.fetchall()
-                for row_s in rows_sport:
-                    sport = {
-                        "name": row_s[0],
-                        "count": row_s[1],
-                    }
-                    sports.append(sport)
-
-            query_review_rank = sql.SQL("""
-                SELECT COALESCE(AVG(rating)::numeric(10,2), 0)
-                FROM reviews 
-                WHERE idPlace = %s AND rating IS NOT NULL
+                cursor.execute(query, box + (BBOX_MAX_MARKERS + 1,))
+                rows = cursor.fetchall()
+                if len(rows) <= BBOX_MAX_MARKERS:
+                    markers = [{"id": row[0], "coord1": row[1], "coord2": row[2],
+                                "type": row[3], "rating": row[4], "review_rank": float(row[5])} for row in rows]
+                    return {"zoom": zoom, "clustered": False, "markers": markers, "clusters": []}
+
+            cell = _cluster_cell_size(min(zoom, CLUSTER_MAX_ZOOM))
+            query = ("""
+                SELECT COUNT(*), AVG(p.coord1), AVG(p.coord2), MIN(p.id), AVG(p.rating)
+                FROM places p
+                WHERE """ + in_box + """
+                GROUP BY floor(p.coord2 / %s), floor(p.coord1 / %s)
+                ORDER BY COUNT(*) DESC
+                LIMIT %s
             """)
-            cursor.execute(query_review_rank, (id,))
-            review_rank_row = cursor.fetchone()
-            review_rank = float(review_rank_row[0]) if review_rank_row[0] is not None else 0.0
+            cursor.execute(query, box + (cell, cell, BBOX_MAX_CLUSTERS))
+            clusters = []
+            for row in cursor.fetchall():
+                clusters.append({
+                    "count": row[0],
+                    "coord1": row[1],
+                    "coord2": row[2],
+                    "id": row[3] if row[0] == 1 else None,
+                    "rating": round(float(row[4]), 1) if row[4] is not None else None,
+                })
+            return {"zoom": zoom, "clustered": True, "markers": [], "clusters": clusters}
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            return None
+        finally:
+            cursor.close()
+
+
+TILE_MAX_FEATURES = 20000
+
+
+@run_in_db_thread
+def get_places_in_tile(z: int, x: int, y: int) -> list:
+    """Точки мест для векторного тайла z/x/y вместе с буфером по краям"""
+    with get_connection() as connection:
+        cursor = connection.cursor()
 
-            query_photos = sql.SQL("""
-                SELECT url FROM places_photos WHERE place_id = %s
+        try:
+            min_lon, min_lat, max_lon, max_lat = tile_bounds(z, x, y, TILE_BUFFER)
+            query = ("""
+                SELECT p.id, p.coord1, p.coord2, pt.type, p.rating, p.is_moderated, p.review_rank
+                FROM places p
+                LEFT JOIN places_type pt ON p.type = pt.id
+                WHERE """ + LONLAT_POINT + """ <@ box(point(%s, %s), point(%s, %s))
+                LIMIT %s
             """)
-            cursor.execute(query_photos, (id,))
-            rows_photos = cursor.fetchall()
-            photos = [row_photo[0] for row_photo in rows_photos]
-
-            place = {"id": row[0], "name": row[1], "coord1": row[2], "coord2": row[3],
-                     "type": row[4], "food_type": row[5], "is_alcohol": row[6],
-                     "is_health": row[7], "is_insurance": row[8], "is_nosmoking": row[9],
-                     "is_smoke": row[10], "rating": row[11], "sport_type": row[12], "info": row[13],
-                     "distance_to_center": row[14], "is_moderated": row[15],
-                     "reviews": reviews, "review_rank": review_rank, "photos": photos}
-
-            if need_products is True:
-                place["products"] = products
-            if need_ads is True:
-                place["ads"] = ads
-            if need_equipment is True:
-                place["equipment"] = sports
-
-            places.append(place)
-        return places
-
-    except (Exception, psycopg2.DatabaseError) as error:
-        logger.error(error)
-        return []
-    finally:
-        if connection:
+            cursor.execute(query, (min_lon, min_lat, max_lon, max_lat, TILE_MAX_FEATURES))
+            return [{"id": row[0], "coord1": row[1], "coord2": row[2], "type": row[3],
+                     "rating": row[4], "is_moderated": row[5], "review_rank": float(row[6])}
+                    for row in cursor.fetchall()]
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            return None
+        finally:
             cursor.close()
-            connection.close()
-            logger.info('Database connection closed.')
@@ -1,8 +1,12 @@
+import logging
+
 import psycopg2
 from psycopg2 import sql
 
 import config as config
 
+logger = logging.getLogger(__name__)
+
 db_config = {
     'dbname': config.DB_NAME,
     'user': config.DB_USER,
@@ -16,11 +20,8 @@ def db_connection():
     return psycopg2.connect(**db_config)
 
 
-def migration_up():
-    conn = db_connection()
-    cur = conn.cursor()
-    try:
-        create = sql.SQL("""
+def _migration_0001_initial(cur):
+    create = sql.SQL("""
 CREATE TABLE IF NOT EXISTS places (
     id serial PRIMARY KEY,
     name varchar,
@@ -160,8 +161,403 @@ CREATE TABLE IF NOT EXISTS follow (
 );
 
 """)
-        cur.execute(create)
-        conn.commit()
+    cur.execute(create)
+
+
+HOT_LOOKUP_INDEXES = [
+    ("reviews_idplace_idx", "reviews (idPlace)"),
+    ("reviews_iduser_idx", "reviews (idUser)"),
+    ("reviews_photo_review_id_idx", "reviews_photo (review_id)"),
+    ("product_id_place_idx", "product (id_place)"),
+    ("reklama_id_place_idx", "reklama (id_place)"),
+    ("sport_interfaces_place_id_place_idx", "sport_interfaces_place (id_place)"),
+    ("places_photos_place_id_idx", "places_photos (place_id)"),
+    ("users_photos_user_id_idx", "users_photos (user_id)"),
+    ("follow_follow_id_idx", "follow (follow_id)"),
+]
+
+# Код уже считает эти ключи уникальными: create_user/create_admin проверяют email,
+# set_review_rank держит одну оценку на пользователя, add_follow не дублирует подписку
+UNIQUE_INDEXES = [
+    ("reviews_ranks_review_user_uniq", "reviews_ranks (review_id, user_id)",
+     """DELETE FROM reviews_ranks a USING reviews_ranks b
+        WHERE a.review_id = b.review_id AND a.user_id = b.user_id AND a.id < b.id"""),
+    ("follow_user_follow_uniq", "follow (user_id, follow_id)",
+     """DELETE FROM follow a USING follow b
+        WHERE a.user_id = b.user_id AND a.follow_id = b.follow_id AND a.ctid < b.ctid"""),
+    ("users_email_uniq", "users (email)", None),
+    ("admins_email_uniq", "admins (email)", None),
+]
+
+
+def _drop_invalid_index(cur, name):
+    # Прерванный CREATE INDEX CONCURRENTLY оставляет невалидный индекс, который IF NOT EXISTS пропустил бы
+    cur.execute("""
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND NOT i.indisvalid
+    """, (name,))
+    if cur.fetchone():
+        cur.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(name)))
+
+
+class MigrationError(Exception):
+    pass
+
+
+def _duplicates(cur, target, limit=20) -> list:
+    """Повторяющиеся значения ключа с числом строк, не больше limit"""
+    table, columns = target.split(" ", 1)
+    columns = columns.strip("()")
+    cur.execute(f"SELECT {columns}, COUNT(*) FROM {table} WHERE ({columns}) IS NOT NULL "
+                f"GROUP BY {columns} HAVING COUNT(*) > 1 ORDER BY COUNT(*) DESC LIMIT %s", (limit,))
+    return cur.fetchall()
+
+
+def _migration_0002_hot_lookup_indexes(cur):
+    for name, target in HOT_LOOKUP_INDEXES:
+        _drop_invalid_index(cur, name)
+        cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {target}")
+
+    for name, target, dedup in UNIQUE_INDEXES:
+        _drop_invalid_index(cur, name)
+        if dedup:
+            cur.execute(dedup)
+            if cur.rowcount:
+                logger.warning(f"Removed {cur.rowcount} duplicate rows from {target} before creating {name}")
+        duplicates = _duplicates(cur, target)
+        if duplicates:
+            # Сами дубли (например, email) удалять нельзя: их сводит оператор, затем
+            # миграция повторяется при следующем старте — версия 2 не записана
+            listed = "; ".join(f"{' / '.join(map(str, row[:-1]))} ({row[-1]} rows)" for row in duplicates)
+            raise MigrationError(f"Cannot create unique index {name}: duplicates in {target}: {listed}")
+        cur.execute(f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {target}")
+
+
+def _migration_0003_places_geo_index(cur):
+    # Выражение совпадает с db.geo.PROJECTED_POINT
+    _drop_invalid_index(cur, "places_geo_knn_idx")
+    cur.execute("""
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS places_geo_knn_idx
+        ON places USING gist (point(coord2 * cos(radians(coord1)), coord1))
+    """)
+
+
+def _migration_0004_places_lonlat_index(cur):
+    # Выражение совпадает с db.geo.LONLAT_POINT
+    _drop_invalid_index(cur, "places_lonlat_idx")
+    cur.execute("""
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS places_lonlat_idx
+        ON places USING gist (point(coord2, coord1))
+    """)
+
+
+# Пересчёт денормализованных агрегатов из исходных таблиц. Обновляются только
+# разошедшиеся строки, RETURNING отдаёт их id — так же работает сверка в db.aggregates.
+_RECONCILE_PLACES_TEMPLATE = """
+    WITH actual AS (
+        SELECT p.id,
+            COUNT(r.id) AS review_count,
+            COUNT(r.rating) AS rating_count,
+            COALESCE(SUM(r.rating), 0) AS rating_sum
+        FROM places p
+        LEFT JOIN reviews r ON r.idPlace = p.id{review_filter}
+        GROUP BY p.id
+    )
+    UPDATE places p SET
+        review_count = a.review_count,
+        rating_count = a.rating_count,
+        rating_sum = a.rating_sum,
+        review_rank = CASE WHEN a.rating_count > 0
+            THEN round(a.rating_sum::numeric / a.rating_count, 2) ELSE 0 END
+    FROM actual a
+    WHERE p.id = a.id AND (p.review_count, p.rating_count, p.rating_sum) IS DISTINCT FROM
+        (a.review_count::int, a.rating_count::int, a.rating_sum::int)
+    RETURNING p.id
+"""
+
+# В агрегатах учитываются только одобренные модерацией отзывы
+RECONCILE_PLACES_SQL = _RECONCILE_PLACES_TEMPLATE.format(review_filter=" AND r.status = 'approved'")
+
+RECONCILE_REVIEWS_SQL = """
+    WITH actual AS (
+        SELECT r.id,
+            COUNT(rr.id) FILTER (WHERE rr."like" = true) AS like_count,
+            COUNT(rr.id) FILTER (WHERE rr.dislike = true) AS dislike_count
+        FROM reviews r
+        LEFT JOIN reviews_ranks rr ON rr.review_id = r.id
+        GROUP BY r.id
+    )
+    UPDATE reviews r SET
+        like_count = a.like_count,
+        dislike_count = a.dislike_count
+    FROM actual a
+    WHERE r.id = a.id AND (r.like_count, r.dislike_count) IS DISTINCT FROM
+        (a.like_count::int, a.dislike_count::int)
+    RETURNING r.id, r.idPlace
+"""
+
+
+def _migration_0005_review_aggregates(cur):
+    cur.execute("""
+        ALTER TABLE places
+            ADD COLUMN IF NOT EXISTS review_count int NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS rating_count int NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS rating_sum int NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS review_rank numeric(10,2) NOT NULL DEFAULT 0;
+        ALTER TABLE reviews
+            ADD COLUMN IF NOT EXISTS like_count int NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS dislike_count int NOT NULL DEFAULT 0;
+    """)
+    # На этой версии схемы колонки reviews.status ещё нет
+    cur.execute(_RECONCILE_PLACES_TEMPLATE.format(review_filter=""))
+    cur.execute(RECONCILE_REVIEWS_SQL)
+
+
+def _migration_0006_review_status(cur):
+    # Уже опубликованные отзывы считаются одобренными, новые вставляются как 'pending'
+    cur.execute("""
+        ALTER TABLE reviews
+            ADD COLUMN IF NOT EXISTS status varchar NOT NULL DEFAULT 'approved'
+            CHECK (status IN ('pending', 'approved', 'rejected'))
+    """)
+
+
+def _migration_0007_pending_reviews_index(cur):
+    _drop_invalid_index(cur, "reviews_pending_idx")
+    cur.execute("""
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS reviews_pending_idx
+        ON reviews (id) WHERE status = 'pending'
+    """)
+
+
+def _migration_0008_moderation_verdicts(cur):
+    # Кэш решений модерации по хэшу нормализованного текста или байтов картинки
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS moderation_verdicts (
+            kind varchar NOT NULL,
+            content_hash char(64) NOT NULL,
+            verdict smallint NOT NULL,
+            created_at timestamp NOT NULL DEFAULT now(),
+            last_hit_at timestamp NOT NULL DEFAULT now(),
+            PRIMARY KEY (kind, content_hash)
+        );
+        CREATE INDEX IF NOT EXISTS moderation_verdicts_last_hit_idx ON moderation_verdicts (last_hit_at);
+    """)
+
+
+
+# Таблицы, строки которых ссылаются на фото по url
+PHOTO_REFERENCE_TABLES = ("places_photos", "reviews_photo", "users_photos")
+
+# Пересчёт photo_objects.ref_count по таблицам ссылок (триггеры держат его
+# актуальным, сверка нужна после ручных правок данных)
+RECONCILE_PHOTO_REFS_SQL = """
+    WITH refs AS (
+        SELECT url FROM places_photos
+        UNION ALL SELECT url FROM reviews_photo
+        UNION ALL SELECT url FROM users_photos
+    ), counts AS (
+        SELECT po.hash, count(refs.url) AS ref_count
+        FROM photo_objects po
+        LEFT JOIN refs ON refs.url IN (po.url, po.original_url)
+        GROUP BY po.hash
+    )
+    UPDATE photo_objects po SET
+        ref_count = counts.ref_count,
+        orphaned_at = CASE WHEN counts.ref_count = 0 THEN COALESCE(po.orphaned_at, now()) END
+    FROM counts
+    WHERE po.hash = counts.hash AND po.ref_count <> counts.ref_count
+    RETURNING po.hash
+"""
+
+
+def _migration_0009_photo_objects(cur):
+    # Хранилище фото с адресацией по содержимому: один объект на sha256 байтов.
+    # ref_count — число строк places_photos/reviews_photo/users_photos с url
+    # или original_url объекта; объекты с нулём дольше PHOTO_GC_GRACE удаляет
+    # сборщик db.photos. Фото, загруженные раньше, в таблицу не попадают и не удаляются.
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS photo_objects (
+            hash char(64) PRIMARY KEY,
+            object_name varchar NOT NULL UNIQUE,
+            url varchar NOT NULL,
+            original_url varchar NOT NULL,
+            variants jsonb NOT NULL DEFAULT '{}',
+            size bigint,
+            ref_count int NOT NULL DEFAULT 0,
+            created_at timestamp NOT NULL DEFAULT now(),
+            orphaned_at timestamp DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS photo_objects_url_idx ON photo_objects (url);
+        CREATE INDEX IF NOT EXISTS photo_objects_original_url_idx ON photo_objects (original_url);
+        CREATE INDEX IF NOT EXISTS photo_objects_orphaned_idx ON photo_objects (orphaned_at) WHERE ref_count = 0;
+
+        CREATE OR REPLACE FUNCTION photo_objects_ref() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('DELETE', 'UPDATE') AND OLD.url IS NOT NULL THEN
+                UPDATE photo_objects SET
+                    ref_count = GREATEST(ref_count - 1, 0),
+                    orphaned_at = CASE WHEN ref_count <= 1 THEN now() END
+                WHERE url = OLD.url OR original_url = OLD.url;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.url IS NOT NULL THEN
+                UPDATE photo_objects SET ref_count = ref_count + 1, orphaned_at = NULL
+                WHERE url = NEW.url OR original_url = NEW.url;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+    """)
+    for table in PHOTO_REFERENCE_TABLES:
+        cur.execute(sql.SQL("""
+            DROP TRIGGER IF EXISTS {trigger} ON {table};
+            CREATE TRIGGER {trigger} AFTER INSERT OR DELETE OR UPDATE OF url ON {table}
+            FOR EACH ROW EXECUTE FUNCTION photo_objects_ref();
+        """).format(trigger=sql.Identifier(f"{table}_photo_ref"), table=sql.Identifier(table)))
+    # Фото удалённых отзывов раньше оставались в reviews_photo
+    cur.execute("DELETE FROM reviews_photo WHERE NOT EXISTS (SELECT 1 FROM reviews WHERE reviews.id = review_id)")
+
+
+def _migration_0010_approved_reviews_by_author_index(cur):
+    # Последние одобренные отзывы автора: дозаполнение лент и чтение авторов без fan-out
+    _drop_invalid_index(cur, "reviews_approved_author_idx")
+    cur.execute("""
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS reviews_approved_author_idx
+        ON reviews (idUser, id) WHERE status = 'approved'
+    """)
+
+
+def _migration_0011_follow_feed(cur):
+    # Готовые ленты подписок (см. db.feed); заполняются по уже существующим подпискам
+    from db.feed import rebuild_feeds
+
+    cur.execute("""
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS follower_count int NOT NULL DEFAULT 0;
+        CREATE TABLE IF NOT EXISTS feed_items (
+            user_id int NOT NULL,
+            review_id int NOT NULL,
+            author_id int NOT NULL,
+            PRIMARY KEY (user_id, review_id)
+        );
+        CREATE INDEX IF NOT EXISTS feed_items_review_id_idx ON feed_items (review_id);
+    """)
+    rebuild_feeds(cur)
+
+
+# Начальное событие журнала рейтинга: рейтинг, накопленный до появления журнала
+RATING_BASELINE_SQL = """
+    INSERT INTO rating_events (user_id, delta, reason)
+    SELECT id, rating, 'baseline' FROM users WHERE COALESCE(rating, 0) <> 0
+"""
+
+
+def _migration_0012_rating_events(cur):
+    # Журнал начислений рейтинга (см. db.ratings): users.rating = сумма delta
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS rating_events (
+            id bigserial PRIMARY KEY,
+            user_id int NOT NULL,
+            delta int NOT NULL,
+            reason varchar NOT NULL,
+            ref_id int,
+            created_at timestamp NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS rating_events_user_id_idx ON rating_events (user_id);
+        CREATE INDEX IF NOT EXISTS rating_events_created_at_idx ON rating_events (created_at);
+    """)
+    cur.execute(RATING_BASELINE_SQL)
+
+
+def _migration_0013_moderation_claims(cur):
+    # До какого момента 'pending' отзыв захвачен репликой для модерации (см. db.moderation)
+    cur.execute("ALTER TABLE reviews ADD COLUMN IF NOT EXISTS moderation_claimed_until timestamp")
+
+
+def _migration_0014_photo_uploads(cur):
+    # Объекты, выданные presigned-загрузке и ещё не зарегистрированные в photo_objects.
+    # Строки старше PHOTO_PRESIGN_EXPIRES + PHOTO_UPLOAD_GRACE удаляет сборщик db.photos
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS photo_uploads (
+            object_name varchar PRIMARY KEY,
+            created_at timestamp NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS photo_uploads_created_idx ON photo_uploads (created_at);
+    """)
+
+
+# (версия, название, функция, выполнять ли в транзакции).
+# CREATE INDEX CONCURRENTLY нельзя выполнять в транзакции, такие шаги должны быть идемпотентны:
+# если процесс упадёт посреди шага, при следующем старте он выполнится заново.
+MIGRATIONS = [
+    (1, "initial schema", _migration_0001_initial, True),
+    (2, "hot lookup indexes", _migration_0002_hot_lookup_indexes, False),
+    (3, "places geo index", _migration_0003_places_geo_index, False),
+    (4, "places lon/lat index", _migration_0004_places_lonlat_index, False),
+    (5, "review aggregates", _migration_0005_review_aggregates, True),
+    (6, "review moderation status", _migration_0006_review_status, True),
+    (7, "pending reviews index", _migration_0007_pending_reviews_index, False),
+    (8, "moderation verdict cache", _migration_0008_moderation_verdicts, True),
+    (9, "content-addressed photo objects", _migration_0009_photo_objects, True),
+    (10, "approved reviews by author index", _migration_0010_approved_reviews_by_author_index, False),
+    (11, "follow feed", _migration_0011_follow_feed, True),
+    (12, "rating ledger", _migration_0012_rating_events, True),
+    (13, "moderation claims", _migration_0013_moderation_claims, True),
+    (14, "photo uploads", _migration_0014_photo_uploads, True),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Ключ pg_advisory_lock, под которым реплики по очереди применяют миграции
+MIGRATION_LOCK_KEY = 7251201
+
+
+def _current_version(cur) -> int:
+    cur.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return 0
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cur.fetchone()[0]
+
+
+def migration_up():
+    """Применяет только недостающие миграции.
+
+    Если схема уже актуальна, выполняются два коротких SELECT без DDL и без
+    блокировок. Иначе миграции применяются под advisory lock, так что
+    несколько реплик могут стартовать одновременно.
+    """
+    conn = db_connection()
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        if _current_version(cur) >= LATEST_VERSION:
+            return None
+
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        try:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version int PRIMARY KEY,
+                    name varchar,
+                    applied_at timestamp default now()
+                )
+            """)
+            current = _current_version(cur)
+            for version, name, apply, transactional in MIGRATIONS:
+                if version <= current:
+                    continue
+                print(f"Applying migration {version}: {name}")
+                conn.autocommit = not transactional
+                apply(cur)
+                cur.execute("INSERT INTO schema_version (version, name) VALUES (%s, %s)", (version, name))
+                if transactional:
+                    conn.commit()
+                    conn.autocommit = True
+        finally:
+            if not conn.autocommit:
+                conn.rollback()
+                conn.autocommit = True
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
     except (Exception, psycopg2.DatabaseError) as error:
         return error
     finally:
@@ -176,7 +572,7 @@ def migration_down():
     try:
         drop = sql.SQL("""DROP TABLE IF EXISTS follow, admins, places, places_type, product,
                             product_type, reklama, reklama_type, reviews, reviews_photo, reviews_ranks, sport_type, sport_interfaces,
-                            sport_interfaces_place, food_type, users, places_photos, users_photos;""")
+                            sport_interfaces_place, food_type, users, places_photos, users_photos, moderation_verdicts, photo_objects, photo_uploads, feed_items, rating_events, schema_version;""")
 
         cur.execute(drop)
         conn.commit()
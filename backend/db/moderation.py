@@ -0,0 +1,224 @@
+import logging
+from typing import Optional
+
+import psycopg2
+from psycopg2 import sql
+
+import config as config
+
+from db.aggregates import apply_review_added
+from db.executor import run_in_db_thread
+from db.feed import fan_out_review
+from db.leaderboard import update_leaderboard
+from db.map import invalidate_place_cache
+from db.pool import get_connection
+from db.ratings import award_many, REVIEW_APPROVED
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд отзыв, взятый репликой на модерацию, недоступен другим
+MODERATION_CLAIM_TTL = getattr(config, 'MODERATION_CLAIM_TTL', 900.0)
+
+# Начисление автору за одобренный отзыв и дополнительно за отзыв с фото
+REVIEW_RATING_AWARD = 5
+REVIEW_PHOTO_RATING_AWARD = 10
+
+
+@run_in_db_thread
+def claim_pending_reviews(limit: Optional[int] = None, lease: float = MODERATION_CLAIM_TTL) -> list:
+    """Захватывает на lease секунд 'pending' отзывы, которые никто не держит: [(id, text), ...].
+
+    Строки, которые в этот момент захватывает другая реплика, пропускаются
+    (SKIP LOCKED), поэтому один отзыв не уходит в модель дважды. Если
+    реплика упала, не применив решение, отзыв снова станет доступен после
+    истечения захвата.
+    """
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            query = sql.SQL("""
+                UPDATE reviews SET moderation_claimed_until = now() + make_interval(secs => %s)
+                WHERE id IN (
+                    SELECT id FROM reviews
+                    WHERE status = 'pending'
+                        AND (moderation_claimed_until IS NULL OR moderation_claimed_until < now())
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, text
+            """)
+            cursor.execute(query, (lease, limit))
+            rows = sorted(cursor.fetchall())
+            connection.commit()
+            return rows
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            return []
+        finally:
+            cursor.close()
+
+
+@run_in_db_thread
+def release_pending_reviews(review_ids: list) -> int:
+    """Снимает захват с 'pending' отзывов, решение по которым получить не удалось.
+
+    Следующий проход claim_pending_reviews любой реплики возьмёт их сразу,
+    не дожидаясь MODERATION_CLAIM_TTL. Возвращает число освобождённых строк.
+    """
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            cursor.execute("""
+                UPDATE reviews SET moderation_claimed_until = NULL
+                WHERE id = ANY(%s) AND status = 'pending'
+            """, (list(review_ids),))
+            released = cursor.rowcount
+            connection.commit()
+            return released
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            return 0
+        finally:
+            cursor.close()
+
+
+@run_in_db_thread
+def apply_moderation_verdicts(verdicts: dict) -> dict:
+    """Применяет решения модерации {review_id: 1 (токсичный) | 0} одной транзакцией.
+
+    Одобренный отзыв становится видимым, попадает в агрегаты места, а автор
+    получает рейтинг. Отзывы, которые уже не в статусе 'pending' (удалены или
+    обработаны раньше), пропускаются. Возвращает число одобренных и отклонённых.
+    """
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            review_ids = sorted(verdicts)
+            update_status = sql.SQL("""
+                UPDATE reviews SET status = CASE WHEN v.toxic = 1 THEN 'rejected' ELSE 'approved' END
+                FROM unnest(%s::int[], %s::int[]) AS v(id, toxic)
+                WHERE reviews.id = v.id AND reviews.status = 'pending'
+                RETURNING reviews.id, reviews.status, idUser, idPlace, rating,
+                    EXISTS(SELECT 1 FROM reviews_photo WHERE review_id = reviews.id)
+            """)
+            cursor.execute(update_status, (review_ids, [int(bool(verdicts[review_id])) for review_id in review_ids]))
+            rows = cursor.fetchall()
+            approved_rows = [row for row in rows if row[1] == 'approved']
+
+            # Места и авторы обновляются по возрастанию id: параллельные пачки
+            # блокируют строки в одном порядке и не встают во взаимную блокировку
+            for review_id, _, user_id, place_id, rating, _ in sorted(approved_rows, key=lambda row: (row[3], row[0])):
+                apply_review_added(cursor, place_id, rating)
+                fan_out_review(cursor, review_id, user_id)
+            authors = award_many(cursor, [
+                (user_id, REVIEW_RATING_AWARD + (REVIEW_PHOTO_RATING_AWARD if has_photos else 0), REVIEW_APPROVED,
+                 review_id)
+                for review_id, _, user_id, _, _, has_photos in approved_rows
+            ])
+
+            connection.commit()
+            for place_id in {row[3] for row in approved_rows}:
+                invalidate_place_cache(place_id)
+            for user_id, ranked in authors.items():
+                update_leaderboard(user_id, *ranked)
+            return {"approved": len(approved_rows), "rejected": len(rows) - len(approved_rows)}
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+@run_in_db_thread
+def get_cached_verdicts(kind: str, hashes: list, ttl: float) -> dict:
+    """Сохранённые решения {hash: verdict} не старше ttl секунд; отмечает их использование"""
+    if not hashes:
+        return {}
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            query = sql.SQL("""
+                UPDATE moderation_verdicts SET last_hit_at = now()
+                WHERE kind = %s AND content_hash = ANY(%s)
+                    AND created_at > now() - make_interval(secs => %s)
+                RETURNING content_hash, verdict
+            """)
+            cursor.execute(query, (kind, list(hashes), ttl))
+            rows = cursor.fetchall()
+            connection.commit()
+            return {row[0]: row[1] for row in rows}
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            return {}
+        finally:
+            cursor.close()
+
+
+@run_in_db_thread
+def store_verdicts(kind: str, verdicts: dict) -> bool:
+    if not verdicts:
+        return True
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            query = sql.SQL("""
+                INSERT INTO moderation_verdicts (kind, content_hash, verdict)
+                SELECT %s, h, v FROM unnest(%s::text[], %s::smallint[]) AS t(h, v)
+                ON CONFLICT (kind, content_hash) DO UPDATE
+                SET verdict = EXCLUDED.verdict, created_at = now(), last_hit_at = now()
+            """)
+            hashes = list(verdicts)
+            cursor.execute(query, (kind, hashes, [verdicts[h] for h in hashes]))
+            connection.commit()
+            return True
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            return False
+        finally:
+            cursor.close()
+
+
+@run_in_db_thread
+def prune_verdicts(ttl: float, max_entries: int) -> int:
+    """Удаляет устаревшие решения и самые давно не использованные сверх max_entries"""
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            cursor.execute("""
+                DELETE FROM moderation_verdicts
+                WHERE created_at < now() - make_interval(secs => %s)
+            """, (ttl,))
+            removed = cursor.rowcount
+            cursor.execute("""
+                DELETE FROM moderation_verdicts WHERE (kind, content_hash) IN (
+                    SELECT kind, content_hash FROM moderation_verdicts
+                    ORDER BY last_hit_at DESC OFFSET %s
+                )
+            """, (max_entries,))
+            removed += cursor.rowcount
+            connection.commit()
+            return removed
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            return 0
+        finally:
+            cursor.close()
@@ -0,0 +1,59 @@
+import base64
+import json
+from typing import Optional
+
+
+def encode_cursor(*key) -> str:
+    """Непрозрачный курсор из ключа сортировки последней строки страницы"""
+    raw = json.dumps(list(key), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(key, list) or not key:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return key
+
+
+def decode_id_cursor(cursor: Optional[str]) -> Optional[int]:
+    if cursor is None:
+        return None
+    key = decode_cursor(cursor)
+    if len(key) != 1 or not isinstance(key[0], int):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return key[0]
+
+
+def paginate(column: str, limit: Optional[int] = None, offset: Optional[int] = None,
+             page: Optional[int] = None, after: Optional[int] = None, descending: bool = False) -> tuple:
+    """Условие, хвост запроса и параметры для постраничной выборки по column.
+
+    С after выборка идёт по ключу (column > after), и страница любой глубины
+    стоит как первая. offset/page оставлены для старых клиентов.
+    Возвращает (условие или None, параметры условия, ORDER BY/LIMIT/OFFSET, их параметры).
+    """
+    condition, condition_params = None, []
+    if after is not None:
+        condition = f"{column} {'<' if descending else '>'} %s"
+        condition_params.append(after)
+
+    suffix = f" ORDER BY {column}{' DESC' if descending else ''}"
+    suffix_params = []
+    if limit is not None:
+        suffix += " LIMIT %s"
+        suffix_params.append(limit)
+        if after is None and offset is not None:
+            suffix += " OFFSET %s"
+            suffix_params.append(offset * (page - 1) if page is not None else offset)
+    return condition, condition_params, suffix, suffix_params
+
+
+def next_cursor(items: list, limit: Optional[int], key: str = "id") -> Optional[str]:
+    if not items or limit is None or len(items) < limit:
+        return None
+    return encode_cursor(items[-1][key])
@@ -0,0 +1,351 @@
+"""Фото с адресацией по содержимому.
+
+photo_objects хранит по одной строке на sha256 байтов: объект в MinIO, его
+варианты и число ссылок из places_photos, reviews_photo и users_photos
+(считают триггеры, см. миграцию 9). Повторная загрузка тех же байтов
+получает уже существующий URL.
+
+Объекты без ссылок дольше PHOTO_GC_GRACE удаляются пачками:
+
+    python -m db.photos             # сборка мусора
+    python -m db.photos --dry-run   # только посчитать кандидатов
+    python -m db.photos --reconcile # пересчитать ref_count и собрать мусор
+    python -m db.photos --purge-originals  # удалить оригиналы, сохранённые до вариантов
+
+Presigned-загрузки записываются в photo_uploads до регистрации. Объект,
+для которого /photo/complete так и не вызвали, удаляется тем же сборщиком
+через PHOTO_PRESIGN_EXPIRES + PHOTO_UPLOAD_GRACE после выдачи URL.
+
+Оригинал с EXIF удаляется сразу после построения вариантов, поэтому у новых
+строк original_url совпадает с url. Фото, загруженные раньше, хранили
+публичный оригинал отдельно; --purge-originals удаляет такие оригиналы, если
+на их URL никто не ссылается.
+"""
+import json
+import logging
+import sys
+from typing import Optional
+
+import psycopg2
+
+import config as config
+from db.executor import run_in_db_thread
+from db.migration import RECONCILE_PHOTO_REFS_SQL
+from db.pool import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Сколько объект без ссылок живёт до удаления: загруженное фото получает
+# первую ссылку только после сохранения отзыва или места
+PHOTO_GC_GRACE = getattr(config, 'PHOTO_GC_GRACE', 24 * 3600)
+PHOTO_GC_BATCH_SIZE = getattr(config, 'PHOTO_GC_BATCH_SIZE', 500)
+# Запас сверх срока presigned URL: загрузка, начатая в последний момент, и вызов /photo/complete
+PHOTO_UPLOAD_GRACE = getattr(config, 'PHOTO_UPLOAD_GRACE', 3600)
+
+_PHOTO_COLUMNS = "object_name, url, variants"
+
+
+def _photo_from_row(row) -> dict:
+    return {
+        "object_name": row[0],
+        "url": row[1],
+        "variants": row[2] or {},
+    }
+
+
+@run_in_db_thread
+def find_photo_object(content_hash: str) -> Optional[dict]:
+    """Фото с такими байтами, если уже загружено.
+
+    Найденному объекту без ссылок заново отсчитывается PHOTO_GC_GRACE: его
+    URL вот-вот снова будет сохранён.
+    """
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            cursor.execute(f"""
+                UPDATE photo_objects SET
+                    orphaned_at = CASE WHEN ref_count = 0 THEN now() ELSE orphaned_at END
+                WHERE hash = %s
+                RETURNING {_PHOTO_COLUMNS}
+            """, (content_hash,))
+            row = cursor.fetchone()
+            connection.commit()
+            return _photo_from_row(row) if row else None
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            return None
+        finally:
+            cursor.close()
+
+
+@run_in_db_thread
+def register_photo_object(content_hash: str, object_name: str, url: str, original_url: str,
+                          variants: dict, size: Optional[int] = None) -> dict:
+    """Регистрирует загруженный объект; возвращает фото, закреплённое за хэшем.
+
+    Если те же байты параллельно зарегистрировал другой запрос, возвращается
+    его объект — свой вызывающий должен удалить.
+    """
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            cursor.execute(f"""
+                INSERT INTO photo_objects (hash, object_name, url, original_url, variants, size)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (hash) DO UPDATE SET
+                    orphaned_at = CASE WHEN photo_objects.ref_count = 0 THEN now()
+                                       ELSE photo_objects.orphaned_at END
+                RETURNING {_PHOTO_COLUMNS}
+            """, (content_hash, object_name, url, original_url, json.dumps(variants), size))
+            row = cursor.fetchone()
+            # Дальше объект учитывает photo_objects (или его удаляет вызывающий)
+            cursor.execute("DELETE FROM photo_uploads WHERE object_name = %s", (object_name,))
+            connection.commit()
+            return _photo_from_row(row)
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+@run_in_db_thread
+def track_photo_upload(object_name: str):
+    """Запоминает объект presigned-загрузки до его регистрации"""
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            cursor.execute("INSERT INTO photo_uploads (object_name) VALUES (%s) ON CONFLICT DO NOTHING",
+                           (object_name,))
+            connection.commit()
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+@run_in_db_thread
+def claim_abandoned_uploads(grace: float, limit: int = PHOTO_GC_BATCH_SIZE, dry_run: bool = False) -> list:
+    """Снимает с учёта пачку presigned-загрузок, не зарегистрированных за grace секунд; имена объектов"""
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            candidates = """
+                SELECT object_name FROM photo_uploads
+                WHERE created_at < now() - make_interval(secs => %s)
+                ORDER BY created_at
+                LIMIT %s
+            """
+            if dry_run:
+                cursor.execute(candidates, (grace, limit))
+            else:
+                cursor.execute(f"""
+                    DELETE FROM photo_uploads WHERE object_name IN ({candidates} FOR UPDATE SKIP LOCKED)
+                    RETURNING object_name
+                """, (grace, limit))
+            names = [row[0] for row in cursor.fetchall()]
+            connection.commit()
+            return names
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            return []
+        finally:
+            cursor.close()
+
+
+@run_in_db_thread
+def claim_orphan_photos(grace: float = PHOTO_GC_GRACE, limit: int = PHOTO_GC_BATCH_SIZE,
+                        dry_run: bool = False) -> list:
+    """Удаляет из photo_objects пачку объектов без ссылок; [(object_name, variants), ...].
+
+    Строки, которые сейчас обновляет загрузка или триггер ссылок, пропускаются
+    (SKIP LOCKED) и попадут в следующий проход.
+    """
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            candidates = """
+                SELECT hash FROM photo_objects
+                WHERE ref_count = 0 AND orphaned_at < now() - make_interval(secs => %s)
+                ORDER BY orphaned_at
+                LIMIT %s
+            """
+            if dry_run:
+                cursor.execute(f"SELECT object_name, variants FROM photo_objects WHERE hash IN ({candidates})",
+                               (grace, limit))
+            else:
+                cursor.execute(f"""
+                    DELETE FROM photo_objects WHERE hash IN ({candidates} FOR UPDATE SKIP LOCKED)
+                    RETURNING object_name, variants
+                """, (grace, limit))
+            rows = [(row[0], row[1] or {}) for row in cursor.fetchall()]
+            connection.commit()
+            return rows
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            return []
+        finally:
+            cursor.close()
+
+
+@run_in_db_thread
+def reconcile_photo_refs() -> int:
+    """Пересчитывает ref_count по таблицам ссылок; число исправленных строк"""
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            cursor.execute(RECONCILE_PHOTO_REFS_SQL)
+            fixed = cursor.rowcount
+            connection.commit()
+            if fixed:
+                logger.warning(f"Fixed photo reference counts: {fixed}")
+            return fixed
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+@run_in_db_thread
+def claim_public_originals(limit: int = PHOTO_GC_BATCH_SIZE) -> list:
+    """Снимает с учёта пачку оригиналов, у которых есть варианты; имена объектов.
+
+    Оригиналы, на URL которых есть ссылки, остаются как есть.
+    """
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            cursor.execute("""
+                UPDATE photo_objects SET original_url = url
+                WHERE hash IN (
+                    SELECT hash FROM photo_objects po
+                    WHERE original_url <> url AND variants <> '{}'::jsonb
+                      AND NOT EXISTS (SELECT 1 FROM places_photos WHERE url = po.original_url)
+                      AND NOT EXISTS (SELECT 1 FROM reviews_photo WHERE url = po.original_url)
+                      AND NOT EXISTS (SELECT 1 FROM users_photos WHERE url = po.original_url)
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING object_name
+            """, (limit,))
+            names = [row[0] for row in cursor.fetchall()]
+            connection.commit()
+            return names
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            return []
+        finally:
+            cursor.close()
+
+
+def purge_public_originals(batch_size: int = PHOTO_GC_BATCH_SIZE) -> dict:
+    """Удаляет из MinIO оригиналы фото, загруженных до удаления оригиналов после вариантов"""
+    import s3_client
+
+    report = {"objects": 0, "failed": []}
+    while True:
+        names = claim_public_originals.sync(batch_size)
+        report["objects"] += len(names)
+        report["failed"].extend(s3_client.delete_objects(names))
+        if len(names) < batch_size:
+            break
+    if report["objects"]:
+        logger.info(f"Purged {report['objects']} photo originals, {len(report['failed'])} failed")
+    return report
+
+
+def collect_orphan_photos(grace: float = PHOTO_GC_GRACE, batch_size: int = PHOTO_GC_BATCH_SIZE,
+                          max_batches: Optional[int] = None, dry_run: bool = False) -> dict:
+    """Сборка мусора: пачками снимает объекты без ссылок с учёта и удаляет их из MinIO.
+
+    Строка удаляется раньше объектов: если MinIO недоступен, остаётся лишний
+    файл, но не URL, который дедупликация выдала бы на несуществующий объект.
+    """
+    import s3_client
+
+    report = {"photos": 0, "objects": 0, "failed": [], "batches": 0, "dry_run": dry_run}
+    while max_batches is None or report["batches"] < max_batches:
+        claimed = claim_orphan_photos.sync(grace, batch_size, dry_run)
+        if not claimed:
+            break
+        report["batches"] += 1
+        report["photos"] += len(claimed)
+        names = [name for object_name, variants in claimed for name in (object_name, *variants.values())]
+        report["objects"] += len(names)
+        if dry_run:
+            # Без удаления следующий запрос вернул бы ту же пачку
+            break
+        report["failed"].extend(s3_client.delete_objects(names))
+        if len(claimed) < batch_size:
+            break
+
+    if report["photos"]:
+        logger.info(f"Photo GC: {report['photos']} photos, {report['objects']} objects, "
+                    f"{len(report['failed'])} failed")
+    return report
+
+
+def collect_abandoned_uploads(grace: Optional[float] = None, batch_size: int = PHOTO_GC_BATCH_SIZE,
+                              max_batches: Optional[int] = None, dry_run: bool = False) -> dict:
+    """Удаляет объекты presigned-загрузок, для которых так и не вызвали /photo/complete.
+
+    Вместе с объектом удаляются варианты, если обработка успела их выгрузить.
+    Загрузки, отклонённые при проверке, тоже проходят здесь: их объекты уже
+    удалены, и запрос на удаление ничего не делает.
+    """
+    import s3_client
+    from images import photo_variant_names
+
+    if grace is None:
+        grace = s3_client.PHOTO_PRESIGN_EXPIRES + PHOTO_UPLOAD_GRACE
+    report = {"uploads": 0, "objects": 0, "failed": [], "batches": 0, "dry_run": dry_run}
+    while max_batches is None or report["batches"] < max_batches:
+        claimed = claim_abandoned_uploads.sync(grace, batch_size, dry_run)
+        if not claimed:
+            break
+        report["batches"] += 1
+        report["uploads"] += len(claimed)
+        names = [name for object_name in claimed for name in (object_name, *photo_variant_names(object_name))]
+        report["objects"] += len(names)
+        if dry_run:
+            break
+        report["failed"].extend(s3_client.delete_objects(names))
+        if len(claimed) < batch_size:
+            break
+
+    if report["uploads"]:
+        logger.info(f"Abandoned uploads: {report['uploads']} uploads, {len(report['failed'])} failed")
+    return report
+
+
+if __name__ == "__main__":
+    if "--reconcile" in sys.argv:
+        print(f"ref_count fixed: {reconcile_photo_refs.sync()}")
+    if "--purge-originals" in sys.argv:
+        print(json.dumps(purge_public_originals(), indent=2))
+    print(json.dumps(collect_orphan_photos(dry_run="--dry-run" in sys.argv), indent=2))
+    print(json.dumps(collect_abandoned_uploads(dry_run="--dry-run" in sys.argv), indent=2))
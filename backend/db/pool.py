@@ -0,0 +1,219 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+import config as config
+from db.migration import db_config
+from db.querylog import InstrumentedCursor
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Потокобезопасный пул соединений с PostgreSQL.
+
+    Держит от min_size до max_size открытых соединений. При выдаче соединение
+    проверяется (закрытые и сломанные заменяются новыми), при возврате
+    незавершённая транзакция откатывается.
+    """
+
+    def __init__(self, min_size: int = 1, max_size: int = 10, timeout: float = 5.0,
+                 health_check_interval: float = 30.0, **connect_kwargs):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min={min_size}, max={max_size}")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._connect_kwargs = connect_kwargs
+
+        self._lock = threading.Condition()
+        self._idle = []  # [(connection, last_used_monotonic)]
+        self._in_use = set()
+        self._opening = 0
+        self._waiting = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._broken = 0
+        self._wait_time_total = 0.0
+        self._max_in_use = 0
+
+        for _ in range(min_size):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        return psycopg2.connect(**self._connect_kwargs)
+
+    def _is_healthy(self, connection, last_used: float) -> bool:
+        if connection.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise psycopg2.InterfaceError("connection pool is closed")
+                if self._idle:
+                    connection, last_used = self._idle.pop()
+                    self._in_use.add(connection)
+                    break
+                if len(self._in_use) + self._opening < self.max_size:
+                    self._opening += 1
+                    connection, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"Could not get a connection within {self.timeout}s "
+                                      f"(pool size {self.max_size})")
+                self._waiting += 1
+                try:
+                    self._lock.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+        if connection is not None and not self._is_healthy(connection, last_used):
+            with self._lock:
+                self._in_use.discard(connection)
+                self._opening += 1
+            self._discard(connection)
+            connection = None
+
+        if connection is None:
+            try:
+                connection = self._connect()
+            finally:
+                with self._lock:
+                    self._opening -= 1
+                    self._lock.notify()
+
+        with self._lock:
+            self._in_use.add(connection)
+            self._checkouts += 1
+            self._wait_time_total += time.monotonic() - started
+            self._max_in_use = max(self._max_in_use, len(self._in_use))
+        return connection
+
+    def putconn(self, connection):
+        reusable = not connection.closed
+        if reusable:
+            try:
+                if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            except psycopg2.Error:
+                reusable = False
+
+        with self._lock:
+            self._in_use.discard(connection)
+            if reusable and not self._closed:
+                self._idle.append((connection, time.monotonic()))
+                connection = None
+            self._lock.notify()
+
+        if connection is not None:
+            self._discard(connection)
+
+    def _discard(self, connection):
+        with self._lock:
+            self._broken += 1
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+    @contextmanager
+    def connection(self):
+        connection = self.getconn()
+        try:
+            yield connection
+        finally:
+            self.putconn(connection)
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_use = len(self._in_use)
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "in_use": in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "saturation": round(in_use / self.max_size, 3),
+                "max_in_use": self._max_in_use,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "broken": self._broken,
+                "avg_wait_ms": round(self._wait_time_total / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._lock.notify_all()
+        for connection, _ in idle:
+            connection.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    min_size=getattr(config, 'DB_POOL_MIN_SIZE', 1),
+                    max_size=getattr(config, 'DB_POOL_MAX_SIZE', 10),
+                    timeout=getattr(config, 'DB_POOL_TIMEOUT', 5.0),
+                    health_check_interval=getattr(config, 'DB_POOL_HEALTH_CHECK_INTERVAL', 30.0),
+                    # Все курсоры пула учитываются в метриках запроса и журнале SQL
+                    cursor_factory=InstrumentedCursor,
+                    **db_config,
+                )
+                logger.info(f"Database pool created: min={_pool.min_size}, max={_pool.max_size}")
+    return _pool
+
+
+@contextmanager
+def get_connection():
+    """Выдаёт соединение из общего пула и возвращает его по выходу из блока."""
+    with get_pool().connection() as connection:
+        yield connection
+
+
+def pool_stats() -> dict:
+    if _pool is None:
+        return {}
+    return _pool.stats()
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -0,0 +1,175 @@
+"""Учёт SQL-запросов: счётчики на HTTP-запрос и структурный журнал.
+
+Соединения пула создаются с cursor_factory=InstrumentedCursor, поэтому
+каждый cursor.execute в db/ замеряется без правок в самих модулях:
+
+* в QueryStats текущего запроса (contextvar, см. metrics.RequestMetricsMiddleware)
+  добавляются число запросов, время в БД и число строк;
+* в журнал db.query.<модуль> пишется событие: отпечаток запроса (текст без
+  литералов), хэш параметров (сами параметры не пишутся — там email и
+  пароли), длительность и rowcount. Пишется доля QUERY_LOG_SAMPLE_RATE
+  запросов на INFO, все медленные (от QUERY_LOG_SLOW_MS) на WARNING и все
+  упавшие на ERROR. Уровни по модулям — LOG_LEVELS в config, например
+  {"db.query.map": "DEBUG"}.
+
+Текст и хэши считаются только для событий, которые действительно пишутся;
+запись в файл идёт из отдельного потока (logs.setup_logging).
+
+Накладные расходы:
+
+    python -m bench.querylog_bench
+"""
+import contextvars
+import hashlib
+import logging
+import random
+import re
+import sys
+import threading
+import time
+from functools import lru_cache
+
+from psycopg2 import extensions, sql
+
+import config as config
+
+QUERY_LOG_SAMPLE_RATE = getattr(config, 'QUERY_LOG_SAMPLE_RATE', 0.01)
+QUERY_LOG_SLOW_MS = getattr(config, 'QUERY_LOG_SLOW_MS', 200.0)
+QUERY_LOG_MAX_STATEMENT = 1000
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACES = re.compile(r"\s+")
+
+_loggers = {}
+_current = contextvars.ContextVar("query_stats", default=None)
+
+
+class QueryStats:
+    """Счётчики запросов одного HTTP-запроса.
+
+    Запросы одного HTTP-запроса могут выполняться параллельно в разных
+    потоках пула БД, поэтому обновление под блокировкой.
+    """
+
+    __slots__ = ("queries", "duration", "rows", "errors", "_lock")
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+        self.rows = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def add(self, duration: float, rows: int, failed: bool = False):
+        with self._lock:
+            self.queries += 1
+            self.duration += duration
+            self.rows += rows
+            if failed:
+                self.errors += 1
+
+
+def start_query_stats():
+    """Начинает учёт для текущего контекста; (stats, token для stop_query_stats)"""
+    stats = QueryStats()
+    return stats, _current.set(stats)
+
+
+def stop_query_stats(token):
+    _current.reset(token)
+
+
+def current_query_stats():
+    return _current.get()
+
+
+@lru_cache(maxsize=2048)
+def normalize_statement(statement: str) -> str:
+    return _SPACES.sub(" ", _LITERALS.sub("?", statement)).strip()
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement: str) -> str:
+    """Отпечаток запроса: одинаков для запросов, отличающихся только литералами"""
+    return hashlib.sha1(normalize_statement(statement).lower().encode("utf-8")).hexdigest()[:16]
+
+
+def params_hash(params) -> str:
+    return hashlib.sha1(repr(params).encode("utf-8")).hexdigest()[:12]
+
+
+def _query_logger(module: str) -> logging.Logger:
+    query_logger = _loggers.get(module)
+    if query_logger is None:
+        query_logger = _loggers[module] = logging.getLogger(f"db.query.{module.rsplit('.', 1)[-1]}")
+    return query_logger
+
+
+def _statement_text(cursor, query) -> str:
+    if isinstance(query, bytes):
+        return query.decode("utf-8", "replace")
+    if isinstance(query, sql.Composable):
+        return query.as_string(cursor)
+    return str(query)
+
+
+def record_query(cursor, query, params, duration: float, error: BaseException = None, depth: int = 2):
+    """Учитывает выполненный запрос; depth — сколько кадров до кода, вызвавшего execute"""
+    rows = cursor.rowcount if cursor.rowcount > 0 else 0
+    stats = _current.get()
+    if stats is not None:
+        stats.add(duration, rows, error is not None)
+
+    duration_ms = duration * 1000
+    if error is not None:
+        level = logging.ERROR
+    elif duration_ms >= QUERY_LOG_SLOW_MS:
+        level = logging.WARNING
+    elif QUERY_LOG_SAMPLE_RATE and random.random() < QUERY_LOG_SAMPLE_RATE:
+        level = logging.INFO
+    else:
+        return
+
+    module = sys._getframe(depth).f_globals.get("__name__", "?")
+    query_logger = _query_logger(module)
+    if not query_logger.isEnabledFor(level):
+        return
+
+    statement = _statement_text(cursor, query)
+    query_fingerprint = fingerprint(statement)
+    event = {
+        "event": "sql",
+        "module": module,
+        "fingerprint": query_fingerprint,
+        "statement": normalize_statement(statement)[:QUERY_LOG_MAX_STATEMENT],
+        "params_hash": params_hash(params) if params is not None else None,
+        "duration_ms": round(duration_ms, 3),
+        "rows": cursor.rowcount,
+        "slow": duration_ms >= QUERY_LOG_SLOW_MS,
+    }
+    if error is not None:
+        event["error"] = type(error).__name__
+    query_logger.log(level, "sql %s %.1fms rows=%s", query_fingerprint, duration_ms, cursor.rowcount,
+                     extra={"event": event})
+
+
+class InstrumentedCursor(extensions.cursor):
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        except BaseException as e:
+            record_query(self, query, vars, time.perf_counter() - started, e)
+            raise
+        record_query(self, query, vars, time.perf_counter() - started)
+        return result
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            result = super().executemany(query, vars_list)
+        except BaseException as e:
+            record_query(self, query, None, time.perf_counter() - started, e)
+            raise
+        record_query(self, query, None, time.perf_counter() - started)
+        return result
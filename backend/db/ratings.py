@@ -0,0 +1,193 @@
+"""Журнал начислений рейтинга пользователей.
+
+Каждое изменение users.rating — строка rating_events (пользователь,
+дельта, причина, id связанной сущности), а сам рейтинг меняется атомарно
+(rating = rating + delta) в том же SQL-выражении, что и запись в журнал.
+Параллельные лайки и отзывы не теряют начислений, и на изменение уходит
+одно обращение к базе вместо SELECT и UPDATE.
+
+Инвариант: users.rating равен сумме delta по пользователю. Старые события
+сворачиваются в одно событие 'compacted' на пользователя:
+
+    python -m db.ratings              # свернуть события старше RATING_COMPACT_AFTER
+    python -m db.ratings --check      # найти расхождения с users.rating
+    python -m db.ratings --reconcile  # записать расхождения событиями 'reconcile'
+"""
+import json
+import logging
+import sys
+from typing import Optional
+
+import psycopg2
+
+import config as config
+from db.executor import run_in_db_thread
+from db.pool import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Возраст событий (секунды), после которого они сворачиваются в итог
+RATING_COMPACT_AFTER = getattr(config, 'RATING_COMPACT_AFTER', 30 * 24 * 3600)
+
+# Причины начислений
+SIGNUP = "signup"
+PLACE_ADDED = "place_added"
+PLACE_UPDATED = "place_updated"
+REVIEW_APPROVED = "review_approved"
+REVIEW_LIKED = "review_liked"
+FOLLOW = "follow"
+PROFILE_COMPLETED = "profile_completed"
+PROFILE_EDIT = "profile_edit"
+ADMIN_ADJUSTMENT = "admin_adjustment"
+ADMIN_REVIEW_DELETED = "admin_review_deleted"
+COMPACTED = "compacted"
+RECONCILE = "reconcile"
+
+AWARD_SQL = """
+    WITH event AS (
+        INSERT INTO rating_events (user_id, delta, reason, ref_id)
+        SELECT id, %(delta)s, %(reason)s, %(ref_id)s FROM users WHERE id = %(user_id)s
+        RETURNING user_id, delta
+    )
+    UPDATE users u SET rating = COALESCE(u.rating, 0) + event.delta
+    FROM event WHERE u.id = event.user_id
+    RETURNING u.rating, u.isbanned
+"""
+
+# Несколько начислений одним выражением. Строки users блокируются по
+# возрастанию id, поэтому параллельные пачки не встают во взаимную блокировку
+AWARD_MANY_SQL = """
+    WITH event AS (
+        INSERT INTO rating_events (user_id, delta, reason, ref_id)
+        SELECT e.user_id, e.delta, e.reason, e.ref_id
+        FROM unnest(%(user_ids)s::int[], %(deltas)s::int[], %(reasons)s::varchar[], %(ref_ids)s::int[])
+            AS e(user_id, delta, reason, ref_id)
+        WHERE EXISTS (SELECT 1 FROM users WHERE id = e.user_id)
+        RETURNING user_id, delta
+    ), totals AS (
+        SELECT user_id, sum(delta) AS delta FROM event GROUP BY user_id
+    ), locked AS (
+        SELECT id FROM users WHERE id IN (SELECT user_id FROM totals) ORDER BY id FOR UPDATE
+    )
+    UPDATE users u SET rating = COALESCE(u.rating, 0) + totals.delta
+    FROM totals JOIN locked ON locked.id = totals.user_id
+    WHERE u.id = totals.user_id
+    RETURNING u.id, u.rating, u.isbanned
+"""
+
+SET_RATING_SQL = """
+    WITH current AS (
+        SELECT id, COALESCE(rating, 0) AS rating FROM users WHERE id = %(user_id)s FOR UPDATE
+    ), event AS (
+        INSERT INTO rating_events (user_id, delta, reason)
+        SELECT id, %(rating)s - rating, %(reason)s FROM current WHERE rating <> %(rating)s
+    )
+    UPDATE users u SET rating = %(rating)s
+    FROM current WHERE u.id = current.id
+    RETURNING u.rating, u.isbanned
+"""
+
+# Сворачиваются только пользователи, у которых появились новые старые
+# события, иначе каждый проход переписывал бы их прежний итог
+COMPACT_SQL = """
+    WITH folded AS (
+        DELETE FROM rating_events
+        WHERE created_at < now() - make_interval(secs => %(older_than)s)
+            AND user_id IN (
+                SELECT user_id FROM rating_events
+                WHERE reason <> 'compacted' AND created_at < now() - make_interval(secs => %(older_than)s)
+            )
+        RETURNING user_id, delta, created_at
+    ), totals AS (
+        SELECT user_id, sum(delta) AS delta, max(created_at) AS created_at, count(*) AS events
+        FROM folded GROUP BY user_id
+    ), inserted AS (
+        INSERT INTO rating_events (user_id, delta, reason, created_at)
+        SELECT user_id, delta, 'compacted', created_at FROM totals
+    )
+    SELECT count(*), COALESCE(sum(events), 0) FROM totals
+"""
+
+# Пользователи, у которых users.rating не равен сумме журнала
+DRIFT_SQL = """
+    SELECT u.id, COALESCE(u.rating, 0), COALESCE(e.total, 0)
+    FROM users u
+    LEFT JOIN (SELECT user_id, sum(delta) AS total FROM rating_events GROUP BY user_id) e ON e.user_id = u.id
+    WHERE COALESCE(u.rating, 0) <> COALESCE(e.total, 0)
+    ORDER BY u.id
+"""
+
+
+def award(cursor, user_id: int, delta: int, reason: str, ref_id: Optional[int] = None):
+    """Начисление в текущей транзакции: (новый рейтинг, isbanned) или None, если пользователя нет"""
+    cursor.execute(AWARD_SQL, {"user_id": user_id, "delta": delta, "reason": reason, "ref_id": ref_id})
+    return cursor.fetchone()
+
+
+def award_many(cursor, events: list) -> dict:
+    """Пачка начислений [(user_id, delta, reason, ref_id), ...]: {user_id: (рейтинг, isbanned)}"""
+    if not events:
+        return {}
+    user_ids, deltas, reasons, ref_ids = (list(column) for column in zip(*events))
+    cursor.execute(AWARD_MANY_SQL, {"user_ids": user_ids, "deltas": deltas, "reasons": reasons, "ref_ids": ref_ids})
+    return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+
+def set_rating(cursor, user_id: int, rating: int, reason: str):
+    """Устанавливает рейтинг, записывая разницу в журнал: (рейтинг, isbanned) или None"""
+    cursor.execute(SET_RATING_SQL, {"user_id": user_id, "rating": rating, "reason": reason})
+    return cursor.fetchone()
+
+
+@run_in_db_thread
+def compact_rating_events(older_than: float = RATING_COMPACT_AFTER) -> dict:
+    """Сворачивает события старше older_than секунд в одно событие на пользователя"""
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            # Незакоммиченные события параллельных транзакций DELETE не видит, они свернутся в следующий раз
+            cursor.execute(COMPACT_SQL, {"older_than": older_than})
+            users, events = cursor.fetchone()
+            connection.commit()
+            return {"users": users, "events_folded": int(events)}
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+@run_in_db_thread
+def reconcile_ratings(fix: bool = False) -> dict:
+    """Сверяет users.rating с журналом; с fix=True дописывает разницу событиями 'reconcile'"""
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            cursor.execute(DRIFT_SQL)
+            drifted = cursor.fetchall()
+            if fix and drifted:
+                cursor.executemany(
+                    "INSERT INTO rating_events (user_id, delta, reason) VALUES (%s, %s, %s)",
+                    [(user_id, rating - total, RECONCILE) for user_id, rating, total in drifted])
+            connection.commit()
+            if drifted:
+                logger.warning(f"Rating ledger drift: {len(drifted)} users")
+            return {"fixed": fix, "users_drifted": len(drifted), "user_ids": [row[0] for row in drifted[:100]]}
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+if __name__ == "__main__":
+    if "--check" in sys.argv or "--reconcile" in sys.argv:
+        print(json.dumps(reconcile_ratings.sync(fix="--reconcile" in sys.argv), indent=2))
+    else:
+        print(json.dumps(compact_rating_events.sync(), indent=2))
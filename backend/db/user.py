@@ -5,622 +5,482 @@ from typing import Optional
 import psycopg2
 from psycopg2 import sql
 
-from db.migration import db_connection
+from db.aggregates import apply_review_removed, apply_rank_delta
+from db.executor import run_in_db_thread
+from db.feed import backfill_follow, remove_review_from_feeds
+from db.leaderboard import update_leaderboard, read_leaderboard_user
+from db.map import invalidate_place_cache
+from db.moderation import MODERATION_CLAIM_TTL
+from db.pagination import paginate
+from db.ratings import award, set_rating, SIGNUP, PROFILE_COMPLETED, PROFILE_EDIT, REVIEW_LIKED, FOLLOW
+from db.pool import get_connection
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("app.log"),
-        logging.StreamHandler()
-    ]
-)
 
 
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
 
-async def create_user(name: str, email: str, password: str) -> int:
-    connection = db_connection()
-    cursor = connection.cursor()
+@run_in_db_thread
+def create_user(name: str, email: str, password: str) -> int:
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            check_query = sql.SQL("SELECT id FROM users WHERE email = %s")
+            cursor.execute(check_query, (email,))
+            if cursor.fetchone():
+                return None
+
+            hashed_password = hash_password(password)
+
+            # Стартовый рейтинг (DEFAULT столбца) сразу попадает в журнал начислений
+            query = sql.SQL("""
+                WITH new_user AS (
+                    INSERT INTO users (name, email, password)
+                    VALUES (%s, %s, %s)
+                    RETURNING id, rating
+                ), event AS (
+                    INSERT INTO rating_events (user_id, delta, reason)
+                    SELECT id, rating, %s FROM new_user WHERE COALESCE(rating, 0) <> 0
+                )
+                SELECT id, rating FROM new_user;
+            """)
+            cursor.execute(query, (name, email, hashed_password, SIGNUP))
 
-    try:
-        check_query = sql.SQL("SELECT id FROM users WHERE email = %s")
-        cursor.execute(check_query, (email,))
-        if cursor.fetchone():
-            return None
+            row = cursor.fetchone()
+            user_id = row[0]
+            connection.commit()
+            update_leaderboard(user_id, row[1], user_name=name)
+            return user_id
 
-        hashed_password = hash_password(password)
-
-        query = sql.SQL("""
-            INSERT INTO users (name, email, password)
-            VALUES (%s, %s, %s)
-            RETURNING id;
-        """)
-        cursor.execute(query, (name, email, hashed_password))
-
-        row = cursor.fetchone()
-        user_id = row[0]
-        connection.commit()
-        return user_id
-
-    except (Exception, psycopg2.DatabaseError) as error:
-        logger.error(error)
-        connection.rollback()
-        return None
-    finally:
-        if connection:
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            return None
+        finally:
             cursor.close()
-            connection.close()
-            logger.info('Database connection closed.')
 
 
-async def login_user(email: str, password: str) -> int:
-    connection = db_connection()
-    cursor = connection.cursor()
+@run_in_db_thread
+def login_user(email: str, password: str) -> int:
+    with get_connection() as connection:
+        cursor = connection.cursor()
 
-    try:
-        hashed_password = hash_password(password)
+        try:
+            hashed_password = hash_password(password)
 
-        query = sql.SQL("""
-            SELECT id FROM users 
-            WHERE email = %s AND password = %s
-        """)
-        cursor.execute(query, (email, hashed_password))
+            query = sql.SQL("""
+                SELECT id FROM users 
+                WHERE email = %s AND password = %s
+            """)
+            cursor.execute(query, (email, hashed_password))
 
-        row = cursor.fetchone()
-        if row:
-            return row[0]
-        return None
+            row = cursor.fetchone()
+            if row:
+                return row[0]
+            return None
 
-    except (Exception, psycopg2.DatabaseError) as error:
-        logger.error(error)
-        return None
-    finally:
-        if connection:
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            return None
+        finally:
             cursor.close()
-            connection.close()
-            logger.info('Database connection closed.')
 
 
-async def add_review(message: str, user_id: int, place_id: int, rating: int, photo_urls: list = None) -> bool:
-    connection = db_connection()
-    cursor = connection.cursor()
+@run_in_db_thread
+def add_review(message: str, user_id: int, place_id: int, rating: int, photo_urls: list = None) -> Optional[int]:
+    """Сохраняет отзыв в статусе 'pending' и возвращает его id.
 
-    try:
-        check_user = sql.SQL("SELECT id, rating FROM users WHERE id = %s")
-        cursor.execute(check_user, (user_id,))
-        row = cursor.fetchone()
-        if not row:
-            return False
-        else:
-            add_rating_cnt = 5
-            if photo_urls and len(photo_urls) > 0:
-                add_rating_cnt += 10
-            add_rating = """UPDATE users 
-                                SET rating = %s
-                                WHERE id = %s"""
-            cursor.execute(add_rating, (row[1] + add_rating_cnt, user_id))
-
-        check_place = sql.SQL("SELECT id FROM places WHERE id = %s")
-        cursor.execute(check_place, (place_id,))
-        if not cursor.fetchone():
-            return False
+    Рейтинг автора и агрегаты места начисляются при одобрении модерацией
+    (db.moderation.apply_moderation_verdicts).
+    """
+    with get_connection() as connection:
+        cursor = connection.cursor()
 
-        if not message or not message.strip():
-            return False
+        try:
+            check_user = sql.SQL("SELECT id FROM users WHERE id = %s")
+            cursor.execute(check_user, (user_id,))
+            if not cursor.fetchone():
+                return None
 
-        if rating < 1 or rating > 5:
-            return False
+            check_place = sql.SQL("SELECT id FROM places WHERE id = %s")
+            cursor.execute(check_place, (place_id,))
+            if not cursor.fetchone():
+                return None
 
-        query = sql.SQL("""
-            INSERT INTO reviews (idUser, idPlace, text, rating)
-            VALUES (%s, %s, %s, %s)
-            RETURNING id
-        """)
-        cursor.execute(query, (user_id, place_id, message.strip(), rating))
+            if not message or not message.strip():
+                return None
 
-        review_id = cursor.fetchone()[0]
+            if rating < 1 or rating > 5:
+                return None
 
-        if photo_urls:
-            photo_query = sql.SQL("""
-                INSERT INTO reviews_photo (review_id, url)
-                VALUES (%s, %s)
+            query = sql.SQL("""
+                INSERT INTO reviews (idUser, idPlace, text, rating, status, moderation_claimed_until)
+                VALUES (%s, %s, %s, %s, 'pending', now() + make_interval(secs => %s))
+                RETURNING id
             """)
-            for photo_url in photo_urls:
-                cursor.execute(photo_query, (review_id, photo_url))
-
-        connection.commit()
-        return True
-
-    except (Exception, psycopg2.DatabaseError) as error:
-        logger.error(error)
-        connection.rollback()
-        return False
-    finally:
-        if connection:
-            cursor.close()
-            connection.close()
-            logger.info('Database connection closed.')
-
-
-async def get_all_users(limit: Optional[int] = None, offset: Optional[int] = None, page: Optional[int] = None) -> list:
-    connection = db_connection()
-    cursor = connection.cursor()
-
-    try:
-        base_query = """
-            SELECT id, name, email, phone, rating
-            FROM users
-            ORDER BY id
-        """
-
-        if limit is not None:
-            if offset is not None and page is not None:
-                calculated_offset = offset * (page - 1)
-                base_query += f" LIMIT {limit} OFFSET {calculated_offset}"
-            elif offset is not None:
-                base_query += f" LIMIT {limit} OFFSET {offset}"
-            else:
-                base_query += f" LIMIT {limit}"
-
-        cursor.execute(base_query)
-
-        rows = cursor.fetchall()
-        users = []
-        for row in rows:
-            user_id = row[0]
-            query_photo = sql.SQL("""
-                SELECT url FROM users_photos WHERE user_id = %s LIMIT 1
-            """)
-            cursor.execute(query_photo, (user_id,))
-            photo_row = cursor.fetchone()
-            photo = photo_row[0] if photo_row else None
-
-            user = {
-                "user_id": user_id,
-                "name": row[1],
-                "email": row[2],
-                "phone": row[3],
-                "rating": row[4],
-                "photo": photo
-            }
-            users.append(user)
-        return users
-
-    except (Exception, psycopg2.DatabaseError) as error:
-        logger.error(error)
-        return []
-    finally:
-        if connection:
-            cursor.close()
-            connection.close()
-            logger.info('Database connection closed.')
-
-
-async def get_user_by_id(user_id: int) -> dict:
-    connection = db_connection()
-    cursor = connection.cursor()
-
-    try:
-        query = sql.SQL("""
-            SELECT id, name, email, phone, rating
-            FROM users
-            WHERE id = %s
-        """)
-        cursor.execute(query, (user_id,))
-
-        row = cursor.fetchone()
-        if row:
-            query_photo = sql.SQL("""
-                SELECT url FROM users_photos WHERE user_id = %s LIMIT 1
-            """)
-            cursor.execute(query_photo, (user_id,))
-            photo_row = cursor.fetchone()
-            photo = photo_row[0] if photo_row else None
-
-            user = {
-                "user_id": row[0],
-                "name": row[1],
-                "email": row[2],
-                "phone": row[3],
-                "rating": row[4],
-                "photo": photo
-            }
-            return user
-        return None
-
-    except (Exception, psycopg2.DatabaseError) as error:
-        logger.error(error)
-        return None
-    finally:
-        if connection:
-            cursor.close()
-            connection.close()
-            logger.info('Database connection closed.')
+            # Отзыв сразу уходит в очередь этой реплики: захват не даёт другим взять его повторно
+            cursor.execute(query, (user_id, place_id, message.strip(), rating, MODERATION_CLAIM_TTL))
 
+            review_id = cursor.fetchone()[0]
 
-async def delete_review(user_id: int, review_id: int) -> str:
-    connection = db_connection()
-    cursor = connection.cursor()
+            if photo_urls:
+                photo_query = sql.SQL("""
+                    INSERT INTO reviews_photo (review_id, url)
+                    VALUES (%s, %s)
+                """)
+                for photo_url in photo_urls:
+                    cursor.execute(photo_query, (review_id, photo_url))
 
-    try:
-        check_query = sql.SQL("""
-            SELECT idUser FROM reviews WHERE id = %s
-        """)
-        cursor.execute(check_query, (review_id,))
+            connection.commit()
+            return review_id
 
-        row = cursor.fetchone()
-        if not row:
-            return 'error'
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            return None
+        finally:
+            cursor.close()
 
-        if row[0] != user_id:
-            return 'not_author'
 
-        delete_query = sql.SQL("""
-            DELETE FROM reviews WHERE id = %s
-        """)
-        cursor.execute(delete_query, (review_id,))
+@run_in_db_thread
+def get_all_users(limit: Optional[int] = None, offset: Optional[int] = None, page: Optional[int] = None,
+                  after: Optional[int] = None) -> list:
+    with get_connection() as connection:
+        cursor = connection.cursor()
 
-        connection.commit()
-        return 'ok'
+        try:
+            base_query = """
+                SELECT id, name, email, phone, rating
+                FROM users
+            """
 
-    except (Exception, psycopg2.DatabaseError) as error:
-        logger.error(error)
-        connection.rollback()
-        return 'error'
-    finally:
-        if connection:
-            cursor.close()
-            connection.close()
-            logger.info('Database connection closed.')
+            condition, params, suffix, suffix_params = paginate("id", limit, offset, page, after)
+            if condition:
+                base_query += " WHERE " + condition
+            base_query += suffix
 
+            cursor.execute(base_query, tuple(params + suffix_params))
 
-async def update_user(user_id: int, user_data: dict) -> bool:
-    connection = db_connection()
-    cursor = connection.cursor()
+            rows = cursor.fetchall()
+            users = []
+            for row in rows:
+                user_id = row[0]
+                query_photo = sql.SQL("""
+                    SELECT url FROM users_photos WHERE user_id = %s LIMIT 1
+                """)
+                cursor.execute(query_photo, (user_id,))
+                photo_row = cursor.fetchone()
+                photo = photo_row[0] if photo_row else None
+
+                user = {
+                    "user_id": user_id,
+                    "name": row[1],
+                    "email": row[2],
+                    "phone": row[3],
+                    "rating": row[4],
+                    "photo": photo
+                }
+                users.append(user)
+            return users
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            return []
+        finally:
+            cursor.close()
 
-    try:
-        check_query = sql.SQL("SELECT id FROM users WHERE id = %s")
-        cursor.execute(check_query, (user_id,))
-        if not cursor.fetchone():
-            return False
 
-        check = ("""SELECT u.name, u.email, u.password, up.url, u.phone from users as u 
-                         left join users_photos as up on up.user_id = u.id
-                         WHERE u.id = %s""")
-        cursor.execute(check, (user_id,))
-        row = cursor.fetchone()
-        cnt = [elem for elem in row].count(None)
+@run_in_db_thread
+def get_user_by_id(user_id: int) -> dict:
+    with get_connection() as connection:
+        cursor = connection.cursor()
 
-        update_fields = []
-        update_values = []
+        try:
+            query = sql.SQL("""
+                SELECT id, name, email, phone, rating
+                FROM users
+                WHERE id = %s
+            """)
+            cursor.execute(query, (user_id,))
 
-        if 'name' in user_data and user_data['name'] is not None:
-            update_fields.append("name = %s")
-            update_values.append(user_data['name'])
+            row = cursor.fetchone()
+            if row:
+                query_photo = sql.SQL("""
+                    SELECT url FROM users_photos WHERE user_id = %s LIMIT 1
+                """)
+                cursor.execute(query_photo, (user_id,))
+                photo_row = cursor.fetchone()
+                photo = photo_row[0] if photo_row else None
+
+                user = {
+                    "user_id": row[0],
+                    "name": row[1],
+                    "email": row[2],
+                    "phone": row[3],
+                    "rating": row[4],
+                    "photo": photo
+                }
+                return user
+            return None
 
-        if 'email' in user_data and user_data['email'] is not None:
-            update_fields.append("email = %s")
-            update_values.append(user_data['email'])
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            return None
+        finally:
+            cursor.close()
 
-        if 'password' in user_data and user_data['password'] is not None:
-            hashed_password = hash_password(user_data['password'])
-            update_fields.append("password = %s")
-            update_values.append(hashed_password)
 
-        if 'rating' in user_data and user_data['rating'] is not None:
-            update_fields.append("rating = %s")
-            update_values.append(user_data['rating'])
+@run_in_db_thread
+def delete_review(user_id: int, review_id: int) -> str:
+    with get_connection() as connection:
+        cursor = connection.cursor()
 
-        if 'phone' in user_data and user_data['phone'] is not None:
-            update_fields.append("phone = %s")
-            update_values.append(user_data['phone'])
+        try:
+            check_query = sql.SQL("""
+                SELECT idUser, idPlace FROM reviews WHERE id = %s
+            """)
+            cursor.execute(check_query, (review_id,))
 
-        if update_fields:
-            update_query = "UPDATE users SET " + ", ".join(update_fields) + " WHERE id = %s"
-            update_values.append(user_id)
-            cursor.execute(update_query, tuple(update_values))
+            row = cursor.fetchone()
+            if not row:
+                return 'error'
 
-        if 'photo' in user_data and user_data['photo'] is not None:
-            query_delete_photos = sql.SQL("DELETE FROM users_photos WHERE user_id = %s")
-            cursor.execute(query_delete_photos, (user_id,))
+            if row[0] != user_id:
+                return 'not_author'
 
-            query_photo = sql.SQL("""
-                INSERT INTO users_photos (user_id, url) VALUES (%s, %s)
+            # Строки фото снимают ссылки с photo_objects, осиротевшие объекты удалит сборщик
+            cursor.execute("DELETE FROM reviews_photo WHERE review_id = %s", (review_id,))
+            remove_review_from_feeds(cursor, review_id)
+            delete_query = sql.SQL("""
+                DELETE FROM reviews WHERE id = %s RETURNING idPlace, rating, status
             """)
-            cursor.execute(query_photo, (user_id, user_data['photo']))
-
-        check = ("""SELECT u.rating, u.name, u.email, u.password, up.url, u.phone from users as u 
-                 left join users_photos as up on up.user_id = u.id
-                 WHERE u.id = %s""")
-        cursor.execute(check, (user_id, ))
-        row = cursor.fetchone()
-        cnt_2 = [elem for elem in row].count(None)
-        if cnt_2 == 0 and cnt != 0:
-            add_rating = """UPDATE users 
-                                    SET rating = %s
-                                    WHERE id = %s"""
-            cursor.execute(add_rating, (row[0] + 15, user_id))
-
-        connection.commit()
-        return True
-
-    except (Exception, psycopg2.DatabaseError) as error:
-        logger.error(f"Ошибка при обновлении пользователя: {error}")
-        connection.rollback()
-        return False
-    finally:
-        if connection:
+            cursor.execute(delete_query, (review_id,))
+            deleted = cursor.fetchone()
+            if deleted and deleted[2] == 'approved':
+                apply_review_removed(cursor, deleted[0], deleted[1])
+
+            connection.commit()
+            invalidate_place_cache(row[1])
+            return 'ok'
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            return 'error'
+        finally:
             cursor.close()
-            connection.close()
-            logger.info('Database connection closed.')
-
 
-async def set_review_rank(user_id: int, review_id: int, like: bool = None, dislike: bool = None) -> bool:
-    connection = db_connection()
-    cursor = connection.cursor()
 
-    try:
-        if like is None and dislike is None:
-            return False
+@run_in_db_thread
+def update_user(user_id: int, user_data: dict) -> bool:
+    with get_connection() as connection:
+        cursor = connection.cursor()
 
-        if like is True and dislike is True:
-            return False
+        try:
+            check_query = sql.SQL("SELECT id FROM users WHERE id = %s")
+            cursor.execute(check_query, (user_id,))
+            if not cursor.fetchone():
+                return False
 
-        check_review = sql.SQL("SELECT id FROM reviews WHERE id = %s")
-        cursor.execute(check_review, (review_id,))
-        if not cursor.fetchone():
-            return False
+            check = ("""SELECT u.name, u.email, u.password, up.url, u.phone from users as u 
+                             left join users_photos as up on up.user_id = u.id
+                             WHERE u.id = %s""")
+            cursor.execute(check, (user_id,))
+            row = cursor.fetchone()
+            cnt = [elem for elem in row].count(None)
 
-        check_user = sql.SQL("SELECT id, rating FROM users WHERE id = %s")
-        cursor.execute(check_user, (user_id,))
-        row = cursor.fetchone()
-        if not row:
-            return False
+            update_fields = []
+            update_values = []
 
-        check_existing = sql.SQL("""
-            SELECT id, "like", dislike FROM reviews_ranks 
-            WHERE review_id = %s AND user_id = %s
-        """)
-        cursor.execute(check_existing, (review_id, user_id))
-        existing = cursor.fetchone()
-
-        if like is True:
-            if existing:
-                existing_id, existing_like, existing_dislike = existing
-                if existing_like:
-                    delete_query = sql.SQL("DELETE FROM reviews_ranks WHERE id = %s")
-                    cursor.execute(delete_query, (existing_id,))
-                elif existing_dislike:
-                    update_query = sql.SQL("""
-                        UPDATE reviews_ranks 
-                        SET "like" = true, dislike = false 
-                        WHERE id = %s
-                    """)
-                    cursor.execute(update_query, (existing_id,))
-                    add_rating = """UPDATE users 
-                                        SET rating = %s
-                                        WHERE id = %s"""
-                    cursor.execute(add_rating, (row[1] + 1, user_id))
-                else:
-                    add_rating = """UPDATE users 
-                                        SET rating = %s
-                                        WHERE id = %s"""
-                    cursor.execute(add_rating, (row[1] + 1, user_id))
-            else:
-                insert_query = sql.SQL("""
-                    INSERT INTO reviews_ranks (review_id, user_id, "like", dislike)
-                    VALUES (%s, %s, true, false)
-                """)
-                cursor.execute(insert_query, (review_id, user_id))
-
-        elif dislike is True:
-            if existing:
-                existing_id, existing_like, existing_dislike = existing
-                if existing_dislike:
-                    delete_query = sql.SQL("DELETE FROM reviews_ranks WHERE id = %s")
-                    cursor.execute(delete_query, (existing_id,))
-                elif existing_like:
-                    update_query = sql.SQL("""
-                        UPDATE reviews_ranks 
-                        SET "like" = false, dislike = true 
-                        WHERE id = %s
-                    """)
-                    cursor.execute(update_query, (existing_id,))
-            else:
-                insert_query = sql.SQL("""
-                    INSERT INTO reviews_ranks (review_id, user_id, "like", dislike)
-                    VALUES (%s, %s, false, true)
-                """)
-                cursor.execute(insert_query, (review_id, user_id))
+            if 'name' in user_data and user_data['name'] is not None:
+                update_fields.append("name = %s")
+                update_values.append(user_data['name'])
 
-        connection.commit()
-        return True
+            if 'email' in user_data and user_data['email'] is not None:
+                update_fields.append("email = %s")
+                update_values.append(user_data['email'])
 
-    except (Exception, psycopg2.DatabaseError) as error:
-        logger.error(error)
-        connection.rollback()
-        return False
-    finally:
-        if connection:
-            cursor.close()
-            connection.close()
-            logger.info('Database connection closed.')
+            if 'password' in user_data and user_data['password'] is not None:
+                hashed_password = hash_password(user_data['password'])
+                update_fields.append("password = %s")
+                update_values.append(hashed_password)
 
+            if 'phone' in user_data and user_data['phone'] is not None:
+                update_fields.append("phone = %s")
+                update_values.append(user_data['phone'])
 
-async def add_follow(user_id: int, follow_id: int) -> bool:
-    connection = db_connection()
-    cursor = connection.cursor()
+            if update_fields:
+                update_query = "UPDATE users SET " + ", ".join(update_fields) + " WHERE id = %s"
+                update_values.append(user_id)
+                cursor.execute(update_query, tuple(update_values))
 
-    try:
-        check_user = sql.SQL("SELECT id, rating FROM users WHERE id = %s")
-        cursor.execute(check_user, (user_id,))
-        row = cursor.fetchone()
-        if not row:
-            return False
-        else:
-            add_rating = """UPDATE users 
-                        SET rating = %s
-                        WHERE id = %s"""
-            cursor.execute(add_rating, (row[1] + 1, user_id))
-        cursor.execute(check_user, (follow_id,))
-        if not cursor.fetchone():
-            return False
+            if 'rating' in user_data and user_data['rating'] is not None:
+                set_rating(cursor, user_id, user_data['rating'], PROFILE_EDIT)
 
-        if user_id == follow_id:
-            return False
+            if 'photo' in user_data and user_data['photo'] is not None:
+                query_delete_photos = sql.SQL("DELETE FROM users_photos WHERE user_id = %s")
+                cursor.execute(query_delete_photos, (user_id,))
 
-        check_follow = sql.SQL("""
-            SELECT user_id FROM follow WHERE user_id = %s AND follow_id = %s
-        """)
-        cursor.execute(check_follow, (user_id, follow_id,))
-        if cursor.fetchone():
+                query_photo = sql.SQL("""
+                    INSERT INTO users_photos (user_id, url) VALUES (%s, %s)
+                """)
+                cursor.execute(query_photo, (user_id, user_data['photo']))
+
+            check = ("""SELECT u.rating, u.name, u.email, u.password, up.url, u.phone from users as u 
+                     left join users_photos as up on up.user_id = u.id
+                     WHERE u.id = %s""")
+            cursor.execute(check, (user_id, ))
+            row = cursor.fetchone()
+            cnt_2 = [elem for elem in row].count(None)
+            if cnt_2 == 0 and cnt != 0:
+                award(cursor, user_id, 15, PROFILE_COMPLETED)
+
+            ranked = read_leaderboard_user(cursor, user_id)
+            connection.commit()
+            update_leaderboard(user_id, **ranked)
             return True
 
-        query = sql.SQL("""
-            INSERT INTO follow (user_id, follow_id)
-            VALUES (%s, %s)
-        """)
-        cursor.execute(query, (user_id, follow_id,))
-
-        connection.commit()
-        return True
-
-    except (Exception, psycopg2.DatabaseError) as error:
-        logger.error(error)
-        connection.rollback()
-        return False
-    finally:
-        if connection:
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(f"Ошибка при обновлении пользователя: {error}")
+            connection.rollback()
+            return False
+        finally:
             cursor.close()
-            connection.close()
-            logger.info('Database connection closed.')
-
-
-async def get_followed_reviews(user_id: int, limit: Optional[int] = None, offset: Optional[int] = None, page: Optional[int] = None) -> list:
-    connection = db_connection()
-    cursor = connection.cursor()
-
-    try:
-        base_query = """
-            SELECT 
-                r.id,
-                r.idUser,
-                u.name,
-                r.idPlace,
-                r.text,
-                r.rating
-            FROM reviews r
-            INNER JOIN follow f ON r.idUser = f.follow_id
-            INNER JOIN users u ON r.idUser = u.id
-            WHERE f.user_id = %s
-            ORDER BY r.id
-        """
-
-        if limit is not None:
-            if offset is not None and page is not None:
-                calculated_offset = offset * (page - 1)
-                base_query += f" LIMIT {limit} OFFSET {calculated_offset}"
-            elif offset is not None:
-                base_query += f" LIMIT {limit} OFFSET {offset}"
-            else:
-                base_query += f" LIMIT {limit}"
-
-        cursor.execute(base_query, (user_id,))
-
-        rows = cursor.fetchall()
-        reviews = []
-
-        for row in rows:
-            review_id = row[0]
-
-            query_photos = sql.SQL("""
-                SELECT url FROM reviews_photo WHERE review_id = %s
-            """)
-            cursor.execute(query_photos, (review_id,))
-            rows_photos = cursor.fetchall()
-            review_photos = [row_photo[0] for row_photo in rows_photos]
-
-            query_ranks = sql.SQL("""
-                SELECT 
-                    COUNT(*) FILTER (WHERE "like" = true) as like_count,
-                    COUNT(*) FILTER (WHERE dislike = true) as dislike_count
-                FROM reviews_ranks 
-                WHERE review_id = %s
+
+
+@run_in_db_thread
+def set_review_rank(user_id: int, review_id: int, like: bool = None, dislike: bool = None) -> bool:
+    with get_connection() as connection:
+        cursor = connection.cursor()
+
+        try:
+            if like is None and dislike is None:
+                return False
+            ranked = None
+
+            if like is True and dislike is True:
+                return False
+
+            check_review = sql.SQL("SELECT id, idPlace FROM reviews WHERE id = %s AND status = 'approved'")
+            cursor.execute(check_review, (review_id,))
+            review_row = cursor.fetchone()
+            if not review_row:
+                return False
+
+            check_user = sql.SQL("SELECT id FROM users WHERE id = %s")
+            cursor.execute(check_user, (user_id,))
+            row = cursor.fetchone()
+            if not row:
+                return False
+
+            check_existing = sql.SQL("""
+                SELECT id, "like", dislike FROM reviews_ranks 
+                WHERE review_id = %s AND user_id = %s
             """)
-            cursor.execute(query_ranks, (review_id,))
-            ranks_row = cursor.fetchone()
-            like_count = ranks_row[0] if ranks_row else 0
-            dislike_count = ranks_row[1] if ranks_row else 0
-
-            review = {
-                "id": review_id,
-                "id_user": row[1],
-                "user_name": row[2],
-                "id_place": row[3],
-                "text": row[4],
-                "rating": row[5],
-                "review_photos": review_photos,
-                "like": like_count,
-                "dislike": dislike_count,
-            }
-            reviews.append(review)
-        return reviews
-    except (Exception, psycopg2.DatabaseError) as error:
-        logger.error(error)
-        return []
-    finally:
-        if connection:
+            cursor.execute(check_existing, (review_id, user_id))
+            existing = cursor.fetchone()
+
+            if like is True:
+                if existing:
+                    existing_id, existing_like, existing_dislike = existing
+                    if existing_like:
+                        delete_query = sql.SQL("DELETE FROM reviews_ranks WHERE id = %s")
+                        cursor.execute(delete_query, (existing_id,))
+                        apply_rank_delta(cursor, review_id, -1, 0)
+                    elif existing_dislike:
+                        update_query = sql.SQL("""
+                            UPDATE reviews_ranks 
+                            SET "like" = true, dislike = false 
+                            WHERE id = %s
+                        """)
+                        cursor.execute(update_query, (existing_id,))
+                        apply_rank_delta(cursor, review_id, 1, -1)
+                        ranked = award(cursor, user_id, 1, REVIEW_LIKED, review_id)
+                    else:
+                        ranked = award(cursor, user_id, 1, REVIEW_LIKED, review_id)
+                else:
+                    insert_query = sql.SQL("""
+                        INSERT INTO reviews_ranks (review_id, user_id, "like", dislike)
+                        VALUES (%s, %s, true, false)
+                    """)
+                    cursor.execute(insert_query, (review_id, user_id))
+                    apply_rank_delta(cursor, review_id, 1, 0)
+
+            elif dislike is True:
+                if existing:
+                    existing_id, existing_like, existing_dislike = existing
+                    if existing_dislike:
+                        delete_query = sql.SQL("DELETE FROM reviews_ranks WHERE id = %s")
+                        cursor.execute(delete_query, (existing_id,))
+                        apply_rank_delta(cursor, review_id, 0, -1)
+                    elif existing_like:
+                        update_query = sql.SQL("""
+                            UPDATE reviews_ranks 
+                            SET "like" = false, dislike = true 
+                            WHERE id = %s
+                        """)
+                        cursor.execute(update_query, (existing_id,))
+                        apply_rank_delta(cursor, review_id, -1, 1)
+                else:
+                    insert_query = sql.SQL("""
+                        INSERT INTO reviews_ranks (review_id, user_id, "like", dislike)
+                        VALUES (%s, %s, false, true)
+                    """)
+                    cursor.execute(insert_query, (review_id, user_id))
+                    apply_rank_delta(cursor, review_id, 0, 1)
+
+            connection.commit()
+            invalidate_place_cache(review_row[1])
+            if ranked:
+                update_leaderboard(user_id, *ranked)
+            return True
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            return False
+        finally:
             cursor.close()
-            connection.close()
-            logger.info('Database connection closed.')
 
 
-async def get_leaderboard() -> list:
-    connection = db_connection()
-    cursor = connection.cursor()
+@run_in_db_thread
+def add_follow(user_id: int, follow_id: int) -> bool:
+    with get_connection() as connection:
+        cursor = connection.cursor()
 
-    try:
-        query = sql.SQL("""
-                SELECT 
-                    id, name, rating
-                    FROM users WHERE isbanned = false
-                    order by rating;
-            """)
-        cursor.execute(query,)
+        try:
+            if user_id == follow_id:
+                return False
 
-        rows = cursor.fetchall()
-        users = []
+            check_users = sql.SQL("SELECT count(*) FROM users WHERE id IN (%s, %s)")
+            cursor.execute(check_users, (user_id, follow_id))
+            if cursor.fetchone()[0] != 2:
+                return False
 
-        for row in rows:
-            user_id = row[0]
+            # Повторная подписка (в том числе параллельная) ничего не меняет и не начисляет рейтинг
+            query = sql.SQL("""
+                INSERT INTO follow (user_id, follow_id)
+                VALUES (%s, %s)
+                ON CONFLICT DO NOTHING
+                RETURNING user_id
+            """)
+            cursor.execute(query, (user_id, follow_id,))
+            if not cursor.fetchone():
+                return True
+            cursor.execute("UPDATE users SET follower_count = follower_count + 1 WHERE id = %s", (follow_id,))
+            backfill_follow(cursor, user_id, follow_id)
+            ranked = award(cursor, user_id, 1, FOLLOW, follow_id)
+
+            connection.commit()
+            update_leaderboard(user_id, *ranked)
+            return True
 
-            query_photos = sql.SQL("""
-                    SELECT url FROM users_photos WHERE user_id = %s ORDER BY id DESC LIMIT 1
-                """)
-            cursor.execute(query_photos, (user_id,))
-            row_photo = cursor.fetchone()
-            user_photos = row_photo[0] if row_photo else None
-
-
-            user = {
-                "id": user_id,
-                "user_name": row[1],
-                "rating": row[2],
-                "user_photos": user_photos,
-            }
-            users.append(user)
-
-        return users
-
-    except (Exception, psycopg2.DatabaseError) as error:
-        logger.error(error)
-        return []
-    finally:
-        if connection:
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(error)
+            connection.rollback()
+            return False
+        finally:
             cursor.close()
-            connection.close()
-            logger.info('Database connection closed.')
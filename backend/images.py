@@ -0,0 +1,171 @@
+"""Обработка загруженных фото: варианты размеров, WebP/AVIF, без EXIF.
+
+Для объекта reviews/<uuid>.<ext> рядом кладутся reviews/<uuid>.thumb.webp,
+.medium.webp и .full.webp. Варианты не увеличивают картинку, учитывают
+ориентацию из EXIF и сохраняются без метаданных (в том числе без GPS).
+
+Оригинал с метаданными публично не хранится: после выгрузки вариантов он
+удаляется, и фото отдаётся только вариантами.
+
+Декодирование и сжатие занимают процессор на десятки и сотни миллисекунд,
+поэтому выполняются в пуле процессов: event loop и потоки БД не ждут GIL.
+Дочерний процесс сам скачивает оригинал, выгружает варианты и удаляет
+оригинал, так что байты картинки не копируются между процессами.
+"""
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from PIL import Image, ImageOps, features
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# (вариант, максимальная сторона в пикселях, качество)
+VARIANTS = (
+    ("thumb", 256, 70),
+    ("medium", 1024, 78),
+    ("full", 2048, 82),
+)
+IMAGE_FORMAT = getattr(config, 'IMAGE_FORMAT', "webp")
+IMAGE_WORKERS = getattr(config, 'IMAGE_WORKERS', 2)
+# Защита от «декомпрессионных бомб»: маленький файл, огромное полотно
+IMAGE_MAX_PIXELS = getattr(config, 'IMAGE_MAX_PIXELS', 40_000_000)
+
+RASTER_EXTENSIONS = ("png", "jpg", "jpeg", "gif", "webp", "bmp")
+_VARIANT_URL = re.compile(r"\.(?:thumb|medium|full)\.(webp|avif)$")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class ImageDecodeError(Exception):
+    pass
+
+
+def output_format() -> tuple:
+    """(формат Pillow, расширение, mime); AVIF — только если Pillow собран с ним"""
+    if IMAGE_FORMAT == "avif" and features.check("avif"):
+        return "AVIF", "avif", "image/avif"
+    return "WEBP", "webp", "image/webp"
+
+
+def variant_name(object_name: str, variant: str, extension: str) -> str:
+    base = object_name.rsplit(".", 1)[0]
+    return f"{base}.{variant}.{extension}"
+
+
+def photo_variant_names(object_name: str) -> list:
+    """Имена всех вариантов объекта в текущем формате"""
+    _, extension, _ = output_format()
+    return [variant_name(object_name, variant, extension) for variant, _, _ in VARIANTS]
+
+
+def thumbnail_url(url, variant: str = "thumb"):
+    """URL нужного варианта для URL полного варианта.
+
+    Фото, загруженные до появления вариантов, и SVG отдаются как есть.
+    """
+    if not url:
+        return url
+    return _VARIANT_URL.sub(lambda m: f".{variant}.{m.group(1)}", url)
+
+
+def render_variants(data: bytes) -> dict:
+    """{вариант: байты} в формате output_format()"""
+    Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+    try:
+        image = Image.open(BytesIO(data))
+        if image.width * image.height > IMAGE_MAX_PIXELS:
+            raise ImageDecodeError(f"Image is too large: {image.width}x{image.height}")
+        image.seek(0)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    except ImageDecodeError:
+        raise
+    except (OSError, ValueError, Image.DecompressionBombError, SyntaxError) as e:
+        raise ImageDecodeError(f"Cannot decode image: {e}") from e
+
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if has_alpha else "RGB")
+
+    pil_format, _, _ = output_format()
+    out = {}
+    for variant, size, quality in VARIANTS:
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+        options = {"quality": quality}
+        if pil_format == "WEBP":
+            options["method"] = 4
+        buffer = BytesIO()
+        # exif не передаётся — метаданные оригинала в варианты не попадают
+        resized.save(buffer, format=pil_format, **options)
+        out[variant] = buffer.getvalue()
+    return out
+
+
+def process_object(object_name: str) -> dict:
+    """Выполняется в дочернем процессе: скачивает оригинал, выгружает варианты
+    и удаляет оригинал.
+
+    Возвращает {"hash": sha256 оригинала, "size": байт, "variants": {вариант: имя объекта}};
+    для SVG вариантов нет, и SVG остаётся как загружен.
+    """
+    import s3_client
+
+    client = s3_client.get_minio_client()
+    response = client.get_object(config.MINIO_BUCKET, object_name)
+    try:
+        data = response.read()
+    finally:
+        response.close()
+        response.release_conn()
+
+    result = {"hash": hashlib.sha256(data).hexdigest(), "size": len(data), "variants": {}}
+    if not is_raster(object_name):
+        return result
+
+    _, extension, mime_type = output_format()
+    for variant, payload in render_variants(data).items():
+        name = variant_name(object_name, variant, extension)
+        client.put_object(config.MINIO_BUCKET, name, BytesIO(payload), len(payload),
+                          content_type=mime_type)
+        result["variants"][variant] = name
+    # В оригинале остаётся EXIF, в том числе GPS: после вариантов он не нужен
+    client.remove_object(config.MINIO_BUCKET, object_name)
+    return result
+
+
+def get_image_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn, а не fork: в родителе уже работают потоки пула БД и MinIO
+                _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_image_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+            _pool = None
+
+
+def is_raster(object_name: str) -> bool:
+    return object_name.rsplit(".", 1)[-1].lower() in RASTER_EXTENSIONS
+
+
+async def process_photo(object_name: str) -> dict:
+    """Строит варианты загруженного фото и считает его хэш, см. process_object"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_image_pool(), process_object, object_name)
@@ -0,0 +1,73 @@
+"""Настройка журналирования процесса.
+
+Обработчики (файл LOG_FILE и stderr) работают в отдельном потоке
+QueueListener: код, который пишет в журнал, только кладёт запись в очередь
+и не ждёт диска. События с полем event (например, db.querylog) пишутся
+одной строкой JSON, остальные — прежним текстовым форматом.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+
+import config
+
+LOG_LEVEL = getattr(config, 'LOG_LEVEL', "INFO")
+# Уровни по логгерам: {"db.query": "WARNING", "db.query.map": "INFO", "urllib3": "WARNING"}
+LOG_LEVELS = getattr(config, 'LOG_LEVELS', {})
+LOG_FILE = getattr(config, 'LOG_FILE', "app.log")
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener = None
+_lock = threading.Lock()
+
+
+class StructuredFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        event = getattr(record, "event", None)
+        if event is None:
+            return super().format(record)
+        return json.dumps({
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            **event,
+        }, ensure_ascii=False, default=str)
+
+
+def setup_logging():
+    """Подключает очередь к корневому логгеру; повторные вызовы ничего не делают"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+
+        formatter = StructuredFormatter(TEXT_FORMAT)
+        handlers = [logging.StreamHandler()]
+        if LOG_FILE:
+            handlers.append(logging.FileHandler(LOG_FILE))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        records = queue.SimpleQueue()
+        root = logging.getLogger()
+        root.handlers[:] = [logging.handlers.QueueHandler(records)]
+        root.setLevel(LOG_LEVEL)
+        for name, level in LOG_LEVELS.items():
+            logging.getLogger(name).setLevel(level)
+
+        _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Дописывает накопленные записи и останавливает поток журнала"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
@@ -20,7 +20,9 @@ async def main():
 
 
 if __name__ == '__main__':
-    db.migration.migration_up()
+    error = db.migration.migration_up()
+    if error:
+        print(f"Warning: migration failed: {error}")
     try:
         ensure_bucket_exists()
     except Exception as e:
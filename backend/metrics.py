@@ -0,0 +1,161 @@
+"""Метрики HTTP-запросов в формате Prometheus и заголовок Server-Timing.
+
+RequestMetricsMiddleware на каждый запрос включает учёт SQL (db.querylog)
+и по шаблону маршрута FastAPI («/place/{id}», а не сам URL) записывает в
+гистограммы длительность запроса, число SQL-запросов, время в БД и число
+строк. Рост числа запросов на маршрут после релиза — признак N+1.
+"""
+import bisect
+import threading
+import time
+
+from db.querylog import start_query_stats, stop_query_stats
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: tuple, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(float(b) for b in buckets)
+        self.labelnames = labelnames
+        # labels -> [счётчики по корзинам (+Inf последней), сумма, количество]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    bucket_labels = _labels(self.labelnames, labels, 'le="' + le + '"')
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+ROUTE_LABELS = ("method", "route")
+
+REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "HTTP requests by route and status", ROUTE_LABELS + ("status",)))
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency", LATENCY_BUCKETS, ROUTE_LABELS))
+DB_QUERIES = REGISTRY.register(Histogram(
+    "db_queries_per_request", "SQL statements executed per HTTP request", QUERY_COUNT_BUCKETS, ROUTE_LABELS))
+DB_DURATION = REGISTRY.register(Histogram(
+    "db_duration_seconds_per_request", "Time spent in SQL per HTTP request", LATENCY_BUCKETS, ROUTE_LABELS))
+DB_ROWS = REGISTRY.register(Histogram(
+    "db_rows_per_request", "Rows returned or affected by SQL per HTTP request", ROW_BUCKETS, ROUTE_LABELS))
+
+
+def server_timing(stats, elapsed: float) -> str:
+    return (f'db;dur={stats.duration * 1000:.2f};desc="{stats.queries} queries, {stats.rows} rows", '
+            f'app;dur={elapsed * 1000:.2f}')
+
+
+class RequestMetricsMiddleware:
+    """ASGI-middleware: Server-Timing в ответе и гистограммы по маршрутам.
+
+    Маршрут берётся из scope["route"], который FastAPI заполняет при
+    сопоставлении; запросы без маршрута (404) попадают в route="unmatched",
+    чтобы произвольные URL не раздували число рядов.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats, token = start_query_stats()
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timing = server_timing(stats, time.perf_counter() - started)
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", timing.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - started
+            stop_query_stats(token)
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            labels = (scope["method"], route)
+            REQUESTS.inc(labels + (str(status),))
+            REQUEST_DURATION.observe(labels, elapsed)
+            DB_QUERIES.observe(labels, stats.queries)
+            DB_DURATION.observe(labels, stats.duration)
+            DB_ROWS.observe(labels, stats.rows)
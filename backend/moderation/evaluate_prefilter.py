@@ -0,0 +1,132 @@
+"""Офлайн-оценка локального префильтра на размеченной выборке.
+
+Метки в выборке — ответы LLM-классификатора (1 — токсичный). Отчёт: доля
+текстов, ушедших в модель, согласие с моделью на решённых локально, доля
+токсичных текстов, одобренных без модели (false_approve_rate), доля чистых,
+отклонённых без модели (false_reject_rate), и время решения на текст.
+
+Встроенная выборка prefilter_sample.jsonl — короткий набор ручных примеров
+и известных промахов, по ней подбирались веса; для оценки качества она не
+годится. Отложенная выборка строится из настоящих отзывов базы, которых нет
+во встроенной, с метками от LLM-классификатора (нужен OPENROUTER_API_KEY):
+
+    python -m moderation.evaluate_prefilter label held_out.jsonl [--limit 2000]
+    python -m moderation.evaluate_prefilter held_out.jsonl [--verbose]
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+from moderation.prefilter import Prefilter
+
+DEFAULT_SAMPLE = os.path.join(os.path.dirname(__file__), "prefilter_sample.jsonl")
+
+
+def load_sample(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def evaluate(samples: list, prefilter: Prefilter = None, verbose: bool = False) -> dict:
+    prefilter = prefilter or Prefilter()
+    decided = agreed = escalated = 0
+    false_positives = false_negatives = 0
+    escalated_by_label = {0: 0, 1: 0}
+
+    started = time.perf_counter()
+    decisions = [prefilter.decide(sample["text"]) for sample in samples]
+    elapsed = time.perf_counter() - started
+
+    for sample, decision in zip(samples, decisions):
+        label = sample["label"]
+        if decision.verdict is None:
+            escalated += 1
+            escalated_by_label[label] += 1
+            outcome = "escalate"
+        else:
+            decided += 1
+            if decision.verdict == label:
+                agreed += 1
+                outcome = "ok"
+            elif decision.verdict == 1:
+                false_positives += 1
+                outcome = "FALSE POSITIVE"
+            else:
+                false_negatives += 1
+                outcome = "FALSE NEGATIVE"
+        if verbose:
+            print(f"{outcome:15} {decision.score:.3f} {label} {','.join(decision.reasons):30} {sample['text']}")
+
+    total = len(samples)
+    toxic = sum(1 for sample in samples if sample["label"] == 1)
+    clean = total - toxic
+    return {
+        "samples": total,
+        "toxic": toxic,
+        "decided_locally": decided,
+        "escalated": escalated,
+        "escalation_rate": round(escalated / total, 4) if total else 0.0,
+        "escalated_clean": escalated_by_label[0],
+        "escalated_toxic": escalated_by_label[1],
+        "agreement": round(agreed / decided, 4) if decided else None,
+        "false_positives": false_positives,
+        "false_negatives": false_negatives,
+        # Главная метрика безопасности: токсичные отзывы, опубликованные без модели
+        "false_approve_rate": round(false_negatives / toxic, 4) if toxic else None,
+        # Чистые отзывы, которые автор не увидит опубликованными
+        "false_reject_rate": round(false_positives / clean, 4) if clean else None,
+        "us_per_text": round(elapsed / total * 1e6, 1) if total else None,
+    }
+
+
+def label_held_out(path: str, limit: int, batch: int = 10) -> int:
+    """Случайные отзывы из базы, размеченные LLM-классификатором, в path (jsonl)"""
+    from openai import OpenAI
+
+    import config
+    from db.migration import db_connection
+    from moderation.classifier import LLMClassifier
+
+    tuning = {sample["text"] for sample in load_sample(DEFAULT_SAMPLE)}
+    connection = db_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT id, text FROM reviews
+                WHERE text IS NOT NULL AND btrim(text) <> ''
+                ORDER BY random() LIMIT %s
+            """, (limit * 2,))
+            fetched = cursor.fetchall()
+    finally:
+        connection.close()
+    # Без повторов и без текстов, на которых подбирались веса
+    rows, seen = [], set(tuning)
+    for review_id, text in fetched:
+        if text not in seen and len(rows) < limit:
+            seen.add(text)
+            rows.append((review_id, text))
+
+    client = OpenAI(base_url="https://openrouter.ai/api/v1", api_key=config.OPENROUTER_API_KEY)
+    classifier = LLMClassifier(client, max_batch=batch)
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for start in range(0, len(rows), batch):
+            texts = dict(rows[start:start + batch])
+            verdicts = asyncio.run(classifier.classify(texts))
+            for review_id, text in texts.items():
+                f.write(json.dumps({"id": review_id, "text": text, "label": verdicts[review_id]},
+                                   ensure_ascii=False) + "\n")
+                written += 1
+    return written
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    if args and args[0] == "label":
+        limit = int(sys.argv[sys.argv.index("--limit") + 1]) if "--limit" in sys.argv else 2000
+        print(f"Labelled {label_held_out(args[1], limit)} reviews into {args[1]}")
+        sys.exit(0)
+    report = evaluate(load_sample(args[0] if args else DEFAULT_SAMPLE), verbose="--verbose" in sys.argv)
+    print(json.dumps(report, indent=2))
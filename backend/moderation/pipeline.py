@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+
+from moderation.verdicts import REVIEW_KIND, text_hash
+
+logger = logging.getLogger(__name__)
+
+
+def _percentile(values, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 4)
+
+
+class ModerationPipeline:
+    """Фоновая модерация отзывов.
+
+    Отзыв сохраняется в статусе 'pending' и ставится в очередь. concurrency
+    воркеров собирают из очереди пачки до batch_size отзывов (ожидая не
+    дольше batch_wait секунд), классифицируют каждую пачку одним вызовом
+    classifier и передают решения в apply_verdicts. Неудачные вызовы
+    повторяются с экспоненциальной задержкой; если попытки кончились, отзыв
+    остаётся 'pending', release_pending снимает с него захват, и он
+    возвращается в очередь при следующем проходе load_pending (при старте и
+    раз в resweep_interval секунд). Без release_pending — когда истечёт захват.
+
+    С prefilter очевидные случаи решаются локально; с verdict_cache тексты,
+    решение по которым уже известно, и повторы внутри пачки в модель не
+    отправляются.
+    """
+
+    def __init__(self, classifier, apply_verdicts, load_pending=None, release_pending=None,
+                 batch_size: int = None,
+                 batch_wait: float = 0.5, concurrency: int = 2, max_retries: int = 3,
+                 retry_backoff: float = 1.0, max_backoff: float = 30.0,
+                 resweep_interval: float = 300.0, max_queue: int = 10000, verdict_cache=None,
+                 prefilter=None):
+        self.classifier = classifier
+        self.apply_verdicts = apply_verdicts
+        self.load_pending = load_pending
+        self.release_pending = release_pending
+        self.batch_size = max(1, batch_size or classifier.max_batch)
+        self.batch_wait = batch_wait
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self.resweep_interval = resweep_interval
+        self.max_queue = max_queue
+        self.verdict_cache = verdict_cache
+        self.prefilter = prefilter
+
+        self._queue = None
+        self._queued = set()
+        self._tasks = []
+        self._in_flight = 0
+
+        self.submitted = 0
+        self.dropped = 0
+        self.batches = 0
+        self.model_calls = 0
+        self.cache_hits = 0
+        self.prefiltered = 0
+        self.classified = 0
+        self.approved = 0
+        self.rejected = 0
+        self.failed = 0
+        self.retries = 0
+        self._classify_latency = deque(maxlen=1000)
+        self._end_to_end_latency = deque(maxlen=1000)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [asyncio.create_task(self._worker(), name=f"moderation-{i}")
+                       for i in range(self.concurrency)]
+        if self.load_pending is not None:
+            self._tasks.append(asyncio.create_task(self._resweep(), name="moderation-resweep"))
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Необработанные отзывы остаются 'pending' и подхватятся при следующем старте
+        self._queued.clear()
+        self._queue = None
+
+    def submit(self, review_id: int, text: str) -> bool:
+        """Ставит отзыв в очередь. False, если очередь переполнена или не запущена."""
+        if self._queue is None:
+            return False
+        if review_id in self._queued:
+            return True
+        try:
+            self._queue.put_nowait((review_id, text, time.monotonic()))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self._queued.add(review_id)
+        self.submitted += 1
+        return True
+
+    async def recover(self) -> int:
+        """Ставит в очередь 'pending' отзывы из БД, которых в ней ещё нет.
+
+        load_pending(limit) должен захватывать строки (см.
+        db.moderation.claim_pending_reviews): тогда при нескольких репликах
+        каждый отзыв уходит в модель только с одной из них. Захватывается не
+        больше, чем помещается в очередь.
+        """
+        free = None
+        if self._queue.maxsize:
+            free = self._queue.maxsize - self._queue.qsize()
+            if free <= 0:
+                return 0
+        rows = await self.load_pending(free)
+        return sum(1 for review_id, text in rows
+                   if review_id not in self._queued and self.submit(review_id, text))
+
+    async def _resweep(self):
+        while True:
+            try:
+                recovered = await self.recover()
+                if recovered:
+                    logger.info(f"Queued {recovered} pending reviews for moderation")
+            except Exception as e:
+                logger.error(f"Could not load pending reviews: {e}")
+            if self.verdict_cache is not None:
+                try:
+                    await self.verdict_cache.prune()
+                except Exception as e:
+                    logger.error(f"Could not prune verdict cache: {e}")
+            await asyncio.sleep(self.resweep_interval)
+
+    async def _next_batch(self) -> list:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_wait
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _worker(self):
+        while True:
+            batch = await self._next_batch()
+            self._in_flight += len(batch)
+            try:
+                await self._process(batch)
+            except Exception as e:
+                logger.error(f"Moderation batch failed: {e}")
+                self.failed += len(batch)
+                await self._release(batch)
+            finally:
+                self._in_flight -= len(batch)
+                for review_id, _, _ in batch:
+                    self._queued.discard(review_id)
+                    self._queue.task_done()
+
+    async def _release(self, batch: list):
+        if self.release_pending is None:
+            return
+        try:
+            await self.release_pending([review_id for review_id, _, _ in batch])
+        except Exception as e:
+            logger.error(f"Could not release moderation claims: {e}")
+
+    async def _with_retry(self, call, *args):
+        attempt = 0
+        while True:
+            try:
+                return await call(*args)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = min(self.max_backoff, self.retry_backoff * 2 ** attempt) * (0.5 + random.random())
+                logger.warning(f"{getattr(call, '__name__', call)} failed ({e}), retry in {delay:.1f}s")
+                self.retries += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def _classify(self, texts: dict) -> dict:
+        started = time.monotonic()
+        verdicts = await self.classifier.classify(texts)
+        self._classify_latency.append(time.monotonic() - started)
+        self.model_calls += 1
+        return verdicts
+
+    async def _verdicts(self, texts: dict) -> dict:
+        """Решения {review_id: verdict} для {review_id: текст}"""
+        if self.prefilter is None:
+            return await self._remote_verdicts(texts)
+
+        verdicts = {review_id: self.prefilter.decide(text).verdict for review_id, text in texts.items()}
+        escalated = {review_id: texts[review_id] for review_id, verdict in verdicts.items() if verdict is None}
+        self.prefiltered += len(texts) - len(escalated)
+        if escalated:
+            verdicts.update(await self._remote_verdicts(escalated))
+        return verdicts
+
+    async def _remote_verdicts(self, texts: dict) -> dict:
+        if self.verdict_cache is None:
+            return await self._with_retry(self._classify, texts)
+
+        keys = {review_id: text_hash(text) for review_id, text in texts.items()}
+        known = await self.verdict_cache.get_many(REVIEW_KIND, list(keys.values()))
+        self.cache_hits += sum(1 for key in keys.values() if key in known)
+
+        # Повторы текста внутри пачки уходят в модель один раз, под id первого отзыва
+        unknown = {}
+        for review_id, key in keys.items():
+            if key not in known and key not in unknown:
+                unknown[key] = review_id
+        if unknown:
+            remote = await self._with_retry(self._classify, {review_id: texts[review_id]
+                                                             for review_id in unknown.values()})
+            fresh = {key: remote[review_id] for key, review_id in unknown.items()}
+            await self.verdict_cache.put_many(REVIEW_KIND, fresh)
+            known.update(fresh)
+        return {review_id: known[key] for review_id, key in keys.items()}
+
+    async def _process(self, batch: list):
+        verdicts = await self._verdicts({review_id: text for review_id, text, _ in batch})
+        self.batches += 1
+        self.classified += len(batch)
+
+        result = await self._with_retry(self.apply_verdicts, verdicts)
+        self.approved += result["approved"]
+        self.rejected += result["rejected"]
+
+        now = time.monotonic()
+        self._end_to_end_latency.extend(now - enqueued_at for _, _, enqueued_at in batch)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "in_flight": self._in_flight,
+            "concurrency": self.concurrency,
+            "batch_size": self.batch_size,
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "model_calls": self.model_calls,
+            "cache_hits": self.cache_hits,
+            "prefiltered": self.prefiltered,
+            "classified": self.classified,
+            "avg_batch_size": round(self.classified / self.batches, 2) if self.batches else 0.0,
+            "approved": self.approved,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "retries": self.retries,
+            "classify_latency_p50": _percentile(self._classify_latency, 0.5),
+            "classify_latency_p95": _percentile(self._classify_latency, 0.95),
+            "end_to_end_latency_p50": _percentile(self._end_to_end_latency, 0.5),
+            "end_to_end_latency_p95": _percentile(self._end_to_end_latency, 0.95),
+            "verdict_cache": self.verdict_cache.stats() if self.verdict_cache is not None else None,
+            "prefilter": self.prefilter.stats() if self.prefilter is not None else None,
+        }
@@ -0,0 +1,114 @@
+import hashlib
+import logging
+import re
+import unicodedata
+
+from cache import MemoryCache
+
+logger = logging.getLogger(__name__)
+
+# Версия входит в ключ: при смене промпта или модели старые решения не используются
+REVIEW_KIND = "review:v2"
+IMAGE_KIND = "image:v1"
+
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def normalize_text(text: str) -> str:
+    """Приводит «Отлично!!!», «отлично» и « ОТЛИЧНО » к одному виду"""
+    text = unicodedata.normalize("NFKC", text or "").lower().replace("ё", "е")
+    return _NON_WORD.sub(" ", text).strip()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def bytes_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class VerdictCache:
+    """Решения модерации по хэшу содержимого: память процесса + таблица moderation_verdicts.
+
+    load(kind, hashes, ttl), store(kind, verdicts) и prune(ttl, max_entries) —
+    корутины работы с БД (db.moderation). Ошибки БД не мешают модерации:
+    промах просто уходит в модель.
+    """
+
+    def __init__(self, load, store, prune=None, ttl: float = 30 * 24 * 3600,
+                 max_entries: int = 100000, memory_entries: int = 10000):
+        self.load = load
+        self.store = store
+        self.prune_func = prune
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory = MemoryCache(max_entries=memory_entries, ttl=ttl)
+        self.lookups = 0
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.stored = 0
+        self.pruned = 0
+
+    async def get_many(self, kind: str, hashes: list) -> dict:
+        found = {}
+        missing = []
+        for h in set(hashes):
+            verdict = self.memory.get((kind, h))
+            if verdict is None:
+                missing.append(h)
+            else:
+                found[h] = verdict
+        self.memory_hits += len(found)
+
+        if missing:
+            try:
+                from_db = await self.load(kind, missing, self.ttl)
+            except Exception as e:
+                logger.warning(f"Could not load cached verdicts: {e}")
+                from_db = {}
+            for h, verdict in from_db.items():
+                self.memory.set((kind, h), verdict)
+            self.db_hits += len(from_db)
+            found.update(from_db)
+
+        self.lookups += len(set(hashes))
+        return found
+
+    async def get(self, kind: str, h: str):
+        return (await self.get_many(kind, [h])).get(h)
+
+    async def put_many(self, kind: str, verdicts: dict):
+        for h, verdict in verdicts.items():
+            self.memory.set((kind, h), verdict)
+        try:
+            if await self.store(kind, verdicts):
+                self.stored += len(verdicts)
+        except Exception as e:
+            logger.warning(f"Could not store verdicts: {e}")
+
+    async def put(self, kind: str, h: str, verdict: int):
+        await self.put_many(kind, {h: verdict})
+
+    async def prune(self) -> int:
+        if self.prune_func is None:
+            return 0
+        removed = await self.prune_func(self.ttl, self.max_entries)
+        self.pruned += removed
+        if removed:
+            logger.info(f"Pruned {removed} cached moderation verdicts")
+        return removed
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.db_hits
+        return {
+            "lookups": self.lookups,
+            "hits": hits,
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.lookups - hits,
+            "hit_ratio": round(hits / self.lookups, 4) if self.lookups else 0.0,
+            "stored": self.stored,
+            "pruned": self.pruned,
+            "memory": self.memory.stats(),
+        }
@@ -0,0 +1,136 @@
+import bisect
+import threading
+import time
+
+
+class RankIndex:
+    """Упорядоченный по рейтингу индекс пользователей в памяти процесса.
+
+    Ключи (-rating, id) лежат в отсортированном списке: место, топ-N и окно
+    вокруг пользователя — это bisect и срез, без обращения к базе. Изменения
+    рейтинга приходят точечно из функций, которые его меняют (после commit),
+    а load целиком перестраивает индекс из базы.
+
+    Место считается «спортивным» способом: у равных рейтингов одно место,
+    следующее за ними пропускает занятые (1, 2, 2, 4). Внутри равных порядок
+    по id, чтобы страницы были стабильными.
+
+    Пока идёт load, точечные изменения копятся в _pending и применяются
+    поверх загруженного снимка: снимок мог быть прочитан до их commit.
+    """
+
+    def __init__(self):
+        self._keys = []  # [(-rating, id)] по возрастанию
+        self._users = {}  # id -> {"id", "user_name", "rating", "user_photos"}
+        self._lock = threading.Lock()
+        self._pending = None
+        self.loaded_at = None
+        self.updates = 0
+        self.rebuilds = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self.loaded_at is not None
+
+    def begin_load(self):
+        with self._lock:
+            self._pending = {}
+
+    def load(self, users: list):
+        """Заменяет содержимое: users — словари с id, user_name, rating, user_photos"""
+        with self._lock:
+            by_id = {user["id"]: dict(user) for user in users}
+            for user_id, changes in (self._pending or {}).items():
+                self._merge(by_id, user_id, changes)
+            self._users = by_id
+            self._keys = sorted((-user["rating"], user_id) for user_id, user in by_id.items())
+            self._pending = None
+            self.loaded_at = time.monotonic()
+            self.rebuilds += 1
+
+    def abort_load(self):
+        with self._lock:
+            self._pending = None
+
+    @staticmethod
+    def _merge(users: dict, user_id: int, changes: dict):
+        changes = dict(changes)
+        if changes.pop("removed", False):
+            users.pop(user_id, None)
+            return
+        user = users.get(user_id)
+        if user is None:
+            if "rating" not in changes:
+                return
+            user = users[user_id] = {"id": user_id, "user_name": None, "rating": 0, "user_photos": None}
+        user.update(changes)
+
+    def update(self, user_id: int, **changes):
+        """Точечное изменение: rating, user_name, user_photos или removed=True (бан)"""
+        with self._lock:
+            if self._pending is not None:
+                pending = self._pending.setdefault(user_id, {})
+                if changes.get("removed"):
+                    pending.clear()
+                pending.update(changes)
+            if not self.loaded:
+                return
+            self.updates += 1
+            old = self._users.get(user_id)
+            if old is not None and ("rating" in changes or changes.get("removed")):
+                self._remove_key(-old["rating"], user_id)
+            self._merge(self._users, user_id, changes)
+            new = self._users.get(user_id)
+            if new is not None and (old is None or "rating" in changes):
+                bisect.insort(self._keys, (-new["rating"], user_id))
+
+    def _remove_key(self, neg_rating, user_id: int):
+        position = bisect.bisect_left(self._keys, (neg_rating, user_id))
+        if position < len(self._keys) and self._keys[position] == (neg_rating, user_id):
+            del self._keys[position]
+
+    def _slice(self, start: int, end: int) -> list:
+        out = []
+        rank = None
+        for position in range(start, end):
+            neg_rating, user_id = self._keys[position]
+            if rank is None or neg_rating != self._keys[position - 1][0]:
+                # Место — число пользователей со строго бо́льшим рейтингом + 1
+                rank = position + 1 if rank is not None else bisect.bisect_left(self._keys, (neg_rating,)) + 1
+            out.append({**self._users[user_id], "rank": rank})
+        return out
+
+    def top(self, limit: int, offset: int = 0) -> list:
+        with self._lock:
+            return self._slice(offset, min(offset + limit, len(self._keys)))
+
+    def rank(self, user_id: int):
+        """Запись пользователя с местом или None, если его нет в рейтинге"""
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                return None
+            position = bisect.bisect_left(self._keys, (-user["rating"], user_id))
+            return self._slice(position, position + 1)[0]
+
+    def around(self, user_id: int, radius: int) -> list:
+        """radius соседей выше и ниже пользователя вместе с ним"""
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                return []
+            position = bisect.bisect_left(self._keys, (-user["rating"], user_id))
+            return self._slice(max(position - radius, 0), min(position + radius + 1, len(self._keys)))
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self._keys),
+                "loaded": self.loaded,
+                "age": round(time.monotonic() - self.loaded_at, 1) if self.loaded else None,
+                "updates": self.updates,
+                "rebuilds": self.rebuilds,
+            }
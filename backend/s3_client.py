@@ -1,37 +1,143 @@
+import asyncio
+import hashlib
 import json
 import logging
-import mimetypes
+import re
+import threading
 import uuid
-from datetime import timedelta
-from io import BytesIO
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
 
+import certifi
+import urllib3
 from minio import Minio
+from minio.datatypes import PostPolicy
+from minio.deleteobjects import DeleteObject
 from minio.error import S3Error
 
 import config
 
-logger = logging.getLogger(__name__)
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("app.log"),
-        logging.StreamHandler()
-    ]
+# Больше фото не принимаем; лимит проверяется по мере чтения тела запроса
+PHOTO_MAX_UPLOAD_SIZE = getattr(config, 'PHOTO_MAX_UPLOAD_SIZE', 20 * 1024 * 1024)
+# Размер части multipart-загрузки (минимум S3 — 5 МиБ). Столько MinIO-клиент
+# держит в памяти на одну загрузку, независимо от размера файла.
+PHOTO_UPLOAD_PART_SIZE = getattr(config, 'PHOTO_UPLOAD_PART_SIZE', 5 * 1024 * 1024)
+
+# Сигнатуры форматов: (mime, расширение, проверка первых байт)
+IMAGE_SIGNATURES = [
+    ("image/png", "png", lambda head: head.startswith(b"\x89PNG\r\n\x1a\n")),
+    ("image/jpeg", "jpg", lambda head: head.startswith(b"\xff\xd8\xff")),
+    ("image/gif", "gif", lambda head: head[:6] in (b"GIF87a", b"GIF89a")),
+    ("image/webp", "webp", lambda head: head[:4] == b"RIFF" and head[8:12] == b"WEBP"),
+    ("image/bmp", "bmp", lambda head: head.startswith(b"BM")),
+    ("image/svg+xml", "svg", lambda head: head.lstrip()[:5].lower() in (b"<svg ", b"<?xml")),
+]
+SNIFF_BYTES = 16
+
+# Сколько секунд действует presigned POST для прямой загрузки в MinIO
+PHOTO_PRESIGN_EXPIRES = getattr(config, 'PHOTO_PRESIGN_EXPIRES', 600)
+PRESIGN_CONTENT_TYPES = {mime_type: extension for mime_type, extension, _ in IMAGE_SIGNATURES}
+# Только оригиналы, выданные presign_photo_upload: не варианты и не чужие префиксы
+_UPLOADED_OBJECT = re.compile(
+    r"^reviews/[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.(?:"
+    + "|".join(PRESIGN_CONTENT_TYPES.values()) + r")$"
 )
 
+# Соединений с MinIO в пуле общего клиента: не меньше, чем одновременных загрузок
+S3_POOL_MAXSIZE = getattr(config, 'S3_POOL_MAXSIZE', 32)
+S3_CONNECT_TIMEOUT = getattr(config, 'S3_CONNECT_TIMEOUT', 5.0)
+S3_READ_TIMEOUT = getattr(config, 'S3_READ_TIMEOUT', 60.0)
 
-def get_minio_client() -> Minio:
-    client = Minio(
-        config.MINIO_ENDPOINT,
-        access_key=config.MINIO_ACCESS_KEY,
-        secret_key=config.MINIO_SECRET_KEY,
-        secure=config.MINIO_SECURE
+_client = None
+_http_pool = None
+_signing_client = None
+_client_lock = threading.Lock()
+_bucket_ready = False
+
+logger = logging.getLogger(__name__)
+
+
+def _http_client() -> urllib3.PoolManager:
+    return urllib3.PoolManager(
+        maxsize=S3_POOL_MAXSIZE,
+        block=False,
+        timeout=urllib3.Timeout(connect=S3_CONNECT_TIMEOUT, read=S3_READ_TIMEOUT),
+        retries=urllib3.Retry(total=3, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+        cert_reqs="CERT_REQUIRED",
+        ca_certs=certifi.where(),
     )
-    return client
+
+
+def get_minio_client() -> Minio:
+    """Общий на процесс клиент MinIO с пулом keep-alive соединений"""
+    global _client, _http_pool
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _http_pool = _http_client()
+                _client = Minio(
+                    config.MINIO_ENDPOINT,
+                    access_key=config.MINIO_ACCESS_KEY,
+                    secret_key=config.MINIO_SECRET_KEY,
+                    secure=config.MINIO_SECURE,
+                    region=getattr(config, 'MINIO_REGION', None),
+                    http_client=_http_pool,
+                )
+    return _client
+
+
+def get_signing_client() -> Minio:
+    """Клиент только для подписи URL, в сеть не ходит.
+
+    Хост входит в подпись, поэтому URL подписывается на публичный адрес
+    MinIO (MINIO_PUBLIC_URL), по которому его откроет браузер, а не на
+    внутренний MINIO_ENDPOINT. Регион задан явно, иначе клиент запросил бы
+    его у бакета.
+    """
+    global _signing_client
+    if _signing_client is None:
+        with _client_lock:
+            if _signing_client is None:
+                public = urlsplit(config.MINIO_PUBLIC_URL)
+                _signing_client = Minio(
+                    public.netloc,
+                    access_key=config.MINIO_ACCESS_KEY,
+                    secret_key=config.MINIO_SECRET_KEY,
+                    secure=public.scheme == "https",
+                    region=getattr(config, 'MINIO_REGION', None) or "us-east-1",
+                )
+    return _signing_client
+
+
+def close_minio_client():
+    global _client, _http_pool, _signing_client
+    with _client_lock:
+        if _http_pool is not None:
+            # Пул создан нами и передан клиенту — закрываем его соединения сами
+            _http_pool.clear()
+            _http_pool = None
+        _client = None
+        _signing_client = None
+
+
+def bucket_ready() -> bool:
+    return _bucket_ready
+
+
+def reconcile_bucket():
+    """Принудительно проверяет бакет и заново применяет политику доступа"""
+    global _bucket_ready
+    _bucket_ready = False
+    ensure_bucket_exists()
 
 
 def ensure_bucket_exists():
+    """Создаёт бакет и политику публичного чтения.
+
+    Вызывается при старте (main.py) и при явной сверке; загрузки сами его
+    не вызывают, если бакет уже подготовлен.
+    """
+    global _bucket_ready
     try:
         client = get_minio_client()
         if not client.bucket_exists(config.MINIO_BUCKET):
@@ -44,6 +150,7 @@ def ensure_bucket_exists():
                 set_bucket_public_policy()
             except Exception as e:
                 logger.warning(f"Could not set bucket policy: {e}")
+        _bucket_ready = True
     except S3Error as e:
         logger.error(f"Error ensuring bucket exists: {e}")
         raise
@@ -69,35 +176,35 @@ def set_bucket_public_policy():
         logger.warning(f"Could not set bucket policy (may need manual setup): {e}")
 
 
-def upload_photo(file_data: bytes, file_extension: str = "jpg") -> str:
-    try:
-        client = get_minio_client()
+def _ensure_bucket_once():
+    # Если при старте MinIO был недоступен, бакет готовит первая загрузка
+    if not _bucket_ready:
         ensure_bucket_exists()
-        file_name = f"{uuid.uuid4()}.{file_extension}"
-        object_name = f"reviews/{file_name}"
-        file_stream = BytesIO(file_data)
-        file_size = len(file_data)
-        mime_type, _ = mimetypes.guess_type(f"file.{file_extension}")
-        if not mime_type:
-            mime_type = f"image/{file_extension}"
-
-        client.put_object(
-            config.MINIO_BUCKET,
-            object_name,
-            file_stream,
-            file_size,
-            content_type=mime_type
-        )
 
-        protocol = "https" if config.MINIO_SECURE else "http"
-        public_url = f"{config.MINIO_PUBLIC_URL}/{config.MINIO_BUCKET}/{object_name}"
 
-        logger.info(f"Photo uploaded successfully: {object_name}")
-        return public_url
+def public_url(object_name: str) -> str:
+    return f"{config.MINIO_PUBLIC_URL}/{config.MINIO_BUCKET}/{object_name}"
+
+
+def delete_object(object_name: str):
+    get_minio_client().remove_object(config.MINIO_BUCKET, object_name)
 
-    except S3Error as e:
-        logger.error(f"Error uploading photo to MinIO: {e}")
-        raise
+
+def delete_objects(object_names: list) -> list:
+    """Удаляет объекты пачками по 1000 за запрос; возвращает имена, которые удалить не удалось"""
+    client = get_minio_client()
+    failed = []
+    for start in range(0, len(object_names), 1000):
+        batch = [DeleteObject(name) for name in object_names[start:start + 1000]]
+        try:
+            # Ошибки приходят лениво: без перебора запрос не отправляется
+            for error in client.remove_objects(config.MINIO_BUCKET, batch):
+                logger.warning(f"Could not delete {error.name}: {error.message}")
+                failed.append(error.name)
+        except S3Error as e:
+            logger.error(f"Error deleting objects: {e}")
+            failed.extend(item.name for item in batch)
+    return failed
 
 
 def get_photo_url(object_name: str) -> str:
@@ -112,3 +219,218 @@ def get_photo_url(object_name: str) -> str:
     except S3Error as e:
         logger.error(f"Error getting photo URL: {e}")
         raise
+
+
+class UploadError(Exception):
+    pass
+
+
+class EmptyUpload(UploadError):
+    pass
+
+
+class UploadTooLarge(UploadError):
+    pass
+
+
+class UnsupportedImage(UploadError):
+    pass
+
+
+class MissingUpload(UploadError):
+    pass
+
+
+def sniff_image_type(head: bytes):
+    """(mime, расширение) по первым байтам файла или None"""
+    for mime_type, extension, matches in IMAGE_SIGNATURES:
+        if matches(head):
+            return mime_type, extension
+    return None
+
+
+class _StreamReader:
+    """Файлоподобный объект для put_object поверх asyncio-очереди.
+
+    Читается из потока MinIO-клиента, а наполняется из event loop, поэтому в
+    памяти одновременно не больше пары чанков тела запроса сверх буфера части.
+    """
+
+    def __init__(self, loop, queue: asyncio.Queue, head: bytes):
+        self._loop = loop
+        self._queue = queue
+        self._buffer = bytearray(head)
+        self._eof = False
+
+    def _next_chunk(self):
+        chunk = asyncio.run_coroutine_threadsafe(self._queue.get(), self._loop).result()
+        if isinstance(chunk, BaseException):
+            raise chunk
+        return chunk
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            chunk = self._next_chunk()
+            if chunk is None:
+                self._eof = True
+            else:
+                self._buffer.extend(chunk)
+        if size < 0 or size >= len(self._buffer):
+            data, self._buffer = bytes(self._buffer), bytearray()
+        else:
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+        return data
+
+
+def presign_photo_upload(content_type: str) -> dict:
+    """Выдаёт presigned POST, по которому клиент загружает фото прямо в MinIO.
+
+    Политика POST фиксирует имя объекта и Content-Type и ограничивает размер
+    PHOTO_MAX_UPLOAD_SIZE — presigned PUT размер ограничить не может. Клиент
+    отправляет multipart/form-data на upload_url: все поля из fields, файл
+    последним полем file. После загрузки клиент вызывает /photo/complete с
+    object_name: до этого объект не зарегистрирован и вариантов у него нет.
+    """
+    mime_type = (content_type or "").split(";")[0].strip().lower()
+    file_extension = PRESIGN_CONTENT_TYPES.get(mime_type)
+    if file_extension is None:
+        raise UnsupportedImage(f"Unsupported content type: {content_type}")
+    _ensure_bucket_once()
+    object_name = f"reviews/{uuid.uuid4()}.{file_extension}"
+    policy = PostPolicy(
+        config.MINIO_BUCKET,
+        datetime.now(timezone.utc) + timedelta(seconds=PHOTO_PRESIGN_EXPIRES),
+    )
+    policy.add_equals_condition("key", object_name)
+    policy.add_equals_condition("Content-Type", mime_type)
+    policy.add_content_length_range_condition(1, PHOTO_MAX_UPLOAD_SIZE)
+    fields = get_signing_client().presigned_post_policy(policy)
+    return {
+        "object_name": object_name,
+        "upload_url": f"{config.MINIO_PUBLIC_URL}/{config.MINIO_BUCKET}",
+        "method": "POST",
+        "fields": {"key": object_name, "Content-Type": mime_type, **fields},
+        "max_size": PHOTO_MAX_UPLOAD_SIZE,
+        "expires_in": PHOTO_PRESIGN_EXPIRES,
+    }
+
+
+def verify_uploaded_photo(object_name: str, max_size: int = PHOTO_MAX_UPLOAD_SIZE) -> str:
+    """Проверяет объект, загруженный по presigned URL; возвращает его mime.
+
+    Размер ограничивает уже политика POST, но содержимое она не проверяет,
+    поэтому здесь повторяются проверки upload_photo_stream: размер по
+    stat_object и тип по первым байтам. Не прошедший проверку объект удаляется.
+    """
+    if not _UPLOADED_OBJECT.match(object_name or ""):
+        raise MissingUpload(f"Unknown object: {object_name}")
+    client = get_minio_client()
+    try:
+        stat = client.stat_object(config.MINIO_BUCKET, object_name)
+    except S3Error as e:
+        if e.code in ("NoSuchKey", "NoSuchObject", "ResourceNotFound"):
+            raise MissingUpload(f"Object {object_name} was not uploaded")
+        raise
+
+    if not stat.size:
+        delete_object(object_name)
+        raise EmptyUpload("No file data provided")
+    if stat.size > max_size:
+        delete_object(object_name)
+        raise UploadTooLarge(f"Photo is larger than {max_size} bytes")
+
+    response = client.get_object(config.MINIO_BUCKET, object_name, offset=0, length=SNIFF_BYTES)
+    try:
+        head = response.read()
+    finally:
+        response.close()
+        response.release_conn()
+
+    sniffed = sniff_image_type(head)
+    # Расширение выбрано при выдаче URL — содержимое должно ему соответствовать
+    if sniffed is None or sniffed[1] != object_name.rsplit(".", 1)[-1]:
+        delete_object(object_name)
+        raise UnsupportedImage("Unsupported image format")
+
+    logger.info(f"Photo uploaded directly: {object_name} ({stat.size} bytes)")
+    return sniffed[0]
+
+
+async def upload_photo_stream(chunks, max_size: int = PHOTO_MAX_UPLOAD_SIZE) -> tuple:
+    """Потоковая загрузка фото из асинхронного итератора чанков (request.stream()).
+    Возвращает (имя объекта в бакете, sha256 содержимого, размер).
+
+    Тип определяется по первым байтам, размер проверяется по мере чтения.
+    Тело целиком в памяти не собирается: чанки через очередь уходят в
+    multipart-загрузку, которую MinIO-клиент ведёт в отдельном потоке.
+    Хэш считается по тем же чанкам — имя объекта до конца загрузки
+    неизвестно, поэтому дубликаты находит таблица photo_objects.
+    """
+    chunks = chunks.__aiter__()
+    head = b""
+    total = 0
+    try:
+        while len(head) < SNIFF_BYTES:
+            chunk = await chunks.__anext__()
+            head += chunk
+    except StopAsyncIteration:
+        pass
+    total = len(head)
+    if not head:
+        raise EmptyUpload("No file data provided")
+    if total > max_size:
+        raise UploadTooLarge(f"Photo is larger than {max_size} bytes")
+
+    sniffed = sniff_image_type(head)
+    if sniffed is None:
+        raise UnsupportedImage("Unsupported image format")
+    mime_type, file_extension = sniffed
+    digest = hashlib.sha256(head)
+
+    client = get_minio_client()
+    if not _bucket_ready:
+        await asyncio.to_thread(_ensure_bucket_once)
+    object_name = f"reviews/{uuid.uuid4()}.{file_extension}"
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=2)
+    reader = _StreamReader(loop, queue, head)
+    upload = asyncio.create_task(asyncio.to_thread(
+        client.put_object,
+        config.MINIO_BUCKET,
+        object_name,
+        reader,
+        length=-1,
+        part_size=PHOTO_UPLOAD_PART_SIZE,
+        content_type=mime_type,
+    ))
+
+    try:
+        async for chunk in chunks:
+            total += len(chunk)
+            if total > max_size:
+                raise UploadTooLarge(f"Photo is larger than {max_size} bytes")
+            digest.update(chunk)
+            await _put_or_fail(queue, chunk, upload)
+        await _put_or_fail(queue, None, upload)
+        await upload
+    except BaseException as e:
+        if not upload.done():
+            # Ошибка в потоке чтения прерывает multipart-загрузку на стороне MinIO
+            await queue.put(e if isinstance(e, Exception) else UploadError("Upload cancelled"))
+            await asyncio.gather(upload, return_exceptions=True)
+        raise
+
+    logger.info(f"Photo uploaded successfully: {object_name} ({total} bytes)")
+    return object_name, digest.hexdigest(), total
+
+
+async def _put_or_fail(queue: asyncio.Queue, item, upload: asyncio.Task):
+    # Если загрузка упала, поток больше не читает очередь — не ждём место в ней вечно
+    put = asyncio.ensure_future(queue.put(item))
+    await asyncio.wait({put, upload}, return_when=asyncio.FIRST_COMPLETED)
+    if not put.done():
+        put.cancel()
+        await upload
+        raise UploadError("Upload finished before the request body was consumed")
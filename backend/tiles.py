@@ -0,0 +1,256 @@
+import logging
+import math
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+import config
+
+logger = logging.getLogger(__name__)
+
+TILE_EXTENT = 4096
+# Точки у края тайла попадают и в соседний, чтобы маркер не обрезался на стыке
+TILE_BUFFER = 64
+TILE_MAX_ZOOM = getattr(config, 'TILE_MAX_ZOOM', 18)
+TILE_LAYER = "places"
+
+
+# --- Web Mercator ---
+
+def tile_bounds(z: int, x: int, y: int, buffer: int = 0) -> tuple:
+    """Границы тайла (min_lon, min_lat, max_lon, max_lat) с запасом buffer в единицах extent"""
+    n = 2 ** z
+    pad = buffer / TILE_EXTENT
+
+    def lon(tx):
+        return tx / n * 360.0 - 180.0
+
+    def lat(ty):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return lon(x - pad), lat(y + 1 + pad), lon(x + 1 + pad), lat(y - pad)
+
+
+def _world(lat: float, lon: float, z: int) -> tuple:
+    n = 2 ** z
+    lat = max(min(lat, 85.0511), -85.0511)
+    wx = (lon + 180.0) / 360.0 * n
+    wy = (1 - math.log(math.tan(math.radians(lat)) + 1 / math.cos(math.radians(lat))) / math.pi) / 2 * n
+    return wx, wy
+
+
+def tiles_for_point(lat: float, lon: float, min_zoom: int = 0, max_zoom: int = TILE_MAX_ZOOM) -> list:
+    """Все тайлы, в которые (с учётом буфера) попадает точка"""
+    pad = TILE_BUFFER / TILE_EXTENT
+    out = []
+    for z in range(min_zoom, max_zoom + 1):
+        n = 2 ** z
+        wx, wy = _world(lat, lon, z)
+        xs = {min(max(int(math.floor(wx + d)), 0), n - 1) for d in (-pad, pad)}
+        ys = {min(max(int(math.floor(wy + d)), 0), n - 1) for d in (-pad, pad)}
+        out.extend((z, x, y) for x in xs for y in ys)
+    return out
+
+
+# --- Mapbox Vector Tile (protobuf) ---
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        bits = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(bits | 0x80)
+        else:
+            out.append(bits)
+            return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _key(field: int, wire_type: int) -> bytes:
+    return _varint((field << 3) | wire_type)
+
+
+def _bytes_field(field: int, data: bytes) -> bytes:
+    return _key(field, 2) + _varint(len(data)) + data
+
+
+def _packed(field: int, values: list) -> bytes:
+    return _bytes_field(field, b"".join(_varint(v) for v in values))
+
+
+def _value(value) -> bytes:
+    if isinstance(value, bool):
+        return _key(7, 0) + _varint(int(value))
+    if isinstance(value, int):
+        return _key(6, 0) + _varint(_zigzag(value))
+    if isinstance(value, float):
+        return _key(3, 1) + struct.pack("<d", value)
+    return _bytes_field(1, str(value).encode("utf-8"))
+
+
+def encode_tile(z: int, x: int, y: int, features: list) -> bytes:
+    """Кодирует точки в тайл MVT с одним слоем places.
+
+    features — словари с id, coord1 (широта), coord2 (долгота) и свойствами.
+    Свойства со значением None пропускаются.
+    """
+    keys, key_index = [], {}
+    values, value_index = [], {}
+    encoded = []
+
+    for feature in features:
+        wx, wy = _world(feature["coord1"], feature["coord2"], z)
+        px = int(round((wx - x) * TILE_EXTENT))
+        py = int(round((wy - y) * TILE_EXTENT))
+
+        tags = []
+        for name, value in feature.items():
+            if name in ("id", "coord1", "coord2") or value is None:
+                continue
+            if name not in key_index:
+                key_index[name] = len(keys)
+                keys.append(name)
+            value_key = (type(value).__name__, value)
+            if value_key not in value_index:
+                value_index[value_key] = len(values)
+                values.append(value)
+            tags.extend((key_index[name], value_index[value_key]))
+
+        body = _key(1, 0) + _varint(feature["id"])
+        if tags:
+            body += _packed(2, tags)
+        body += _key(3, 0) + _varint(1)  # POINT
+        body += _packed(4, [(1 & 0x7) | (1 << 3), _zigzag(px), _zigzag(py)])  # MoveTo(1)
+        encoded.append(_bytes_field(2, body))
+
+    layer = _key(15, 0) + _varint(2) + _bytes_field(1, TILE_LAYER.encode("utf-8"))
+    layer += b"".join(encoded)
+    layer += b"".join(_bytes_field(3, k.encode("utf-8")) for k in keys)
+    layer += b"".join(_bytes_field(4, _value(v)) for v in values)
+    layer += _key(5, 0) + _varint(TILE_EXTENT)
+    return _bytes_field(3, layer)
+
+
+# --- Кэш тайлов: память + диск ---
+
+class TileCache:
+    def __init__(self, max_entries: int = 2048, directory: str = None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Растёт при каждой инвалидации: тайл, собранный до неё, в кэш не кладётся
+        self.generation = 0
+
+    def _path(self, key: tuple) -> str:
+        z, x, y = key
+        return os.path.join(self.directory, str(z), str(x), f"{y}.pbf")
+
+    def get_memory(self, key: tuple):
+        """Только память, без обращения к диску: безопасно вызывать из event loop"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+            return data
+
+    def get(self, key: tuple):
+        """Память, затем диск; блокирует на чтении файла"""
+        data = self.get_memory(key)
+        if data is not None:
+            return data
+        if self.directory:
+            try:
+                with open(self._path(key), "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                data = None
+            if data is not None:
+                self._remember(key, data)
+                with self._lock:
+                    self.disk_hits += 1
+                return data
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _remember(self, key: tuple, data: bytes):
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def put(self, key: tuple, data: bytes, generation: int = None):
+        if generation is not None and generation != self.generation:
+            return
+        self._remember(key, data)
+        if self.directory:
+            path = self._path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            except OSError as e:
+                logger.warning(f"Could not write tile {key} to disk: {e}")
+
+    def invalidate(self, keys: list):
+        with self._lock:
+            for key in keys:
+                self._memory.pop(key, None)
+            self.invalidations += len(keys)
+            self.generation += 1
+        if self.directory:
+            for key in keys:
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning(f"Could not remove tile {key} from disk: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self.generation += 1
+        if self.directory and os.path.isdir(self.directory):
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if name.endswith(".pbf"):
+                        os.remove(os.path.join(root, name))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
+
+
+tile_cache = TileCache(
+    max_entries=getattr(config, 'TILE_CACHE_MAX_ENTRIES', 2048),
+    directory=getattr(config, 'TILE_CACHE_DIR', "tile_cache"),
+)
+
+
+def invalidate_place(lat, lon):
+    """Сбрасывает все тайлы, в которых может быть нарисовано место"""
+    if lat is None or lon is None:
+        return
+    tile_cache.invalidate(tiles_for_point(lat, lon))